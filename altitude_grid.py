@@ -0,0 +1,396 @@
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+
+import numpy as np
+import shapely
+
+from rings import range_per_foot
+from task_analysis import altitudes_required, TASK_SEARCH_RADIUS_NM, NM_PER_DEGREE_LAT
+
+# Directory of precomputed altitude grids and their manifest; the grids are off when unset
+ALTITUDE_GRID_DIR = os.environ.get('ALTITUDE_GRID_DIR')
+
+MANIFEST_FILE = 'manifest.json'
+GRID_EXTENSION = '.npy'
+# Grid points per side of the tiles a grid is computed in
+GRID_TILE = 32
+# Decimal places kept in contour coordinates; 5 places is about 1 m
+CONTOUR_PRECISION = 5
+
+
+def glider_class(glide_ratio, vg, glide_step, vg_step):
+    """
+    Return the class of a glider: its glide ratio rounded down to a multiple of glide_step and
+    its best glide speed rounded to the nearest multiple of vg_step. The grid of a class is
+    computed for the worst case over every glider in it (see worst_range_per_foot), so the
+    rounding never under-states the altitude required.
+    """
+    return (float(math.floor(glide_ratio / glide_step) * glide_step),
+            float(round(vg / vg_step) * vg_step))
+
+
+def wind_bucket(wind_speed, wind_direction, speeds, directions):
+    """
+    Return the precomputed wind whose grid covers a wind: the smallest of speeds at or above
+    wind_speed and, unless that is calm, the nearest of directions around the compass.
+
+    Returns:
+    tuple: (speed, direction, exceeded), where exceeded is True when wind_speed is above the
+    largest of speeds, whose grid is then used although it does not cover the wind.
+    """
+    speeds = sorted(speeds)
+    above = [value for value in speeds if value >= wind_speed]
+    speed = above[0] if above else speeds[-1]
+    if speed == 0:
+        return 0.0, 0.0, False
+    direction = min(directions, key=lambda value: abs((value - wind_direction + 180) % 360 - 180))
+    return float(speed), float(direction), not above
+
+
+def wind_cell(speed, direction, speeds, directions):
+    """
+    Return the winds a bucket's grid stands for: the speeds above the next lower bucket up to
+    speed, and the directions from halfway to the previous bucket to halfway to the next one.
+
+    Returns:
+    tuple: (lowest speed, highest speed, first direction, last direction) in knots and degrees,
+    the directions clockwise.
+    """
+    speeds = sorted(speeds)
+    lower = [value for value in speeds if value < speed]
+    speed_low = lower[-1] if lower else 0.0
+    if speed == 0:
+        return 0.0, 0.0, 0.0, 0.0
+    offsets = sorted(offset for offset in ((value - direction) % 360 for value in directions)
+                     if offset != 0)
+    if not offsets:
+        return float(speed_low), float(speed), float(direction - 180), float(direction + 180)
+    # Half the gap to the next bucket clockwise and to the previous one
+    return (float(speed_low), float(speed), float(direction - (360 - offsets[-1]) / 2),
+            float(direction + offsets[0] / 2))
+
+
+def worst_range_per_foot(glide_ratio, safety_margin, vg_low, vg_high, speed_low, speed_high,
+                         direction_first, direction_last, headings):
+    """
+    Return, for every heading, the smallest range per foot of rings.range_per_foot over every
+    best glide speed in [vg_low, vg_high] and every wind from speed_low to speed_high knots
+    and from direction_first clockwise to direction_last.
+
+    The glide model only uses the wind component along the heading, Vw = -w cos(d - h). The
+    largest one over the winds comes from the direction nearest to h + 180 and from the
+    highest speed when it slows the glider (the lowest when it helps). A slowing wind costs
+    most at the lowest best glide speed and a helping one helps least at the highest.
+
+    Returns:
+    array, shape (H,).
+    """
+    headings = np.asarray(headings, dtype=np.float64)
+    width = min(direction_last - direction_first, 360.0)
+    # Angle from h + 180 to the nearest direction of the sector
+    into = (headings + 180 - direction_first) % 360
+    distance = np.where(into <= width, 0.0, np.minimum(into - width, 360 - into))
+    component = np.cos(np.radians(distance))
+    wind = np.where(component >= 0, speed_high, speed_low) * component
+    vg = np.where(component >= 0, vg_low, vg_high)
+    # A wind from 180 degrees has its whole speed along heading 0
+    return range_per_foot(glide_ratio, safety_margin, vg, wind, np.full(headings.shape, 180.0),
+                          [0.0])[:, 0]
+
+
+def region_bounds(turnpoints, region, margin_nm):
+    """
+    Return the (south, west, north, east) box around the landable turnpoints of a region, grown by
+    margin_nm, or None if it has none.
+    """
+    rows = np.flatnonzero((turnpoints.region_ids == turnpoints.region_names.index(region))
+                          & turnpoints.landable)
+    if rows.size == 0:
+        return None
+    lats, lons = turnpoints.lats[rows], turnpoints.lons[rows]
+    dlat = margin_nm / NM_PER_DEGREE_LAT
+    south, north = max(lats.min() - dlat, -90.0), min(lats.max() + dlat, 90.0)
+    dlon = margin_nm / (NM_PER_DEGREE_LAT * max(math.cos(math.radians(max(abs(south), abs(north)))),
+                                                1e-6))
+    return south, max(lons.min() - dlon, -180.0), north, min(lons.max() + dlon, 180.0)
+
+
+def grid_axes(bounds, step_nm):
+    """
+    Return the latitudes and longitudes of a grid over bounds with points about step_nm apart.
+    """
+    south, west, north, east = bounds
+    dlat = step_nm / NM_PER_DEGREE_LAT
+    dlon = dlat / max(math.cos(math.radians((south + north) / 2)), 1e-6)
+    return (south + dlat * np.arange(int(math.ceil((north - south) / dlat)) + 1),
+            west + dlon * np.arange(int(math.ceil((east - west) / dlon)) + 1))
+
+
+def compute_grid(turnpoints, lats, lons, unit_range, arrival_altitude_agl,
+                 radius_nm=TASK_SEARCH_RADIUS_NM):
+    """
+    Return the altitude in feet MSL required to reach the best landable turnpoint from every
+    point of a lat x lon grid, NaN where none is within radius_nm.
+
+    The grid is evaluated tile by tile, so that every tile only looks at the turnpoints within
+    radius_nm of it rather than at those of the whole region.
+
+    Parameters:
+    unit_range (function): headings -> range per foot in nautical miles, normally
+      worst_range_per_foot for a glider class and wind bucket.
+
+    Returns:
+    array, shape (len(lats), len(lons)), float32.
+    """
+    values = np.empty((len(lats), len(lons)), dtype=np.float32)
+    for row in range(0, len(lats), GRID_TILE):
+        for column in range(0, len(lons), GRID_TILE):
+            tile_lats, tile_lons = np.meshgrid(lats[row:row + GRID_TILE],
+                                               lons[column:column + GRID_TILE], indexing='ij')
+            required, _ = altitudes_required(turnpoints, tile_lats.ravel(), tile_lons.ravel(),
+                                             None, None, None, None, None, arrival_altitude_agl,
+                                             radius_nm, unit_range=unit_range)
+            required[~np.isfinite(required)] = np.nan
+            values[row:row + GRID_TILE, column:column + GRID_TILE] = \
+                required.reshape(tile_lats.shape)
+    return values
+
+
+def class_range(glide_ratio, vg, safety_margin, wind_speed, wind_direction, manifest):
+    """
+    Return the headings -> range per foot function of the grid of a glider class and wind
+    bucket: the worst case over every glider of the class and every wind of the bucket.
+
+    Parameters:
+    manifest (dict): The glide_step, vg_step, wind_speeds and wind_directions of the grids.
+    """
+    half_step = manifest['vg_step'] / 2
+    cell = wind_cell(wind_speed, wind_direction, manifest['wind_speeds'],
+                     manifest['wind_directions'])
+
+    def unit_range(headings):
+        return worst_range_per_foot(glide_ratio, safety_margin, max(vg - half_step, 1e-6),
+                                    vg + half_step, *cell, headings)
+    return unit_range
+
+
+def grid_file_name(entry):
+    """
+    Return the file name of a grid from its manifest entry.
+    """
+    region = re.sub(r'[^a-z0-9]+', '-', entry['region'].lower()).strip('-')
+    return '%s-ld%g-vg%g-sm%g-arr%g-w%g-%g%s' % (
+        region, entry['glide_ratio'], entry['vg'], entry['safety_margin'] * 100,
+        entry['arrival_altitude'], entry['wind_speed'], entry['wind_direction'], GRID_EXTENSION)
+
+
+def _replace(path, write):
+    """
+    Write a file next to path with write(file) and move it into place, so a running app never
+    maps a partial file.
+    """
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as file:
+            write(file)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def write_grids(directory, grids, settings):
+    """
+    Write computed grids and their manifest to a directory.
+
+    Parameters:
+    directory (str): Where the .npy grids and manifest.json go.
+    grids (list): (entry, array) pairs; an entry describes its grid (region, glide_ratio, vg,
+      safety_margin, arrival_altitude, wind_speed, wind_direction, south, west, dlat, dlon).
+    settings (dict): How the grids were computed (glide_step, vg_step, wind speeds and
+      directions, step_nm, radius_nm), stored in the manifest for the lookups.
+    """
+    os.makedirs(directory, exist_ok=True)
+    entries = []
+    for entry, array in grids:
+        entry = dict(entry, file=grid_file_name(entry), shape=list(array.shape))
+        _replace(os.path.join(directory, entry['file']),
+                 lambda file: np.save(file, np.ascontiguousarray(array, dtype='<f4')))
+        entries.append(entry)
+    manifest = dict(settings, grids=entries)
+    _replace(os.path.join(directory, MANIFEST_FILE),
+             lambda file: file.write(json.dumps(manifest, indent=1).encode('utf-8')))
+
+
+class AltitudeGrid:
+    """
+    One precomputed grid of the altitude required to reach a landable turnpoint, memory-mapped
+    from its .npy file.
+    """
+
+    def __init__(self, entry, values, version=None):
+        self.entry = entry
+        self.values = values
+        self.version = version
+        self.south, self.west = entry['south'], entry['west']
+        self.dlat, self.dlon = entry['dlat'], entry['dlon']
+
+    @property
+    def bounds(self):
+        rows, columns = self.values.shape
+        return (self.south, self.west, self.south + self.dlat * (rows - 1),
+                self.west + self.dlon * (columns - 1))
+
+    def value_at(self, lat, lon):
+        """
+        Return the altitude required at the grid point nearest to (lat, lon), or None outside the
+        grid or where no landable turnpoint is in reach.
+        """
+        row = int(round((lat - self.south) / self.dlat))
+        column = int(round((lon - self.west) / self.dlon))
+        if not (0 <= row < self.values.shape[0] and 0 <= column < self.values.shape[1]):
+            return None
+        value = float(self.values[row, column])
+        return None if math.isnan(value) else value
+
+    def contours(self, altitudes, bbox=None, precision=CONTOUR_PRECISION):
+        """
+        Return the areas from which a landable turnpoint can be reached at every altitude, as a
+        GeoJSON FeatureCollection with one MultiPolygon per altitude, like the rings.
+
+        Each grid point stands for the cell around it; the cells at or below an altitude are
+        merged row run by row run and the staircase simplified to half a cell. Unlike the rings,
+        holes are kept, since they are places from which nothing can be reached.
+
+        Parameters:
+        altitudes (list): Altitudes in feet MSL.
+        bbox (tuple): Optional (south, west, north, east) to cut the grid to, e.g. a map tile.
+        """
+        rows, columns = self.values.shape
+        row_start, column_start, row_end, column_end = 0, 0, rows, columns
+        if bbox is not None:
+            south, west, north, east = bbox
+            row_start = max(int(math.floor((south - self.south) / self.dlat)), 0)
+            row_end = min(int(math.ceil((north - self.south) / self.dlat)) + 1, rows)
+            column_start = max(int(math.floor((west - self.west) / self.dlon)), 0)
+            column_end = min(int(math.ceil((east - self.west) / self.dlon)) + 1, columns)
+        values = np.asarray(self.values[row_start:max(row_end, row_start),
+                                        column_start:max(column_end, column_start)])
+
+        features = []
+        for altitude in altitudes:
+            with np.errstate(invalid='ignore'):
+                inside = values <= altitude
+            # Runs of cells inside the contour along every row, found from the edges of the mask
+            edges = np.diff(np.pad(inside, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+            run_rows, run_starts = np.nonzero(edges == 1)
+            _, run_ends = np.nonzero(edges == -1)
+            if run_rows.size == 0:
+                continue
+            lats = self.south + self.dlat * (row_start + run_rows)
+            boxes = shapely.box(self.west + self.dlon * (column_start + run_starts - 0.5),
+                                lats - self.dlat / 2,
+                                self.west + self.dlon * (column_start + run_ends - 0.5),
+                                lats + self.dlat / 2)
+            merged = shapely.simplify(shapely.union_all(boxes), min(self.dlat, self.dlon) / 2)
+            polygons = [polygon for polygon in getattr(merged, 'geoms', [merged])
+                        if not polygon.is_empty]
+            features.append({
+                'type': 'Feature',
+                'properties': {'altitude': int(altitude) if float(altitude).is_integer()
+                               else float(altitude)},
+                'geometry': {
+                    'type': 'MultiPolygon',
+                    'coordinates': [[np.round(np.asarray(ring.coords), precision).tolist()
+                                     for ring in (polygon.exterior, *polygon.interiors)]
+                                    for polygon in polygons],
+                },
+            })
+        return {'type': 'FeatureCollection', 'features': features}
+
+
+class AltitudeGridStore:
+    """
+    The precomputed grids of ALTITUDE_GRID_DIR, found through its manifest.
+
+    The manifest is re-read when it changes; grids are memory-mapped on first use, so every
+    worker shares them through the page cache and a lookup reads only the cells it needs.
+    """
+
+    def __init__(self, directory=ALTITUDE_GRID_DIR):
+        self.directory = directory
+        self.version = None
+        self.manifest = {'grids': []}
+        self._grids = {}
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """
+        Reload the manifest if it changed on disk, or forget it if it is gone.
+        """
+        path = os.path.join(self.directory, MANIFEST_FILE) if self.directory else None
+        version = os.stat(path).st_mtime_ns if path and os.path.exists(path) else None
+        if version == self.version:
+            return False
+        with self._lock:
+            if version is None:
+                self.manifest = {'grids': []}
+            else:
+                with open(path, 'r') as file:
+                    self.manifest = json.load(file)
+            self.version = version
+            self._grids = {}
+        return True
+
+    def regions(self):
+        self.refresh()
+        return sorted({entry['region'] for entry in self.manifest['grids']})
+
+    def find(self, region, glide_ratio, vg, safety_margin, arrival_altitude, wind_speed,
+             wind_direction):
+        """
+        Return the grid for a region, glider, safety margin, arrival altitude and wind, through
+        the glider class and wind bucket of the manifest, or None if it was not precomputed.
+
+        Returns:
+        tuple: The AltitudeGrid and whether the wind is stronger than the strongest
+        precomputed one, so that the grid under-states the altitude required.
+        """
+        self.refresh()
+        manifest = self.manifest
+        if not manifest['grids']:
+            return None
+        glide_class = glider_class(glide_ratio, vg, manifest['glide_step'], manifest['vg_step'])
+        speed, direction, exceeded = wind_bucket(wind_speed, wind_direction,
+                                                 manifest['wind_speeds'],
+                                                 manifest['wind_directions'])
+        for entry in manifest['grids']:
+            if (entry['region'], entry['glide_ratio'], entry['vg'], entry['wind_speed'],
+                    entry['wind_direction']) == (region,) + glide_class + (speed, direction) \
+                    and math.isclose(entry['safety_margin'], safety_margin) \
+                    and math.isclose(entry['arrival_altitude'], arrival_altitude):
+                return self._open(entry), exceeded
+        return None
+
+    def _open(self, entry):
+        with self._lock:
+            grid = self._grids.get(entry['file'])
+            if grid is None:
+                values = np.load(os.path.join(self.directory, entry['file']), mmap_mode='r')
+                grid = self._grids[entry['file']] = AltitudeGrid(entry, values, self.version)
+            return grid
+
+
+_store = AltitudeGridStore()
+
+
+def get_altitude_grids():
+    """
+    Return the shared store of precomputed altitude grids.
+    """
+    _store.refresh()
+    return _store
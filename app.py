@@ -1,13 +1,28 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, abort, g, Response
 from flask_session import Session
-import numpy as np
-import csv
-import ast
-import json
+import hashlib
+import math
 import os
-from utils import plot_map, send_email, GMAIL_ADDRESS
+import time
+from utils import plan_map_html, ring_geometry, ring_geometry_key, ring_label_locations
+from turnpoints import get_repository, TABLE_COLUMNS
+from gliders import get_glider_registry
+from plans import FlightPlan, PlanError, plan_store
+from responses import json_response, json_error, not_modified, compressed_response
+from ring_geojson import rings_feature_collection
+from ring_cache import canonical_key
+from scenarios import Scenario, scenario_ring_geometry
+from tasks import MAP_JOBS, BACKEND_ERRORS, submit_map_job, job_status, job_map_html
+from wind_field import forecast_hours
+from reachability import reachable_turnpoints, REACHABLE_LIMIT
+from task_analysis import analyze_tasks, task_distance
+from altitude_grid import get_altitude_grids
+from outbox import outbox, GMAIL_ADDRESS, OUTBOX_SENDER
+from instrumentation import configure_logging, metrics, start_request, finish_request, server_timing, \
+    should_profile, SamplingProfiler, write_profile, stage
 from dotenv import load_dotenv
 load_dotenv()
+configure_logging()
 
 app = Flask(__name__)
 
@@ -19,26 +34,63 @@ app.config['SESSION_TYPE'] = 'filesystem'
 
 Session(app)
 
-type_mapping = {
-    '0': 'Unknown',
-    '1': 'Waypoint',
-    '2': 'Airfield - grass runway',
-    '3': 'Outlanding',
-    '4': 'Gliding Airfield',
-    '5': 'Airfield - solid surface runway',
-    '6': 'Mountain Pass',
-    '7': 'Mountain Top',
-    '8': 'Transmitter Mast',
-    '9': 'VOR',
-    '10': 'NDB',
-    '11': 'Cooling Tower',
-    '12': 'Dam',
-    '13': 'Tunnel',
-    '14': 'Bridge',
-    '15': 'PowerPlant',
-    '16': 'Castle',
-    '17': 'Intersection'
-}
+# Parse the turnpoint database and the gliders once at startup; they are reloaded only if the
+# files change
+get_repository()
+get_glider_registry()
+
+# The rendered index page, kept until the turnpoints, the gliders or the templates change
+INDEX_TEMPLATES = ('templates/index.html', 'templates/base.html')
+_index_page = {'version': None, 'body': None, 'etag': None}
+
+# Most scenarios computed by one /api/rings/batch request
+BATCH_MAX_SCENARIOS = int(os.environ.get('BATCH_MAX_SCENARIOS', '12'))
+# Most turnpoint table rows returned by one /api/turnpoints request
+TURNPOINT_PAGE_MAX = int(os.environ.get('TURNPOINT_PAGE_MAX', '500'))
+
+@app.before_request
+def start_outbox_sender():
+    # With OUTBOX_SENDER set, every worker sends the contact form messages, from a thread
+    # started in the worker itself rather than in a parent process that forks it
+    if OUTBOX_SENDER:
+        outbox.start()
+
+@app.before_request
+def start_timing():
+    g.request_start = time.perf_counter()
+    start_request()
+    g.profiler = SamplingProfiler().start() if should_profile(request.headers.get('X-Profile')) \
+        else None
+
+@app.after_request
+def record_timing(response):
+    """
+    Add the request's stage timings as a Server-Timing header and record its metrics.
+    """
+    seconds = time.perf_counter() - g.get('request_start', time.perf_counter())
+    timings = finish_request()
+    endpoint = request.endpoint or 'unknown'
+    response.headers['Server-Timing'] = server_timing(timings, seconds)
+    metrics.count('gfp_requests_total', endpoint=endpoint, method=request.method,
+                  status=response.status_code)
+    metrics.observe('gfp_request_seconds', seconds, endpoint=endpoint)
+    if response.content_length is not None:
+        metrics.observe('gfp_response_bytes', response.content_length, endpoint=endpoint)
+
+    profiler = g.get('profiler')
+    if profiler is not None:
+        profiler.stop()
+        write_profile(profiler, endpoint)
+    app.logger.debug('%s %s %d in %.1f ms (%s)', request.method, request.path,
+                     response.status_code, seconds * 1000, server_timing(timings))
+    return response
+
+@app.route('/metrics')
+def metrics_page():
+    """
+    Return this worker's metrics in the Prometheus text format.
+    """
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def home():
@@ -61,98 +113,294 @@ def index():
     if not session.get('agreed_to_terms'):
         return redirect(url_for('welcome'))
     
-    data = []
-
-    # Eric - Switched to cup files and cup field names
-    # Just replace  .cup extension with .csv and it works
-    with open('data/Sterling_MA_2024_04.csv', 'r') as file:
-        done = ''
-        reader = csv.DictReader(file)
-        for row in reader:
-
-            # Replace the value in the Type column using the mapping
-            # row['Type'] = type_mapping.get(row['Type'], row['Type'])
-            if  'Related Tasks'  in row['name'] or row['name'] == '':
-                done = 'done'
-
-            if (done == '') :
-                row['style'] = type_mapping.get(row['style'], row['style'])
-
-                row['lat'] = ((float(row['lat'][0:2])
-                                + float(row['lat'][2:4])/60
-                                + float(row['lat'][4:8])/60) * ((-1, 1)[row['lat'][-1] =='N'] ))
-
-                row['lon'] = ((float(row['lon'][0:3])
-                      + float(row['lon'][3:5])/60
-                      + float(row['lon'][5:9])/60) * ((-1, 1)[row['lon'][-1] == 'E'] ))
-                data.append(row)
-                print(row)
-    data.sort(key=lambda turnpoint: turnpoint['name'])
-
-    # Load gliders data from the JSON file
-    with open('data/gliders.json', 'r') as file:
-        gliders = json.load(file)
-
-    # Sort the gliders alphabetically by make and model
-    gliders.sort(key=lambda glider: glider['make'] + " " + glider['model'])
-
     if request.method == "POST":
-        # Extract selected rows from the table
-        selected_rows = request.form.getlist('selectedRows[]')
-        
-        selected_glider = request.form['gliderSelection']
-        if selected_glider != "other":
-            for glider in gliders:
-                selected_glider_name = glider['make'] + " " + glider['model']
-                if selected_glider_name == selected_glider:
-                    glide_ratio = float(glider['glide_ratio'])
-                    vg = float(glider['vg'])
-                    break
-        else:
-            glide_ratio = float(request.form['glideRatio'])
-            vg = float(request.form['vg'])
-
-        dict = request.form
-        for key in dict:
-            print ('form key '+ key + ' ' + dict[key])
-
-
-        # Extract new form data
-        wind_direction = float(request.form['windDirection'])
-        wind_speed = float(request.form['windSpeed'])
-        safety_margin = float(request.form['safetyMargin']) / 100
-        location_names = request.form.getlist('locationName[]')
-        altitudes = request.form.getlist('altitude[]')
-        latitudes = request.form.getlist('latitude[]')
-        longitudes = request.form.getlist('longitude[]')
-        arrival_altitude = float(request.form['arrivalAltitude'])
-        ring_spacing = request.form['ringSpacingSelection']
-        ring_start_alt = request.form['ringStartAlt']
-        ring_end_alt = request.form['ringEndAlt']
-
-
-        # Create a form data dictionary
-        form_data = {
-            'selected_glider': selected_glider,
-            'selected_rows': [selected_rows],
-            'glide_ratio': glide_ratio,
-            'safety_margin': safety_margin,
-            'vg': vg,
-            'wind_speed': wind_speed,
-            'wind_direction': wind_direction,
-            'location_names': location_names,
-            'altitudes': altitudes,
-            'latitudes': latitudes,
-            'longitudes': longitudes,
-            'arrival_altitude': arrival_altitude,
-            'ring_spacing': ring_spacing,
-            'ring_start_alt': ring_start_alt,
-            'ring_end_alt': ring_end_alt
-        }
-        
-        return redirect(url_for('map_page', **form_data))
-
-    return render_template("index.html", data=data, gliders_json=gliders)
+        try:
+            plan = FlightPlan.from_form(request.form, get_glider_registry())
+        except PlanError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('index'))
+
+        # Draw the map straight away; the page then shows the plan's short /map/<plan_id> URL
+        plan_id = plan_store.save(plan)
+        app.logger.debug('Plan %s: %s', plan_id, plan.to_json())
+        return render_plan_map(plan, plan_id)
+
+    # Pages carrying flashed messages are personal, so they are rendered rather than cached
+    if session.get('_flashes'):
+        return render_index_page()
+
+    version = index_version()
+    if _index_page['version'] != version:
+        body = render_index_page().encode('utf-8')
+        _index_page.update(version=version, body=body,
+                           etag=hashlib.sha256(body).hexdigest())
+    response = not_modified(_index_page['etag'])
+    if response is None:
+        response = compressed_response(_index_page['body'], 'text/html', _index_page['etag'])
+    # Browsers must revalidate, which costs a 304 while nothing changed
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def index_version():
+    """
+    Return what the index page depends on: the turnpoint file, the gliders file, the wind
+    forecasts and the templates.
+    """
+    return (get_repository().version, get_glider_registry().version, tuple(forecast_hours()),
+            tuple(os.stat(path).st_mtime_ns for path in INDEX_TEMPLATES))
+
+def render_index_page():
+    # The turnpoint table is filled page by page from /api/turnpoints
+    return render_template("index.html", regions=get_repository().regions(),
+                           gliders_json=get_glider_registry().gliders, forecasts=forecast_hours())
+
+def float_list(value, count, name):
+    values = [float(part) for part in value.split(',')]
+    if len(values) != count:
+        raise ValueError('%s needs %d comma-separated numbers' % (name, count))
+    return values
+
+@app.route('/api/turnpoints', methods=['GET'])
+def api_turnpoints():
+    """
+    Return one page of the turnpoint table, in the format of DataTables' server-side processing.
+
+    Query parameters (all optional): region, bbox=south,west,north,east, near=lat,lon with
+    radius (nautical miles), search (or DataTables' search[value]), order[0][column] and
+    order[0][dir], start and length (at most TURNPOINT_PAGE_MAX rows), and draw, which is echoed.
+    """
+    turnpoints = get_repository()
+    args = request.args
+    try:
+        bbox = float_list(args['bbox'], 4, 'bbox') if args.get('bbox') else None
+        if bbox is not None:
+            south, west, north, east = bbox
+            # west > east is a box across the antimeridian
+            if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+                raise ValueError('bbox must be south,west,north,east in degrees')
+        near = float_list(args['near'], 2, 'near') if args.get('near') else None
+        radius_nm = float(args['radius']) if near is not None else None
+        if near is not None and not (-90 <= near[0] <= 90 and -180 <= near[1] <= 180):
+            raise ValueError('near must be lat,lon in degrees')
+        if radius_nm is not None and not 0 <= radius_nm < math.inf:
+            raise ValueError('radius must be a distance in nautical miles')
+        column_index = int(args.get('order[0][column]', 1))
+        if not 0 <= column_index < len(TABLE_COLUMNS):
+            raise ValueError('unknown column %d' % column_index)
+        column = TABLE_COLUMNS[column_index]
+        start = max(int(args.get('start', 0)), 0)
+        length = int(args.get('length', 10))
+        length = TURNPOINT_PAGE_MAX if length < 0 else min(length, TURNPOINT_PAGE_MAX)
+        draw = int(args.get('draw', 0))
+    except KeyError as e:
+        return json_error('Invalid turnpoint query: %s is required' % e.args[0])
+    except ValueError as e:
+        return json_error('Invalid turnpoint query: %s' % e)
+
+    etag = canonical_key(turnpoints=turnpoints.version, query=sorted(args.items(multi=True)))
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
+    selected = turnpoints.select(region=args.get('region') or None, bbox=bbox, near=near,
+                                 radius_nm=radius_nm,
+                                 search=args.get('search', args.get('search[value]')))
+    selected = turnpoints.sort(selected, column, args.get('order[0][dir]') == 'desc')
+    return json_response({
+        'draw': draw,
+        'recordsTotal': len(turnpoints),
+        'recordsFiltered': len(selected),
+        'data': [turnpoints.table_row(i) for i in selected[start:start + length]],
+    }, etag=etag)
+
+def glide_query(args):
+    """
+    Read the glider, wind and arrival altitude of a query: glider (a glider ID) or glideRatio
+    and vg, and optionally safetyMargin (%, default 50), windSpeed (knots) and windDirection
+    (degrees, default calm) and arrivalAltitude (feet AGL, default 1500).
+
+    Returns:
+    tuple: (glide_ratio, safety_margin, vg, wind_speed, wind_direction, arrival_altitude).
+    Raises KeyError for a missing parameter and ValueError for an invalid one.
+    """
+    if args.get('glider'):
+        glider = get_glider_registry().lookup(args['glider'])
+        if glider is None:
+            raise ValueError('unknown glider %r' % args['glider'])
+        glide_ratio, vg = float(glider['glide_ratio']), float(glider['vg'])
+    else:
+        glide_ratio, vg = float(args['glideRatio']), float(args['vg'])
+    if not (glide_ratio > 0 and vg > 0):
+        raise ValueError('glideRatio and vg must be positive')
+    safety_margin = float(args.get('safetyMargin', 50)) / 100
+    if not 0 <= safety_margin < 1:
+        raise ValueError('safetyMargin must be between 0 and 100')
+    wind_speed = float(args.get('windSpeed', 0))
+    wind_direction = float(args.get('windDirection', 0))
+    arrival_altitude = float(args.get('arrivalAltitude', 1500))
+    if not all(math.isfinite(value) for value in (wind_speed, wind_direction, arrival_altitude)):
+        raise ValueError('altitudes and wind must be numbers')
+    return glide_ratio, safety_margin, vg, wind_speed, wind_direction, arrival_altitude
+
+@app.route('/api/reachable', methods=['GET'])
+def api_reachable():
+    """
+    Return the turnpoints a glider can reach from a position and altitude, the largest arrival
+    margin first.
+
+    Query parameters: lat, lon and altitude (feet MSL) of the glider; the glider and wind as
+    read by glide_query; and optionally limit (default and at most REACHABLE_LIMIT) and
+    all=true to include turnpoints that are not landable.
+    """
+    args = request.args
+    try:
+        lat, lon, altitude = float(args['lat']), float(args['lon']), float(args['altitude'])
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError('lat and lon must be valid coordinates')
+        if not math.isfinite(altitude):
+            raise ValueError('altitude must be a number')
+        glide_ratio, safety_margin, vg, wind_speed, wind_direction, arrival_altitude = \
+            glide_query(args)
+        limit = min(max(int(args.get('limit', REACHABLE_LIMIT)), 0), REACHABLE_LIMIT)
+    except KeyError as e:
+        return json_error('Invalid reachability query: %s is required' % e.args[0])
+    except ValueError as e:
+        return json_error('Invalid reachability query: %s' % e)
+
+    turnpoints = get_repository()
+    indices, distances, courses, required = reachable_turnpoints(
+        turnpoints, lat, lon, altitude, glide_ratio, safety_margin, vg, wind_speed,
+        wind_direction, arrival_altitude, landable_only=args.get('all') != 'true', limit=limit)
+    response = json_response({'turnpoints': [{
+        'code': turnpoints.codes[i],
+        'name': turnpoints.names[i],
+        'style': turnpoints.styles[i],
+        'lat': float(turnpoints.lats[i]),
+        'lon': float(turnpoints.lons[i]),
+        'elev': float(turnpoints.elevs[i]),
+        'distance_nm': round(float(distance), 2),
+        'course': round(float(course), 1),
+        'altitude_required': round(float(altitude_required)),
+        'margin': round(altitude - float(altitude_required)),
+    } for i, distance, course, altitude_required in zip(indices, distances, courses, required)]})
+    # Positions change with every fix, so there is nothing to revalidate
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/api/tasks', methods=['GET'])
+def api_tasks():
+    """
+    Return the tasks stored in the turnpoint files, with their points and distances. A task's
+    id is its position in the list; points that are not in the turnpoint database are listed
+    in 'missing'.
+    """
+    turnpoints = get_repository()
+    etag = canonical_key(turnpoints=turnpoints.version, tasks=True)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    return json_response({'tasks': [{
+        'id': task_id,
+        'name': task['name'],
+        'region': turnpoints.region_names[task['region']],
+        'points': task['points'],
+        'distance_nm': round(task_distance(task), 2),
+        'options': task['options'],
+        'missing': task['missing'],
+    } for task_id, task in enumerate(turnpoints.tasks)]}, etag=etag)
+
+@app.route('/api/tasks/analysis', methods=['GET'])
+def api_task_analysis():
+    """
+    Return the final-glide altitude profile of tasks: along every leg, the altitude needed to
+    reach the best landable turnpoint within TASK_SEARCH_RADIUS_NM in the wind, and the
+    critical point of every task.
+
+    Query parameters: the glider and wind as read by glide_query, and optionally task, a
+    comma-separated list of task ids from /api/tasks (default all tasks).
+    """
+    turnpoints = get_repository()
+    args = request.args
+    try:
+        glide_ratio, safety_margin, vg, wind_speed, wind_direction, arrival_altitude = \
+            glide_query(args)
+        task_ids = [int(part) for part in args['task'].split(',')] if args.get('task') \
+            else list(range(len(turnpoints.tasks)))
+        if not all(0 <= task_id < len(turnpoints.tasks) for task_id in task_ids):
+            raise ValueError('unknown task id')
+    except KeyError as e:
+        return json_error('Invalid task analysis query: %s is required' % e.args[0])
+    except ValueError as e:
+        return json_error('Invalid task analysis query: %s' % e)
+
+    etag = canonical_key(turnpoints=turnpoints.version, query=sorted(args.items(multi=True)))
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
+    with stage('tasks'):
+        results = analyze_tasks(turnpoints, [turnpoints.tasks[task_id] for task_id in task_ids],
+                                glide_ratio, safety_margin, vg, wind_speed, wind_direction,
+                                arrival_altitude)
+    for task_id, result in zip(task_ids, results):
+        result['id'] = task_id
+    return json_response({'tasks': results}, etag=etag)
+
+@app.route('/api/altitude-grid/contours', methods=['GET'])
+def api_altitude_grid_contours():
+    """
+    Return, from the precomputed altitude grids, the areas of a region from which a landable
+    turnpoint can be reached at every altitude, as a GeoJSON FeatureCollection.
+
+    Query parameters: altitudes, a comma-separated list of altitudes in feet MSL; the glider and
+    wind as read by glide_query; and optionally region (needed when grids of several regions were
+    precomputed) and bbox=south,west,north,east to cut the contours to, e.g. a map tile. The
+    glider class and wind bucket used are returned with the contours, and wind_exceeds_grids is
+    true when the wind is stronger than every precomputed one.
+    """
+    grids = get_altitude_grids()
+    regions = grids.regions()
+    if not regions:
+        return json_error('No precomputed grids are available', status=503)
+    args = request.args
+    try:
+        altitudes = [float(part) for part in args['altitudes'].split(',')]
+        if not all(math.isfinite(altitude) for altitude in altitudes):
+            raise ValueError('altitudes must be numbers')
+        bbox = float_list(args['bbox'], 4, 'bbox') if args.get('bbox') else None
+        glide_ratio, safety_margin, vg, wind_speed, wind_direction, arrival_altitude = \
+            glide_query(args)
+        region = args.get('region') or (regions[0] if len(regions) == 1 else None)
+        if region is None:
+            raise KeyError('region')
+    except KeyError as e:
+        return json_error('Invalid altitude grid query: %s is required' % e.args[0])
+    except ValueError as e:
+        return json_error('Invalid altitude grid query: %s' % e)
+
+    found = grids.find(region, glide_ratio, vg, safety_margin, arrival_altitude, wind_speed,
+                       wind_direction)
+    if found is None:
+        return json_error('No altitude grid was precomputed for this region, glider, safety '
+                          'margin and arrival altitude', status=404)
+    grid, wind_exceeded = found
+
+    etag = canonical_key(grid=[grid.entry['file'], grid.version], altitudes=altitudes, bbox=bbox,
+                         wind_exceeded=wind_exceeded)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    with stage('contours'):
+        contours = grid.contours(altitudes, bbox)
+    entry = grid.entry
+    return json_response({
+        'contours': contours,
+        'grid': {name: entry[name] for name in ('region', 'glide_ratio', 'vg', 'safety_margin',
+                                                'arrival_altitude', 'wind_speed',
+                                                'wind_direction')},
+        # The strongest precomputed wind was used for a stronger one: the areas are too large
+        'wind_exceeds_grids': wind_exceeded,
+    }, etag=etag)
 
 @app.route('/user-guide')
 def user_guide():
@@ -162,138 +410,236 @@ def user_guide():
 def disclaimer():
     return render_template('disclaimer.html')
 
+def render_plan_map(plan, plan_id=None):
+    """
+    Render the map page for a flight plan.
+
+    With MAP_JOBS set, the map is computed by a Celery worker and the page polls for it. Only
+    plans with a plan_id were stored, so only they get their short URL.
+    """
+    # One entry per location; plot_map draws the rings of every altitude around each of them
+    try:
+        center_locations = plan.center_locations(get_repository())
+    except PlanError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('index'))
+    if not center_locations:
+        flash('None of the selected locations are in the turnpoint database.', 'danger')
+        return redirect(url_for('index'))
+
+    plan_url = url_for('plan_map_page', plan_id=plan_id) if plan_id else None
+    if MAP_JOBS:
+        try:
+            job_id = submit_map_job(plan)
+        except BACKEND_ERRORS as e:
+            # Without a broker, draw the map here rather than fail
+            app.logger.warning('Could not queue the map of plan %s: %s', plan.plan_id, e)
+        else:
+            return render_template("map.html", plan_url=plan_url,
+                                   job_url=url_for('api_job', job_id=job_id),
+                                   job_map_url=url_for('job_map', job_id=job_id))
+
+    return render_template("map.html", map_html=plan_map_html(plan, center_locations),
+                           plan_url=plan_url)
+
+@app.route("/map/<plan_id>", methods=["GET"])
+def plan_map_page(plan_id):
+    plan = plan_store.get(plan_id)
+    if plan is None:
+        abort(404)
+    return render_plan_map(plan, plan_id)
+
 @app.route("/map", methods=["GET"])
 def map_page():
-    data = []
-    selected_glider = request.args.get('selected_glider')
-    selected_rows_str = request.args.get('selected_rows')
-    selected_rows = ast.literal_eval(selected_rows_str)
-    wind_direction = float(request.args.get('wind_direction'))
-    wind_speed = float(request.args.get('wind_speed'))
-    arrival_altitude_agl = float(request.args.get('arrival_altitude'))
-    ring_spacing = request.args.get('ring_spacing')
-    ring_start_alt = int(request.args.get('ring_start_alt'))
-    ring_end_alt = int(request.args.get('ring_end_alt'))
-    
-    # Retrieve dynamic form fields
-    location_names = request.args.getlist('location_names')
-    altitudes = request.args.getlist('altitudes')
-    latitudes = request.args.getlist('latitudes')
-    longitudes = request.args.getlist('longitudes')
-
-    # Load data from CSV
-    with open('data/Sterling_MA_2024_04.csv', 'r') as file:
-        done = ''
-        reader = csv.DictReader(file)
-        for row in reader:
-
-            # Replace the value in the Type column using the mapping
-            # row['Type'] = type_mapping.get(row['Type'], row['Type'])
-            if  'Related Tasks'  in row['name'] or row['name'] == '':
-                done = 'done'
-
-            if (done == '') :
-                row['style'] = type_mapping.get(row['style'], row['style'])
-                if (row['elev'].endswith('ft')) :
-                    row['elev'] = row['elev'][:-2]
-                elif (row['elev'].endswith('m')):
-                    row['elev'] = float(row['elev'][:-1]) * 3.28084
-
-                row['lat'] = ((float(row['lat'][0:2])
-                               + float(row['lat'][2:4])/60
-                               + float(row['lat'][4:8])/60) * ((-1, 1)[row['lat'][-1] =='N'] ))
-
-                row['lon'] = ((float(row['lon'][0:3])
-                               + float(row['lon'][3:5])/60
-                               + float(row['lon'][5:9])/60) * ((-1, 1)[row['lon'][-1] == 'E'] ))
-                data.append(row)
-                print(row)
-
-    if ring_spacing == 'thousands':
-       polygon_altitudes = np.arange( ring_start_alt ,  ring_end_alt + 1000 , 1000)
-    elif ring_spacing == 'evenThousands':
-        if (ring_start_alt/2000 == int(ring_start_alt/2000)):
-            polygon_altitudes = np.arange(ring_start_alt,ring_end_alt + 2000, 2000)
-        else:
-            polygon_altitudes = np.arange(ring_start_alt + 1000,ring_end_alt + 1000, 2000)
-    elif ring_spacing == 'oddThousands':
-        if (ring_start_alt/2000 == int(ring_start_alt/2000)):
-            polygon_altitudes = np.arange(ring_start_alt + 1000, ring_end_alt + 1000, 2000)
-        else:
-            polygon_altitudes = np.arange(ring_start_alt , ring_end_alt + 1000, 2000)
-    center_locations =[]
-
-    for polygon_altitude in polygon_altitudes:
-        for row in data:
-            if row['code'] in selected_rows:
-                center_locations.append(
-                    (
-                        float(row['lat']),
-                        float(row['lon']),
-                        float(polygon_altitude), 
-                        wind_speed, 
-                        wind_direction,
-                        float(row['elev']) + arrival_altitude_agl, # Add arrival altitude AGL to the center location altitude
-                        row['name'],
-                        row['style'],
-                        row['desc']
-                        )
-                    )
-                
-    # Append additional center locations
-    for i in range(len(location_names)):
-        # Check if any field in the current row is empty
-        if not (location_names[i] and altitudes[i] and latitudes[i] and longitudes[i]):
-            continue  # Skip processing this row if any field is empty
-        for polygon_altitude in polygon_altitudes:
-            center_locations.append(
-                (
-                    float(latitudes[i]),
-                    float(longitudes[i]),
-                    float(polygon_altitude),
-                    wind_speed,
-                    wind_direction,
-                    float(altitudes[i]) + arrival_altitude_agl,  # Add arrival altitude AGL to the center location altitude
-                    location_names[i],
-                    "A",  # Type for custom locations
-                    "User-defined location"  # Description for custom locations
-                )
-            )
-    
-    # Initialize total latitude and longitude to zero
-    total_lat = 0
-    total_lon = 0
-
-    # Iterate over the center locations
-    for location in center_locations:
-        total_lat += location[0]
-        total_lon += location[1]
-
-    # Calculate the average latitude and longitude
-    avg_lat = total_lat / len(center_locations)
-    avg_lon = total_lon / len(center_locations)
-
-    # Retrieve form parameters from request arguments
-    glide_ratio = float(request.args.get('glide_ratio'))
-    safety_margin = float(request.args.get('safety_margin'))
-    vg = float(request.args.get('vg'))
-    
-    # Generate the map using the form parameters
-    map_html = plot_map(
-        avg_lat, 
-        avg_lon,
-        glide_ratio,
-        safety_margin,
-        vg,
-        center_locations,
-        polygon_altitudes,
-        arrival_altitude_agl,
-        selected_glider,
-        wind_speed,
-        wind_direction,
-        ) 
-
-    return render_template("map.html", map_html=map_html)
+    # Old links carry the whole plan in the query string, so they are drawn without storing it
+    try:
+        plan = FlightPlan.from_legacy_args(request.args)
+    except PlanError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('index'))
+    return render_plan_map(plan)
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def api_job(job_id):
+    """
+    Return the state of a map job: pending, running, done or failed (with an error). Unknown
+    and expired jobs are not found, and an unreachable result backend is unavailable.
+    """
+    try:
+        status = job_status(job_id)
+    except BACKEND_ERRORS as e:
+        app.logger.warning('Could not read the state of job %s: %s', job_id, e)
+        return json_error('The job backend is unavailable', 503)
+    if status is None:
+        return json_error('Unknown or expired job %r' % job_id, 404)
+    state, error = status
+    payload = {'job_id': job_id, 'state': state}
+    if error is not None:
+        payload['error'] = error
+    response = json_response(payload)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/jobs/<job_id>/map', methods=['GET'])
+def job_map(job_id):
+    """
+    Return the map HTML computed by a finished job.
+    """
+    try:
+        map_html = job_map_html(job_id)
+    except BACKEND_ERRORS as e:
+        app.logger.warning('Could not read the map of job %s: %s', job_id, e)
+        return json_error('The job backend is unavailable', 503)
+    if map_html is None:
+        return json_error('Job %r has no map yet' % job_id, 404)
+    return compressed_response(map_html.encode('utf-8'), 'text/html')
+
+@app.route('/api/rings', methods=['POST'])
+def api_rings():
+    """
+    Return the rings for the inputs of the index form, given as a JSON body, as a GeoJSON
+    FeatureCollection (one MultiPolygon per altitude) plus the resolved inputs.
+
+    The body uses the index form's field names: selectedRows, gliderSelection (or "other" with
+    glideRatio and vg), windDirection, windSpeed, safetyMargin (percent), arrivalAltitude,
+    ringSpacingSelection, ringStartAlt, ringEndAlt, and optionally the user-defined locations
+    as locationName, altitude, latitude and longitude lists.
+    """
+    try:
+        plan = FlightPlan.from_json(request.get_json(silent=True), get_glider_registry())
+    except PlanError as e:
+        return json_error(str(e))
+    return plan_rings_response(plan, plan_store.save(plan))
+
+@app.route('/api/rings/<plan_id>', methods=['GET'])
+def api_plan_rings(plan_id):
+    """
+    Return the rings of a stored plan, as for POST /api/rings.
+    """
+    plan = plan_store.get(plan_id)
+    if plan is None:
+        return json_error('Unknown plan %r' % plan_id, 404)
+    return plan_rings_response(plan, plan_id)
+
+def plan_rings_response(plan, plan_id):
+    polygon_altitudes = plan.polygon_altitudes()
+    try:
+        wind_field = plan.wind_field()
+        # The forecast can expire between the two, so both may fail
+        center_locations = plan.center_locations(get_repository())
+    except PlanError as e:
+        return json_error(str(e))
+    if not center_locations:
+        return json_error('None of the selected locations are in the turnpoint database')
+    glide_ratio, safety_margin, vg = plan.glide_ratio, plan.safety_margin, plan.vg
+
+    # The ETag is derived from the inputs alone, so a matching one is answered before any ring math
+    etag = canonical_key(rings=ring_geometry_key(center_locations, polygon_altitudes, glide_ratio,
+                                                 safety_margin, vg, wind_field=wind_field),
+                         plan_id=plan_id,
+                         locations=center_locations)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
+    merged_rings = ring_geometry(center_locations, polygon_altitudes, glide_ratio, safety_margin, vg,
+                                 wind_field=wind_field)
+    return json_response({
+        'rings': rings_feature_collection(polygon_altitudes, merged_rings, ring_label_locations),
+        'metadata': {
+            'plan_id': plan_id,
+            'glider': plan.selected_glider,
+            'glide_ratio': glide_ratio,
+            'vg': vg,
+            'safety_margin': safety_margin,
+            'wind_speed': plan.wind_speed,
+            'wind_direction': plan.wind_direction,
+            'wind_forecast': plan.wind_forecast or None,
+            'arrival_altitude_agl': plan.arrival_altitude,
+            'altitudes': [int(altitude) for altitude in polygon_altitudes],
+            'locations': locations_metadata(center_locations),
+        },
+    }, etag=etag)
+
+def locations_metadata(center_locations):
+    return [{'name': name, 'type': type, 'lat': lat, 'lon': lon,
+             'arrival_altitude_msl': arrival_altitude_msl}
+            for lat, lon, _, _, arrival_altitude_msl, name, type, _ in center_locations]
+
+@app.route('/api/rings/batch', methods=['POST'])
+def api_rings_batch():
+    """
+    Return the rings of several glider and wind scenarios over the same locations, computed
+    together, as one GeoJSON FeatureCollection per scenario.
+
+    The body holds the fields of POST /api/rings shared by every scenario (the locations,
+    arrivalAltitude and the ring band) and a scenarios list. Each scenario gives
+    gliderSelection (or "other" with glideRatio and vg), windSpeed, windDirection and
+    safetyMargin, and optionally a name; missing fields are taken from the shared ones.
+    Every scenario is also stored as a plan, so it can be opened as a map.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('scenarios'), list) \
+            or not data['scenarios']:
+        return json_error('Expected a JSON object with a non-empty scenarios list')
+    if len(data['scenarios']) > BATCH_MAX_SCENARIOS:
+        return json_error('At most %d scenarios can be computed at once' % BATCH_MAX_SCENARIOS)
+
+    shared = {name: value for name, value in data.items() if name != 'scenarios'}
+    plans = []
+    names = []
+    try:
+        for number, fields in enumerate(data['scenarios'], 1):
+            if not isinstance(fields, dict):
+                raise PlanError('Scenario %d must be a JSON object' % number)
+            if not isinstance(fields.get('name', ''), str):
+                raise PlanError('The name of scenario %d must be a string' % number)
+            plans.append(FlightPlan.from_json(dict(shared, **fields), get_glider_registry()))
+            names.append(fields.get('name'))
+    except PlanError as e:
+        return json_error(str(e))
+    if any(plan.wind_forecast for plan in plans):
+        return json_error('Scenarios take windSpeed and windDirection, not a windForecast')
+
+    # The scenarios share the locations and the ring band, so the first plan has them all
+    polygon_altitudes = plans[0].polygon_altitudes()
+    center_locations = plans[0].center_locations(get_repository())
+    if not center_locations:
+        return json_error('None of the selected locations are in the turnpoint database')
+    scenarios = [Scenario.from_plan(plan, name) for plan, name in zip(plans, names)]
+    plan_ids = [plan_store.save(plan) for plan in plans]
+
+    etag = canonical_key(plan_ids=plan_ids, names=[scenario.name for scenario in scenarios],
+                         rings=[ring_geometry_key(scenario.center_locations(center_locations),
+                                                  polygon_altitudes, scenario.glide_ratio,
+                                                  scenario.safety_margin, scenario.vg)
+                                for scenario in scenarios],
+                         locations=center_locations)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
+    scenario_rings = scenario_ring_geometry(center_locations, polygon_altitudes, scenarios)
+    return json_response({
+        'scenarios': [{
+            'name': scenario.name,
+            'plan_id': plan_id,
+            'glider': plan.selected_glider,
+            'glide_ratio': scenario.glide_ratio,
+            'vg': scenario.vg,
+            'safety_margin': scenario.safety_margin,
+            'wind_speed': scenario.wind_speed,
+            'wind_direction': scenario.wind_direction,
+            'rings': rings_feature_collection(polygon_altitudes, merged_rings,
+                                              ring_label_locations),
+        } for scenario, plan, plan_id, merged_rings in zip(scenarios, plans, plan_ids,
+                                                           scenario_rings)],
+        'metadata': {
+            'arrival_altitude_agl': plans[0].arrival_altitude,
+            'altitudes': [int(altitude) for altitude in polygon_altitudes],
+            'locations': locations_metadata(center_locations),
+        },
+    }, etag=etag)
 
 @app.route('/about-us')
 def about_us():
@@ -322,10 +668,10 @@ def submit_contact_form():
     email = request.form.get('email')
     message_content = request.form.get('message')
 
-    # Send email
+    # Queue the email; the outbox sends it in the background
     subject = "[GliderFlightPlanner] New Contact Form Submission"
     content = f"Name: {name}\nEmail: {email}\nMessage: {message_content}"
-    send_email(GMAIL_ADDRESS, subject, content)
+    outbox.enqueue(GMAIL_ADDRESS, subject, content)
 
     # Provide feedback to the user
     flash('Thank you for reaching out! We will get back to you as soon as possible.', 'success')
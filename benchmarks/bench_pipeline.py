@@ -0,0 +1,309 @@
+"""
+Time every stage of drawing a map, from parsing the turnpoint file to the rendered HTML.
+
+For synthetic turnpoint files of several sizes and several numbers of altitude bands, the
+stages are timed separately:
+
+- parse: reading the .cup file into a TurnpointRepository
+- rings: computing the ring of every location and band (rings.compute_rings)
+- union: merging the overlapping rings of every band (utils.merge_ring_bands)
+- render: building the folium map around the merged rings (utils.plot_map)
+
+Every stage reports the median of several runs and its peak of Python allocations
+(tracemalloc; the work of RING_WORKERS processes is not counted), and the size of the HTML is
+recorded. Nothing is fetched over the network. Results can be saved as a baseline and later
+runs compared with it. Timings only compare on the machine that recorded the baseline, so
+every machine keeps its own; a fixed calibration loop, timed with every run and stored with
+the baseline, scales the baseline to how fast the machine runs at the time of the check.
+
+Run from the project root:
+
+    python -m benchmarks.bench_pipeline
+    python -m benchmarks.bench_pipeline --save-baseline
+    python -m benchmarks.bench_pipeline --check
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from planning import center_locations_for, map_center
+from rings import compute_rings, resolve_headings
+from ring_cache import geometry_cache
+from turnpoints import TurnpointRepository
+from utils import plot_map, ring_locations_of, ring_geometry_key, merge_ring_bands, \
+    RING_RESOLUTION
+
+# Synthetic airports are centred on the New England turnpoint file
+CENTER_LAT = 43.25
+CENTER_LON = -72.0
+DEFAULT_SPREAD = 5.0
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'baseline_pipeline.json')
+STAGES = ('parse', 'rings', 'union', 'render')
+
+GLIDE_RATIO = 38
+SAFETY_MARGIN = 0.2
+VG = 55
+WIND_SPEED = 15.0
+WIND_DIRECTION = 270.0
+ARRIVAL_ALTITUDE_AGL = 1000
+FIRST_BAND = 3000
+BAND_SPACING = 1000
+# Slower stages below this many seconds are put down to noise rather than reported
+MIN_REGRESSION_SECONDS = 0.005
+# Stages faster than this many seconds are noisier, so they get SHORT_STAGE_TOLERANCE instead
+# when it is larger than the tolerance asked for
+SHORT_STAGE_SECONDS = 0.1
+SHORT_STAGE_TOLERANCE = 0.5
+# Runs of the calibration loop; their median is kept
+CALIBRATION_REPEAT = 7
+
+
+def cup_coordinate(value, hemispheres, degree_digits):
+    """
+    Format signed decimal degrees as a .cup coordinate, e.g. 4421.200N.
+    """
+    minutes = round(abs(value) * 60, 3)
+    return '%0*d%06.3f%s' % (degree_digits, minutes // 60, minutes % 60,
+                              hemispheres[0] if value >= 0 else hemispheres[1])
+
+
+def write_synthetic_cup(path, airport_count, spread=DEFAULT_SPREAD, seed=0):
+    """
+    Write a .cup file of airport_count airports spread over a square of spread degrees.
+
+    Returns:
+    list: The codes of the airports.
+    """
+    rng = np.random.default_rng(seed)
+    lats = CENTER_LAT + rng.uniform(-spread / 2, spread / 2, airport_count)
+    lons = CENTER_LON + rng.uniform(-spread / 2, spread / 2, airport_count)
+    elevations = rng.uniform(100, 2500, airport_count)
+    codes = ['A%05d' % i for i in range(airport_count)]
+    with open(path, 'w') as file:
+        file.write('name,code,country,lat,lon,elev,style,rwdir,rwlen,rwwidth,freq,desc\n')
+        for code, lat, lon, elevation in zip(codes, lats, lons, elevations):
+            file.write('"Airport %s","%s",US,%s,%s,%.0fft,5,90,3000ft,75ft,122.8,"%s, synthetic"\n'
+                       % (code, code, cup_coordinate(lat, 'NS', 2), cup_coordinate(lon, 'EW', 3),
+                          elevation, code))
+    return codes
+
+
+def measure(stage, memory):
+    """
+    Run stage() and return its result, the seconds it took and, with memory set, the peak of
+    its allocations in bytes (None otherwise).
+    """
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = stage()
+    seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+def calibrate(repeat=CALIBRATION_REPEAT):
+    """
+    Return the median seconds of a fixed mix of NumPy and pure Python work, a measure of how
+    fast the machine runs at the moment.
+    """
+    values = np.linspace(0.0, 10.0, 200000)
+
+    def work():
+        np.sin(values).sum()
+        np.sort(values[::-1])
+        sum(i * i for i in range(100000))
+        sorted(str(i) for i in range(20000))
+
+    work()
+    return statistics.median(measure(work, False)[1] for _ in range(repeat))
+
+
+def run_case(directory, airport_count, band_count, repeat, memory, spread=DEFAULT_SPREAD):
+    """
+    Time every stage for one synthetic file and number of bands, keeping the median of repeat
+    runs. The memory peaks come from one extra run with tracemalloc on, as tracing slows the
+    stages down.
+
+    Returns:
+    dict: Per stage, its seconds and peak bytes, plus the HTML size in bytes.
+    """
+    path = os.path.join(directory, 'synthetic_%d.cup' % airport_count)
+    if not os.path.exists(path):
+        write_synthetic_cup(path, airport_count, spread)
+    polygon_altitudes = [FIRST_BAND + BAND_SPACING * i for i in range(band_count)]
+
+    def parse():
+        repository = TurnpointRepository(path)
+        repository.refresh()
+        return repository
+
+    seconds = {stage: [] for stage in STAGES}
+    peaks = {}
+
+    def timed(stage, function, traced):
+        result, elapsed, peak = measure(function, traced)
+        if traced:
+            peaks[stage] = peak
+        else:
+            seconds[stage].append(elapsed)
+        return result
+
+    for run in range(repeat + memory):
+        traced = run == repeat
+        repository = timed('parse', parse, traced)
+
+        center_locations = center_locations_for(repository, repository.codes, [], [], [], [],
+                                                WIND_SPEED, WIND_DIRECTION, ARRIVAL_ALTITUDE_AGL)
+        ring_lats, ring_lons, ring_arrival_altitudes, ring_wind_speeds, ring_wind_directions = \
+            np.array(ring_locations_of(center_locations), dtype=np.float64).reshape(-1, 5).T
+        headings = resolve_headings(RING_RESOLUTION, GLIDE_RATIO, SAFETY_MARGIN, VG,
+                                    ring_wind_speeds, ring_wind_directions)
+
+        ring_vertices, ring_reachable = timed('rings', lambda: compute_rings(
+            polygon_altitudes, ring_lats, ring_lons, ring_arrival_altitudes, ring_wind_speeds,
+            ring_wind_directions, GLIDE_RATIO, SAFETY_MARGIN, VG, headings, terrain=None), traced)
+
+        merged_rings = timed('union', lambda: merge_ring_bands(
+            ring_vertices, ring_reachable, polygon_altitudes, ring_wind_speeds, VG), traced)
+
+        # plot_map takes the rings from the geometry cache, so only the map itself is timed
+        geometry_cache.put(ring_geometry_key(center_locations, polygon_altitudes, GLIDE_RATIO,
+                                             SAFETY_MARGIN, VG, terrain=None), merged_rings)
+        lat, lon = map_center(center_locations)
+        html = timed('render', lambda: plot_map(
+            lat, lon, GLIDE_RATIO, SAFETY_MARGIN, VG, center_locations, polygon_altitudes,
+            ARRIVAL_ALTITUDE_AGL, 'Benchmark glider', WIND_SPEED, WIND_DIRECTION), traced)
+        geometry_cache.clear()
+
+    result = {stage: {'seconds': statistics.median(seconds[stage])} for stage in STAGES}
+    if memory:
+        for stage in STAGES:
+            result[stage]['peak_bytes'] = peaks[stage]
+    result['html_bytes'] = len(html.encode('utf-8'))
+    return result
+
+
+def compare(results, baseline, tolerance, speed=1.0):
+    """
+    Return a line for every stage that got slower, used more memory or changed the HTML size
+    compared with the baseline.
+
+    Parameters:
+    speed (float): The calibration time of this run over that of the baseline; the baseline's
+      timings are scaled by it before they are compared.
+    """
+    regressions = []
+    for case, result in results.items():
+        before = baseline.get(case)
+        if before is None:
+            continue
+        for stage in STAGES:
+            old, new = before[stage], result[stage]
+            expected = old['seconds'] * speed
+            allowed = tolerance if expected >= SHORT_STAGE_SECONDS \
+                else max(tolerance, SHORT_STAGE_TOLERANCE)
+            if new['seconds'] > expected * (1 + allowed) \
+                    and new['seconds'] - expected > MIN_REGRESSION_SECONDS:
+                regressions.append('%s %s: %.1f ms, expected %.1f ms (%.1f ms in the baseline)'
+                                   % (case, stage, new['seconds'] * 1000, expected * 1000,
+                                      old['seconds'] * 1000))
+            if 'peak_bytes' in new and 'peak_bytes' in old \
+                    and new['peak_bytes'] > old['peak_bytes'] * (1 + tolerance):
+                regressions.append('%s %s: peak %.1f MB, was %.1f MB' % (
+                    case, stage, new['peak_bytes'] / 1e6, old['peak_bytes'] / 1e6))
+        if result['html_bytes'] > before['html_bytes'] * (1 + tolerance):
+            regressions.append('%s html: %d bytes, was %d bytes' % (
+                case, result['html_bytes'], before['html_bytes']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--airports', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--bands', type=int, nargs='+', default=[1, 5, 20])
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='runs per case; the median is reported')
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='skip the extra traced run that measures the memory peaks')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('--check', action='store_true',
+                        help='exit with status 1 when a stage regressed against the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='fraction a stage may be slower or larger than the baseline '
+                             '(at least %.0f%%%% for stages under %.0f ms)'
+                             % (SHORT_STAGE_TOLERANCE * 100, SHORT_STAGE_SECONDS * 1000))
+    args = parser.parse_args()
+
+    baseline = {}
+    baseline_calibration = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            saved = json.load(file)
+        baseline = saved['results']
+        baseline_calibration = saved.get('calibration_seconds')
+
+    calibration = calibrate()
+    speed = calibration / baseline_calibration if baseline_calibration else 1.0
+    print('Calibration: %.1f ms%s' % (calibration * 1000, ', %.2fx the baseline' % speed
+                                      if baseline_calibration else ''))
+    if baseline and not baseline_calibration:
+        print('The baseline has no calibration: save a new one on this machine to compare '
+              'timings reliably')
+
+    print('%8s %6s %10s %10s %10s %10s %10s %10s %10s' % (
+        'airports', 'bands', 'parse ms', 'rings ms', 'union ms', 'render ms', 'peak MB',
+        'html kB', 'vs base'))
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for airport_count in args.airports:
+            for band_count in args.bands:
+                case = '%d airports x %d bands' % (airport_count, band_count)
+                result = run_case(directory, airport_count, band_count, args.repeat, args.memory)
+                results[case] = result
+                total = sum(result[stage]['seconds'] for stage in STAGES)
+                before = baseline.get(case)
+                change = '%+9.0f%%' % ((total / (speed * sum(before[stage]['seconds']
+                                                              for stage in STAGES))
+                                        - 1) * 100) if before else '%10s' % '-'
+                peak = max(result[stage].get('peak_bytes') or 0 for stage in STAGES)
+                print('%8d %6d %10.1f %10.1f %10.1f %10.1f %10s %10.1f %s' % (
+                    airport_count, band_count,
+                    *(result[stage]['seconds'] * 1000 for stage in STAGES),
+                    '%.1f' % (peak / 1e6) if args.memory else '-',
+                    result['html_bytes'] / 1000, change))
+
+    regressions = compare(results, baseline, args.tolerance, speed)
+    for line in regressions:
+        print('REGRESSION', line)
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as file:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                       'calibration_seconds': calibration, 'results': baseline}, file,
+                      indent=2, sort_keys=True)
+            file.write('\n')
+        print('Saved the baseline to %s' % args.baseline)
+
+    if args.check and regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Time the per-band union of glide rings for synthetic airport sets.
+
+Run from the project root:
+
+    python -m benchmarks.bench_union
+"""
+import argparse
+import time
+
+import numpy as np
+from shapely.geometry import Polygon
+from shapely.ops import unary_union
+
+from rings import compute_rings
+from ring_union import union_bands
+
+# Synthetic airports are centred on the New England turnpoint file; the default spread in
+# degrees covers roughly the same area
+CENTER_LAT = 43.25
+CENTER_LON = -72.0
+DEFAULT_SPREAD = 5.0
+
+
+def synthetic_rings(airport_count, altitudes, spread=DEFAULT_SPREAD, seed=0):
+    rng = np.random.default_rng(seed)
+    lats = CENTER_LAT + rng.uniform(-spread / 2, spread / 2, airport_count)
+    lons = CENTER_LON + rng.uniform(-spread / 2, spread / 2, airport_count)
+    arrival_altitudes = rng.uniform(100, 2500, airport_count) + 1000
+    wind_speeds = np.full(airport_count, 15.0)
+    wind_directions = np.full(airport_count, 270.0)
+    return compute_rings(altitudes, lats, lons, arrival_altitudes, wind_speeds, wind_directions,
+                         glide_ratio=38, safety_margin=0.2, Vg=55)
+
+
+def time_unary_union(ring_vertices, ring_reachable):
+    timings = []
+    for band in range(ring_reachable.shape[0]):
+        start = time.perf_counter()
+        unary_union([Polygon(points) for points in ring_vertices[band][ring_reachable[band]]])
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def time_union_bands(ring_vertices, ring_reachable, nested):
+    start = time.perf_counter()
+    union_bands(ring_vertices, ring_reachable, nested)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--airports', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--start', type=int, default=3000)
+    parser.add_argument('--end', type=int, default=12000)
+    parser.add_argument('--spacing', type=int, default=1000)
+    parser.add_argument('--spread', type=float, nargs='+', default=[DEFAULT_SPREAD, 40.0],
+                        help='width in degrees of the square the airports are spread over')
+    args = parser.parse_args()
+
+    altitudes = np.arange(args.start, args.end + args.spacing, args.spacing, dtype=np.float64)
+    print('%8s %8s %8s %15s %15s %15s' % ('spread', 'airports', 'bands', 'unary ms/band',
+                                          'cluster ms/band', 'nested ms/band'))
+    for spread in args.spread:
+        for airport_count in args.airports:
+            ring_vertices, ring_reachable = synthetic_rings(airport_count, altitudes, spread)
+            unary = sum(time_unary_union(ring_vertices, ring_reachable)) / altitudes.size
+            clustered = time_union_bands(ring_vertices, ring_reachable, nested=False) / altitudes.size
+            nested = time_union_bands(ring_vertices, ring_reachable, nested=True) / altitudes.size
+            print('%8.1f %8d %8d %15.2f %15.2f %15.2f' % (spread, airport_count, altitudes.size,
+                                                          unary * 1000, clustered * 1000,
+                                                          nested * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import json
+import os
+import re
+import threading
+import unicodedata
+
+GLIDERS_FILE = os.environ.get('GLIDERS_FILE', 'data/gliders.json')
+
+
+def glider_id(make, model):
+    """
+    Return a stable, URL-safe ID for a glider, e.g. 'schleicher-ask-21'.
+    """
+    name = unicodedata.normalize('NFKD', make + ' ' + model).encode('ascii', 'ignore').decode('ascii')
+    return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-')
+
+
+class GliderRegistry:
+    """
+    The gliders of data/gliders.json, sorted by make and model and indexed by a stable ID.
+
+    The file is parsed once and re-read only when its modification time changes.
+    """
+
+    def __init__(self, path=GLIDERS_FILE):
+        self.path = path
+        self.version = None
+        self.gliders = []
+        self._by_id = {}
+        self._by_name = {}
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """
+        Reload the file if it changed on disk since it was last read.
+
+        Returns:
+        bool: True if the file was (re)loaded.
+        """
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self.version:
+            return False
+        with self._lock:
+            if mtime == self.version:
+                return False
+            with open(self.path, 'r') as file:
+                gliders = json.load(file)
+
+            # Sort the gliders alphabetically by make and model
+            gliders.sort(key=lambda glider: glider['make'] + " " + glider['model'])
+            by_id = {}
+            for glider in gliders:
+                glider['name'] = glider['make'] + " " + glider['model']
+                glider['id'] = base_id = glider_id(glider['make'], glider['model'])
+                suffix = 2
+                while glider['id'] in by_id:
+                    glider['id'] = '%s-%d' % (base_id, suffix)
+                    suffix += 1
+                by_id[glider['id']] = glider
+
+            self.gliders = gliders
+            self._by_id = by_id
+            self._by_name = {glider['name']: glider for glider in reversed(gliders)}
+            self.version = mtime
+        return True
+
+    def get(self, glider_id):
+        return self._by_id.get(glider_id)
+
+    def lookup(self, selection):
+        """
+        Return the glider for an ID or, for older forms and links, a "make model" name, or None.
+        """
+        return self._by_id.get(selection) or self._by_name.get(selection)
+
+
+_registry = GliderRegistry()
+
+
+def get_glider_registry():
+    """
+    Return the shared glider registry, reloading it if the file has changed.
+    """
+    _registry.refresh()
+    return _registry
@@ -0,0 +1,269 @@
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Level of the app's log messages: DEBUG, INFO, WARNING or ERROR
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# Directory where request profiles are written; profiling is off when unset
+PROFILE_DIR = os.environ.get('PROFILE_DIR')
+# Fraction of requests profiled when PROFILE_DIR is set
+PROFILE_RATE = float(os.environ.get('PROFILE_RATE', '0'))
+# Requests carrying this value in an X-Profile header are always profiled
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+# Milliseconds between the stack samples of a profiled request
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', '5'))
+
+# Histogram buckets of durations in seconds and of sizes in bytes
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 3e5, 1e6, 3e6, 1e7, 3e7)
+
+# Every metric exposed on /metrics: its type, help text and, for histograms, buckets
+METRICS = OrderedDict([
+    ('gfp_requests_total', ('counter', 'Requests answered, by endpoint and status', None)),
+    ('gfp_request_seconds', ('histogram', 'Time spent answering requests', TIME_BUCKETS)),
+    ('gfp_response_bytes', ('histogram', 'Size of response bodies as sent', SIZE_BUCKETS)),
+    ('gfp_stage_seconds', ('histogram', 'Time spent in each stage of drawing rings and maps',
+                           TIME_BUCKETS)),
+    ('gfp_rings_total', ('counter', 'Rings computed, one per location and band', None)),
+    ('gfp_ring_vertices_total', ('counter', 'Vertices of the reachable rings computed', None)),
+    ('gfp_union_input_polygons_total', ('counter', 'Rings passed to the union', None)),
+    ('gfp_union_output_polygons_total', ('counter', 'Merged polygons out of the union', None)),
+    ('gfp_union_output_vertices_total', ('counter', 'Vertices of the merged polygons', None)),
+    ('gfp_map_html_bytes', ('histogram', 'Size of rendered map pages', SIZE_BUCKETS)),
+    ('gfp_geometry_cache_requests_total', ('counter', 'Ring geometry cache lookups, by result',
+                                           None)),
+    ('gfp_turnpoints_loaded', ('gauge', 'Turnpoints in the loaded database', None)),
+    ('gfp_profiles_total', ('counter', 'Requests profiled', None)),
+    ('gfp_outbox_messages_total', ('counter', 'Outbox messages, by result: queued, sent, retried '
+                                   'or failed', None)),
+    ('gfp_outbox_send_seconds', ('histogram', 'Time spent sending one outbox message',
+                                 TIME_BUCKETS)),
+    ('gfp_outbox_connections_total', ('counter', 'SMTP connections opened by the outbox', None)),
+    ('gfp_outbox_pending', ('gauge', 'Messages waiting in the outbox', None)),
+])
+
+logger = logging.getLogger(__name__)
+
+
+def configure_logging(level=LOG_LEVEL):
+    """
+    Send the app's log messages at level and above to stderr, unless logging is already set up
+    (e.g. by gunicorn's --log-config), in which case its handlers and levels are left alone.
+    """
+    if logging.getLogger().handlers:
+        return
+    logging.basicConfig(level=level, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+
+class Metrics:
+    """
+    Process-wide counters, gauges and histograms, rendered in the Prometheus text format.
+
+    Every series is keyed by its metric name and its sorted labels. Metrics are kept per
+    process, so with several gunicorn workers each scrape sees the worker that answered it.
+    """
+
+    def __init__(self, metrics=METRICS):
+        self.metrics = metrics
+        self._values = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = value
+
+    def observe(self, name, value, **labels):
+        buckets = self.metrics[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self._histograms.clear()
+
+    def render(self):
+        """
+        Return every series in the Prometheus text exposition format.
+        """
+        def series(name, labels, value, extra=()):
+            pairs = ','.join('%s="%s"' % (label, str(text).replace('\\', r'\\').replace('"', r'\"'))
+                             for label, text in tuple(labels) + tuple(extra))
+            return '%s{%s} %s' % (name, pairs, repr(float(value))) if pairs \
+                else '%s %s' % (name, repr(float(value)))
+
+        with self._lock:
+            values = sorted(self._values.items())
+            histograms = sorted((key, (list(counts), total, count))
+                                for key, (counts, total, count) in self._histograms.items())
+
+        lines = []
+        for name, (kind, description, buckets) in self.metrics.items():
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, kind))
+            if kind == 'histogram':
+                for (metric, labels), (counts, total, count) in histograms:
+                    if metric != name:
+                        continue
+                    for bound, bucket_count in zip(buckets, counts):
+                        lines.append(series(name + '_bucket', labels, bucket_count,
+                                            [('le', repr(float(bound)))]))
+                    lines.append(series(name + '_bucket', labels, count, [('le', '+Inf')]))
+                    lines.append(series(name + '_sum', labels, total))
+                    lines.append(series(name + '_count', labels, count))
+            else:
+                lines.extend(series(name, labels, value)
+                             for (metric, labels), value in values if metric == name)
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+# Stage timings of the request being answered by the current thread
+_request = threading.local()
+
+
+def start_request():
+    """
+    Start collecting the stage timings of the current thread's request.
+    """
+    _request.timings = []
+
+
+def finish_request():
+    """
+    Stop collecting and return the (stage, seconds) timings of the current thread's request.
+    """
+    timings = getattr(_request, 'timings', None) or []
+    _request.timings = None
+    return timings
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a stage of the work, e.g. with stage('union'): ..., for the stage histograms and the
+    Server-Timing header of the current request.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        metrics.observe('gfp_stage_seconds', seconds, stage=name)
+        timings = getattr(_request, 'timings', None)
+        if timings is not None:
+            timings.append((name, seconds))
+
+
+def server_timing(timings, total=None):
+    """
+    Return a Server-Timing header value for the timings of a request, adding up repeated stages.
+    """
+    durations = OrderedDict()
+    for name, seconds in timings:
+        durations[name] = durations.get(name, 0.0) + seconds
+    if total is not None:
+        durations['total'] = total
+    return ', '.join('%s;dur=%.1f' % (name, seconds * 1000) for name, seconds in durations.items())
+
+
+class SamplingProfiler:
+    """
+    Sample the call stack of one thread at a fixed interval from a background thread.
+
+    The samples are kept as collapsed stacks ('module:function;module:function' -> count), the
+    input of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, thread_id=None, interval=PROFILE_INTERVAL_MS / 1000):
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s:%s' % (frame.f_globals.get('__name__', code.co_filename),
+                                        code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample, name='profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.samples
+
+    def write(self, path):
+        """
+        Write the samples to path in the collapsed stack format, the most frequent first.
+        """
+        with open(path, 'w') as file:
+            for stack, count in self.samples.most_common():
+                file.write('%s %d\n' % (stack, count))
+
+
+def should_profile(profile_header=None):
+    """
+    Return True if the current request is to be profiled: PROFILE_DIR is set and the request
+    either carries PROFILE_TOKEN in its X-Profile header or is picked at PROFILE_RATE.
+    """
+    if not PROFILE_DIR:
+        return False
+    if PROFILE_TOKEN and profile_header == PROFILE_TOKEN:
+        return True
+    return PROFILE_RATE > 0 and random.random() < PROFILE_RATE
+
+
+def write_profile(profiler, endpoint):
+    """
+    Write a request's profile to PROFILE_DIR and return its path, or None if it could not be
+    written.
+    """
+    path = os.path.join(PROFILE_DIR, '%s-%d-%s.folded' % (
+        time.strftime('%Y%m%dT%H%M%S'), time.time_ns() % 10 ** 9, endpoint or 'unknown'))
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.write(path)
+    except OSError as e:
+        logger.warning('Could not write the profile of a %s request: %s', endpoint, e)
+        return None
+    metrics.count('gfp_profiles_total')
+    logger.info('Wrote the profile of a %s request to %s', endpoint, path)
+    return path
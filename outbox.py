@@ -0,0 +1,303 @@
+import json
+import logging
+import os
+import smtplib
+import tempfile
+import threading
+import time
+import uuid
+from email.message import EmailMessage
+
+from dotenv import load_dotenv
+
+from instrumentation import metrics
+
+load_dotenv()
+
+GMAIL_ADDRESS = os.environ.get('GMAIL_ADDRESS')
+GMAIL_PASSWORD = os.environ.get('GMAIL_PASSWORD')
+
+# SMTP server the outbox delivers through; with SMTP_SSL=false it talks plain SMTP, e.g. to a
+# local stand-in such as aiosmtpd, and logs in only if SMTP_USERNAME is set
+SMTP_HOST = os.environ.get('SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', '465'))
+SMTP_SSL = os.environ.get('SMTP_SSL', 'true').lower() in ('1', 'true', 'yes')
+SMTP_USERNAME = os.environ.get('SMTP_USERNAME', GMAIL_ADDRESS)
+SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD', GMAIL_PASSWORD)
+SMTP_TIMEOUT = float(os.environ.get('SMTP_TIMEOUT', '30'))
+# Directory of the queued messages, kept across restarts
+OUTBOX_DIR = os.environ.get('OUTBOX_DIR', 'data/outbox')
+# Deliver the queue from a thread of every web worker, started on its first request;
+# otherwise `python outbox.py` is the sender
+OUTBOX_SENDER = os.environ.get('OUTBOX_SENDER', 'false').lower() in ('1', 'true', 'yes')
+# Most messages sent over one connection per pass
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', '20'))
+# Seconds between passes over the queue when nothing new arrives
+OUTBOX_POLL_SECONDS = float(os.environ.get('OUTBOX_POLL_SECONDS', '30'))
+# Seconds before the first retry of a failed message, doubled on every further attempt
+OUTBOX_RETRY_SECONDS = float(os.environ.get('OUTBOX_RETRY_SECONDS', '60'))
+# Attempts after which a message is moved to the failed directory
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '8'))
+
+# Longest wait between two attempts at one message, in seconds
+MAX_RETRY_SECONDS = 6 * 3600
+# Errors that concern one message rather than the connection, so the batch goes on
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError,
+                  ValueError)
+# Messages claimed by a sender that died are returned to the queue after this many seconds
+CLAIM_TIMEOUT_SECONDS = 600
+
+logger = logging.getLogger(__name__)
+
+
+class SMTPTransport:
+    """
+    Delivers messages over one SMTP connection, opened and logged in on first use and kept
+    until close(), so a batch costs one handshake.
+    """
+
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, use_ssl=SMTP_SSL, username=SMTP_USERNAME,
+                 password=SMTP_PASSWORD, timeout=SMTP_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self._server = None
+
+    def send(self, message):
+        if self._server is None:
+            server_class = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+            server = server_class(self.host, self.port, timeout=self.timeout)
+            try:
+                if self.username:
+                    server.login(self.username, self.password)
+            except Exception:
+                server.close()
+                raise
+            self._server = server
+            metrics.count('gfp_outbox_connections_total')
+        try:
+            self._server.send_message(message)
+        except MESSAGE_ERRORS:
+            raise
+        except OSError:
+            # The connection is gone; the next message opens a new one
+            self.close()
+            raise
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                self._server.close()
+            self._server = None
+
+
+class Outbox:
+    """
+    A queue of email messages on disk, delivered in the background.
+
+    Every message is a JSON file in the pending directory. A sender claims a message by moving
+    it to the sending directory, which only one process can do, so several workers can share a
+    queue. Sent messages are deleted; a failed one goes back to pending with its next attempt
+    OUTBOX_RETRY_SECONDS later, doubling every time, and to the failed directory after
+    OUTBOX_MAX_ATTEMPTS.
+
+    Parameters:
+    directory (str): Where the queue is kept.
+    transport: Anything with send(EmailMessage) and close(), by default an SMTPTransport.
+    """
+
+    def __init__(self, directory=OUTBOX_DIR, transport=None, sender=GMAIL_ADDRESS,
+                 batch_size=OUTBOX_BATCH_SIZE, poll_seconds=OUTBOX_POLL_SECONDS,
+                 retry_seconds=OUTBOX_RETRY_SECONDS, max_attempts=OUTBOX_MAX_ATTEMPTS):
+        self.directory = directory
+        self.transport = transport if transport is not None else SMTPTransport()
+        self.sender = sender
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.retry_seconds = retry_seconds
+        self.max_attempts = max_attempts
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        for state in ('pending', 'sending', 'failed'):
+            os.makedirs(os.path.join(directory, state), exist_ok=True)
+
+    def _path(self, state, message_id):
+        return os.path.join(self.directory, state, message_id + '.json')
+
+    def _write(self, state, entry):
+        # Write to a temporary file first so a sender never reads a partial message
+        handle, temp_path = tempfile.mkstemp(dir=os.path.join(self.directory, state), suffix='.tmp')
+        with os.fdopen(handle, 'w') as file:
+            json.dump(entry, file)
+        os.replace(temp_path, self._path(state, entry['id']))
+
+    def enqueue(self, to_email, subject, content):
+        """
+        Queue a message and wake the sender. Returns the message ID.
+        """
+        entry = {'id': '%d-%s' % (time.time_ns(), uuid.uuid4().hex), 'to': to_email,
+                 'subject': subject, 'content': content, 'attempts': 0, 'next_attempt': 0,
+                 'error': None}
+        self._write('pending', entry)
+        metrics.count('gfp_outbox_messages_total', result='queued')
+        self._wake.set()
+        return entry['id']
+
+    def pending(self):
+        """
+        Return the IDs of the queued messages, oldest first.
+        """
+        return sorted(name[:-len('.json')] for name in os.listdir(os.path.join(self.directory,
+                                                                               'pending'))
+                      if name.endswith('.json'))
+
+    def _claim(self, message_id):
+        try:
+            os.replace(self._path('pending', message_id), self._path('sending', message_id))
+        except FileNotFoundError:
+            # Another sender claimed it first
+            return None
+        # The claim's time, for _recover
+        os.utime(self._path('sending', message_id))
+        try:
+            with open(self._path('sending', message_id), 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            logger.error('Moved unreadable outbox message %s aside: %s', message_id, e)
+            os.replace(self._path('sending', message_id), self._path('failed', message_id))
+            return None
+
+    def _recover(self):
+        """
+        Return messages claimed by a sender that died before sending them to the queue.
+        """
+        directory = os.path.join(self.directory, 'sending')
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            try:
+                if name.endswith('.json') \
+                        and time.time() - os.stat(path).st_mtime > CLAIM_TIMEOUT_SECONDS:
+                    os.replace(path, os.path.join(self.directory, 'pending', name))
+            except FileNotFoundError:
+                pass
+
+    def message(self, entry):
+        message = EmailMessage()
+        message.set_content(entry['content'])
+        message['Subject'] = entry['subject']
+        message['From'] = self.sender
+        message['To'] = entry['to']
+        return message
+
+    def deliver(self):
+        """
+        Send the messages that are due, up to batch_size of them over one connection.
+
+        Returns:
+        int: The number of messages sent.
+        """
+        with self._lock:
+            self._recover()
+            now = time.time()
+            sent = 0
+            claimed = 0
+            try:
+                for message_id in self.pending():
+                    if claimed == self.batch_size:
+                        break
+                    entry = self._claim(message_id)
+                    if entry is None:
+                        continue
+                    if entry['next_attempt'] > now:
+                        os.replace(self._path('sending', message_id),
+                                   self._path('pending', message_id))
+                        continue
+                    claimed += 1
+                    start = time.perf_counter()
+                    try:
+                        self.transport.send(self.message(entry))
+                    except MESSAGE_ERRORS as e:
+                        self._failed(entry, e)
+                        continue
+                    except Exception as e:
+                        # The server can't be reached: retry the rest of the batch later
+                        self._failed(entry, e)
+                        break
+                    metrics.observe('gfp_outbox_send_seconds', time.perf_counter() - start)
+                    metrics.count('gfp_outbox_messages_total', result='sent')
+                    os.remove(self._path('sending', message_id))
+                    sent += 1
+            finally:
+                if not claimed:
+                    # Nothing more to send: don't hold an idle connection open
+                    self.transport.close()
+                metrics.set('gfp_outbox_pending', len(self.pending()))
+            return sent
+
+    def _failed(self, entry, error):
+        entry['attempts'] += 1
+        entry['error'] = str(error)
+        if entry['attempts'] >= self.max_attempts:
+            logger.error('Gave up on outbox message %s to %s after %d attempts: %s', entry['id'],
+                         entry['to'], entry['attempts'], error)
+            metrics.count('gfp_outbox_messages_total', result='failed')
+            self._write('failed', entry)
+        else:
+            delay = min(self.retry_seconds * 2 ** (entry['attempts'] - 1), MAX_RETRY_SECONDS)
+            logger.warning('Could not send outbox message %s, retrying in %.0f s: %s',
+                           entry['id'], delay, error)
+            metrics.count('gfp_outbox_messages_total', result='retried')
+            entry['next_attempt'] = time.time() + delay
+            self._write('pending', entry)
+        os.remove(self._path('sending', entry['id']))
+
+    def run(self):
+        """
+        Deliver the queue until stop() is called: a pass on every enqueue() and every
+        poll_seconds, and right away again while full batches are going out.
+        """
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                sent = self.deliver()
+            except Exception:
+                logger.exception('Outbox pass failed')
+                sent = 0
+            if sent < self.batch_size:
+                self._wake.wait(self.poll_seconds)
+        self.transport.close()
+
+    def start(self):
+        """
+        Start delivering from a background thread, once.
+        """
+        with self._start_lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self.run, name='outbox', daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+outbox = Outbox()
+
+
+if __name__ == '__main__':
+    from instrumentation import configure_logging
+    configure_logging()
+    outbox.run()
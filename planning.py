@@ -0,0 +1,90 @@
+import numpy as np
+
+
+def ring_altitudes(ring_spacing, ring_start_alt, ring_end_alt):
+    """
+    Return the altitudes of the rings for the ring spacing selected on the index page
+    ('thousands', 'evenThousands' or 'oddThousands') between the start and end altitudes.
+    """
+    ring_start_alt = int(ring_start_alt)
+    ring_end_alt = int(ring_end_alt)
+    if ring_spacing == 'thousands':
+        return np.arange(ring_start_alt, ring_end_alt + 1000, 1000)
+    elif ring_spacing == 'evenThousands':
+        if (ring_start_alt/2000 == int(ring_start_alt/2000)):
+            return np.arange(ring_start_alt, ring_end_alt + 2000, 2000)
+        else:
+            return np.arange(ring_start_alt + 1000, ring_end_alt + 1000, 2000)
+    elif ring_spacing == 'oddThousands':
+        if (ring_start_alt/2000 == int(ring_start_alt/2000)):
+            return np.arange(ring_start_alt + 1000, ring_end_alt + 1000, 2000)
+        else:
+            return np.arange(ring_start_alt, ring_end_alt + 1000, 2000)
+    raise ValueError('Unknown ring spacing %r' % ring_spacing)
+
+
+def center_locations_for(turnpoints, selected_codes, location_names, altitudes, latitudes,
+                         longitudes, wind_speed, wind_direction, arrival_altitude_agl,
+                         wind_field=None):
+    """
+    Return the center locations for plot_map: the selected turnpoints followed by the
+    user-defined locations, one (lat, lon, wind_speed, wind_direction, arrival_altitude_msl,
+    name, type, description) tuple each.
+
+    With a wind_field, every location gets the forecast wind at its arrival altitude instead
+    of wind_speed and wind_direction.
+    """
+    center_locations = []
+
+    for i in turnpoints.indices(selected_codes):
+        center_locations.append(
+            (
+                float(turnpoints.lats[i]),
+                float(turnpoints.lons[i]),
+                wind_speed,
+                wind_direction,
+                float(turnpoints.elevs[i]) + arrival_altitude_agl, # Add arrival altitude AGL to the center location altitude
+                turnpoints.names[i],
+                turnpoints.styles[i],
+                turnpoints.descriptions[i]
+                )
+            )
+
+    # Append additional center locations
+    for i in range(len(location_names)):
+        # Check if any field in the current row is empty
+        if not (location_names[i] and altitudes[i] and latitudes[i] and longitudes[i]):
+            continue  # Skip processing this row if any field is empty
+        center_locations.append(
+            (
+                float(latitudes[i]),
+                float(longitudes[i]),
+                wind_speed,
+                wind_direction,
+                float(altitudes[i]) + arrival_altitude_agl,  # Add arrival altitude AGL to the center location altitude
+                location_names[i],
+                "A",  # Type for custom locations
+                "User-defined location"  # Description for custom locations
+            )
+        )
+
+    if wind_field is not None and center_locations:
+        lats, lons, _, _, arrival_altitudes = zip(*(location[:5] for location in center_locations))
+        speeds, directions = wind_field.speed_direction(lats, lons, arrival_altitudes)
+        center_locations = [(lat, lon, float(speed), float(direction)) + tuple(rest)
+                            for (lat, lon, _, _, *rest), speed, direction
+                            in zip(center_locations, speeds, directions)]
+
+    return center_locations
+
+
+def map_center(center_locations):
+    """
+    Return the average latitude and longitude of the center locations.
+    """
+    if not center_locations:
+        raise ValueError('At least one location is required')
+    total_lat = sum(location[0] for location in center_locations)
+    total_lon = sum(location[1] for location in center_locations)
+    return total_lat / len(center_locations), total_lon / len(center_locations)
+
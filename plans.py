@@ -0,0 +1,350 @@
+import ast
+import base64
+import hashlib
+import json
+import math
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Tuple
+
+from planning import ring_altitudes, center_locations_for
+from wind_field import forecast_hours, get_wind_field
+
+# Directory where plans are kept so that every worker can serve every plan ID
+PLAN_STORE_DIR = os.environ.get('PLAN_STORE_DIR', 'plans')
+# Number of plans kept in memory per worker
+PLAN_CACHE_SIZE = int(os.environ.get('PLAN_CACHE_SIZE', '1024'))
+# Number of plan files kept in PLAN_STORE_DIR; the least recently saved ones are removed
+PLAN_STORE_MAX_FILES = int(os.environ.get('PLAN_STORE_MAX_FILES', '10000'))
+
+# Most ring bands and most locations (selected and user-defined together) a plan may have
+MAX_PLAN_BANDS = int(os.environ.get('MAX_PLAN_BANDS', '50'))
+MAX_PLAN_LOCATIONS = int(os.environ.get('MAX_PLAN_LOCATIONS', '100'))
+
+RING_SPACINGS = ('thousands', 'evenThousands', 'oddThousands')
+# Feet between rings for every ring spacing
+RING_SPACING_FEET = {'thousands': 1000, 'evenThousands': 2000, 'oddThousands': 2000}
+
+
+class PlanError(ValueError):
+    """Raised for missing or invalid flight plan inputs."""
+
+
+@dataclass(frozen=True)
+class CustomLocation:
+    name: str
+    altitude: float
+    latitude: float
+    longitude: float
+
+
+@dataclass(frozen=True)
+class FlightPlan:
+    """
+    Everything needed to draw a map: the glider, the wind, the ring band and the locations.
+
+    safety_margin is a fraction (0.2 for 20%), altitudes are in feet and the arrival altitude
+    is above ground level. wind_forecast names a forecast hour in WIND_FIELD_DIR whose winds
+    replace wind_speed and wind_direction.
+    """
+    selected_glider: str
+    glide_ratio: float
+    vg: float
+    safety_margin: float
+    wind_speed: float
+    wind_direction: float
+    arrival_altitude: float
+    ring_spacing: str
+    ring_start_alt: int
+    ring_end_alt: int
+    selected_codes: Tuple[str, ...] = ()
+    custom_locations: Tuple[CustomLocation, ...] = field(default=())
+    wind_forecast: str = ''
+
+    def __post_init__(self):
+        if not self.glide_ratio > 0:
+            raise PlanError('The glide ratio must be positive')
+        if not self.vg > 0:
+            raise PlanError('The best glide speed must be positive')
+        if not 0 <= self.safety_margin < 1:
+            raise PlanError('The safety margin must be between 0 and 100%')
+        if not self.wind_speed >= 0:
+            raise PlanError('The wind speed cannot be negative')
+        if not 0 <= self.wind_direction <= 360:
+            raise PlanError('The wind direction must be between 0 and 360 degrees')
+        if not math.isfinite(self.arrival_altitude):
+            raise PlanError('The arrival altitude must be a number')
+        if self.ring_spacing not in RING_SPACINGS:
+            raise PlanError('Unknown ring spacing %r' % self.ring_spacing)
+        if self.ring_start_alt > self.ring_end_alt:
+            raise PlanError('The first ring altitude is above the last one')
+        # Rings are drawn at both ends, so there is one more ring than spacings between them
+        if (self.ring_end_alt - self.ring_start_alt) // RING_SPACING_FEET[self.ring_spacing] + 1 \
+                > MAX_PLAN_BANDS:
+            raise PlanError('Too many rings: at most %d can be drawn' % MAX_PLAN_BANDS)
+        if len(self.selected_codes) + len(self.custom_locations) > MAX_PLAN_LOCATIONS:
+            raise PlanError('Too many locations: at most %d can be drawn' % MAX_PLAN_LOCATIONS)
+        for location in self.custom_locations:
+            if not math.isfinite(location.altitude):
+                raise PlanError('Invalid altitude for %s' % location.name)
+            if not (-90 <= location.latitude <= 90 and -180 <= location.longitude <= 180):
+                raise PlanError('Invalid coordinates for %s' % location.name)
+        if not (self.selected_codes or self.custom_locations):
+            raise PlanError('Select at least one location from the table or enter a location')
+
+    @property
+    def plan_id(self):
+        """
+        Short ID derived from the plan's content, so the same plan always gets the same ID.
+        """
+        digest = hashlib.sha256(self.to_json().encode('utf-8')).digest()
+        return base64.urlsafe_b64encode(digest[:9]).decode('ascii')
+
+    def polygon_altitudes(self):
+        return ring_altitudes(self.ring_spacing, self.ring_start_alt, self.ring_end_alt)
+
+    def wind_field(self):
+        """
+        Return the WindField of the plan's forecast hour, or None when it uses a single wind.
+        """
+        if not self.wind_forecast:
+            return None
+        try:
+            return get_wind_field(self.wind_forecast)
+        except ValueError as e:
+            raise PlanError(str(e))
+
+    def center_locations(self, turnpoints):
+        return center_locations_for(turnpoints, self.selected_codes,
+                                    [location.name for location in self.custom_locations],
+                                    [location.altitude for location in self.custom_locations],
+                                    [location.latitude for location in self.custom_locations],
+                                    [location.longitude for location in self.custom_locations],
+                                    self.wind_speed, self.wind_direction, self.arrival_altitude,
+                                    self.wind_field())
+
+    def to_json(self):
+        data = asdict(self)
+        # Leave out the forecast when unused so plans made before it keep their IDs
+        if not data['wind_forecast']:
+            del data['wind_forecast']
+        return json.dumps(data, sort_keys=True, separators=(',', ':'))
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        data['selected_codes'] = tuple(data.get('selected_codes', ()))
+        data['custom_locations'] = tuple(CustomLocation(**location)
+                                         for location in data.get('custom_locations', ()))
+        return cls(**data)
+
+    @classmethod
+    def from_fields(cls, get, getlist, gliders):
+        """
+        Build a plan from the index form's fields, read with get(name) and getlist(name).
+
+        gliders is the GliderRegistry used to resolve the selected glider's ID.
+        """
+        try:
+            selected_glider = get('gliderSelection') or 'other'
+            if selected_glider != 'other':
+                glider = gliders.lookup(selected_glider)
+                if glider is None:
+                    raise PlanError('Unknown glider %r' % selected_glider)
+                selected_glider = glider['name']
+                glide_ratio, vg = float(glider['glide_ratio']), float(glider['vg'])
+            else:
+                glide_ratio = float(get('glideRatio'))
+                vg = float(get('vg'))
+
+            custom_locations = []
+            for name, altitude, latitude, longitude in zip(getlist('locationName'),
+                                                           getlist('altitude'),
+                                                           getlist('latitude'),
+                                                           getlist('longitude')):
+                # Skip rows with an empty field, as the form does
+                if name and altitude and latitude and longitude:
+                    custom_locations.append(CustomLocation(name, float(altitude), float(latitude),
+                                                           float(longitude)))
+
+            wind_forecast = get('windForecast') or ''
+            if wind_forecast and wind_forecast not in forecast_hours():
+                raise PlanError('No wind forecast for %r' % wind_forecast)
+
+            return cls(
+                selected_glider=selected_glider,
+                glide_ratio=glide_ratio,
+                vg=vg,
+                safety_margin=float(get('safetyMargin')) / 100,
+                wind_speed=float(get('windSpeed')),
+                wind_direction=float(get('windDirection')),
+                arrival_altitude=float(get('arrivalAltitude')),
+                ring_spacing=get('ringSpacingSelection'),
+                ring_start_alt=int(get('ringStartAlt')),
+                ring_end_alt=int(get('ringEndAlt')),
+                selected_codes=tuple(dict.fromkeys(getlist('selectedRows'))),
+                custom_locations=tuple(custom_locations),
+                wind_forecast=wind_forecast,
+            )
+        except (TypeError, ValueError) as e:
+            if isinstance(e, PlanError):
+                raise
+            raise PlanError('Invalid flight parameters: %s' % e)
+
+    @classmethod
+    def from_form(cls, form, gliders):
+        """
+        Build a plan from the index page's POSTed form.
+        """
+        return cls.from_fields(form.get, lambda name: form.getlist(name + '[]'), gliders)
+
+    @classmethod
+    def from_json(cls, data, gliders):
+        """
+        Build a plan from a JSON object using the index form's field names, with lists for
+        selectedRows and the user-defined location fields.
+        """
+        if not isinstance(data, dict):
+            raise PlanError('Expected a JSON object')
+
+        def get(name):
+            value = data.get(name)
+            return None if value is None else str(value)
+
+        def getlist(name):
+            values = data.get(name) or []
+            if not isinstance(values, list):
+                raise PlanError('%s must be a list' % name)
+            return [str(value) for value in values]
+
+        return cls.from_fields(get, getlist, gliders)
+
+    @classmethod
+    def from_legacy_args(cls, args):
+        """
+        Build a plan from the query string of the old /map?... links.
+        """
+        try:
+            selected_codes = ast.literal_eval(args.get('selected_rows', '[]'))
+            custom_locations = []
+            for name, altitude, latitude, longitude in zip(args.getlist('location_names'),
+                                                           args.getlist('altitudes'),
+                                                           args.getlist('latitudes'),
+                                                           args.getlist('longitudes')):
+                if name and altitude and latitude and longitude:
+                    custom_locations.append(CustomLocation(name, float(altitude), float(latitude),
+                                                           float(longitude)))
+            return cls(
+                selected_glider=args.get('selected_glider') or 'other',
+                glide_ratio=float(args.get('glide_ratio')),
+                vg=float(args.get('vg')),
+                safety_margin=float(args.get('safety_margin')),
+                wind_speed=float(args.get('wind_speed')),
+                wind_direction=float(args.get('wind_direction')),
+                arrival_altitude=float(args.get('arrival_altitude')),
+                ring_spacing=args.get('ring_spacing'),
+                ring_start_alt=int(args.get('ring_start_alt')),
+                ring_end_alt=int(args.get('ring_end_alt')),
+                selected_codes=tuple(dict.fromkeys(str(code) for code in selected_codes)),
+                custom_locations=tuple(custom_locations),
+            )
+        except (TypeError, ValueError, SyntaxError) as e:
+            if isinstance(e, PlanError):
+                raise
+            raise PlanError('Invalid map link: %s' % e)
+
+
+class PlanStore:
+    """
+    Plans by plan ID, kept in a bounded in-memory LRU and, if a directory is given, as JSON files
+    shared by all workers. The directory keeps at most max_files plans: saving a new one
+    removes those saved least recently.
+    """
+
+    def __init__(self, directory=PLAN_STORE_DIR, max_entries=PLAN_CACHE_SIZE,
+                 max_files=PLAN_STORE_MAX_FILES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_files = max_files
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, plan_id):
+        return os.path.join(self.directory, plan_id + '.json')
+
+    def _remember(self, plan_id, plan):
+        with self._lock:
+            self._plans[plan_id] = plan
+            self._plans.move_to_end(plan_id)
+            while len(self._plans) > self.max_entries:
+                self._plans.popitem(last=False)
+
+    def save(self, plan):
+        """
+        Store the plan and return its ID.
+        """
+        plan_id = plan.plan_id
+        self._remember(plan_id, plan)
+        if not self.directory:
+            return plan_id
+        path = self._path(plan_id)
+        try:
+            # Saving a plan again keeps it among the most recent ones
+            os.utime(path)
+        except FileNotFoundError:
+            # Write to a temporary file first so other workers never read a partial plan
+            handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(handle, 'w') as file:
+                file.write(plan.to_json())
+            os.replace(temp_path, path)
+            self._prune()
+        return plan_id
+
+    def _prune(self):
+        """
+        Remove the plan files saved least recently until at most max_files are left.
+        """
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith('.json'):
+                    try:
+                        files.append((entry.stat().st_mtime_ns, entry.path))
+                    except FileNotFoundError:
+                        pass
+        if len(files) <= self.max_files:
+            return
+        files.sort()
+        for _, path in files[:len(files) - self.max_files]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Another worker pruned it first
+                pass
+
+    def get(self, plan_id):
+        """
+        Return the plan with this ID, or None.
+        """
+        with self._lock:
+            plan = self._plans.get(plan_id)
+        if plan is not None or not self.directory:
+            return plan
+        # IDs are URL-safe base64, so they can't escape the directory
+        if not plan_id or not all(c.isalnum() or c in '-_' for c in plan_id):
+            return None
+        try:
+            with open(self._path(plan_id), 'r') as file:
+                plan = FlightPlan.from_dict(json.load(file))
+        except (OSError, ValueError, TypeError):
+            return None
+        self._remember(plan_id, plan)
+        return plan
+
+
+plan_store = PlanStore()
@@ -0,0 +1,124 @@
+import os
+
+import numpy as np
+
+from rings import range_per_foot, initial_bearings
+from terrain import terrain_model
+
+# Most turnpoints returned by one reachability query
+REACHABLE_LIMIT = int(os.environ.get('REACHABLE_LIMIT', '50'))
+
+
+def great_circle_points(lats1, lons1, lats2, lons2, fractions):
+    """
+    Return the points at fractions of the way along the great circles from (lats1, lons1) to
+    (lats2, lons2).
+
+    Parameters:
+    lats1, lons1, lats2, lons2 (array, shape (N,)): The end points in degrees.
+    fractions (array, shape (S, N)): How far along each path, from 0 to 1.
+
+    Returns:
+    tuple of arrays, shape (S, N): Latitudes and longitudes in degrees.
+    """
+    def unit_vectors(lats, lons):
+        lats, lons = np.radians(lats), np.radians(lons)
+        return np.stack((np.cos(lats) * np.cos(lons), np.cos(lats) * np.sin(lons), np.sin(lats)))
+
+    start, end = unit_vectors(lats1, lons1), unit_vectors(lats2, lons2)
+    angle = np.arccos(np.clip((start * end).sum(axis=0), -1.0, 1.0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sin_angle = np.sin(angle)
+        a = np.where(sin_angle > 0, np.sin((1 - fractions) * angle) / sin_angle, 1 - fractions)
+        b = np.where(sin_angle > 0, np.sin(fractions * angle) / sin_angle, fractions)
+    points = a[None] * start[:, None] + b[None] * end[:, None]
+    return (np.degrees(np.arctan2(points[2], np.hypot(points[0], points[1]))),
+            np.degrees(np.arctan2(points[1], points[0])))
+
+
+def clear_of_terrain(lat, lon, lats, lons, distances, arrival_altitudes, unit_ranges, terrain):
+    """
+    Return which of the glide paths from (lat, lon) to the turnpoints stay clear of the terrain.
+
+    Like the terrain cut of the rings (terrain.TerrainModel.ray_limits), the glider must be
+    arrival_altitude + d / unit_range feet high at d nautical miles from the turnpoint, and
+    that path must keep the terrain's clearance at every sample along the way.
+    """
+    clear = np.ones(lats.shape, dtype=bool)
+    if lats.size == 0:
+        return clear
+    steps = max(int(np.ceil(distances.max() / terrain.step)), 1)
+    sample_distances = terrain.step * np.arange(1, steps + 1)[:, None]
+    inside = sample_distances < distances[None, :]
+    fractions = np.where(inside, sample_distances / np.maximum(distances, 1e-9)[None, :], 0.0)
+    sample_lats, sample_lons = great_circle_points(lats, lons, np.full(lats.shape, lat),
+                                                   np.full(lons.shape, lon), fractions)
+    path = arrival_altitudes[None, :] + sample_distances / unit_ranges[None, :]
+    blocked = inside & (path < terrain.elevations(sample_lats, sample_lons) + terrain.clearance)
+    clear &= ~blocked.any(axis=0)
+    return clear
+
+
+def reachable_turnpoints(turnpoints, lat, lon, altitude, glide_ratio, safety_margin, Vg,
+                         wind_speed, wind_direction, arrival_altitude_agl, landable_only=True,
+                         limit=REACHABLE_LIMIT, terrain=terrain_model):
+    """
+    Find the turnpoints a glider at (lat, lon) and altitude can glide to in a wind.
+
+    This is the reverse of the rings: instead of the altitude needed around every location, the
+    arrival altitude at every turnpoint from one position. The candidates come from the spatial
+    index, within the farthest any turnpoint could be reached (with the wind straight behind
+    and down to the lowest turnpoint); the wind-corrected range to every candidate is then
+    evaluated in one vectorized pass, with the same glide model as the rings.
+
+    Parameters:
+    turnpoints (TurnpointRepository): The turnpoint database.
+    lat, lon (float): The glider's position in degrees.
+    altitude (float): The glider's altitude in feet MSL.
+    glide_ratio, safety_margin, Vg: The glider, as for rings.range_per_foot.
+    wind_speed (float): Wind speed in knots.
+    wind_direction (float): Direction the wind comes from in degrees.
+    arrival_altitude_agl (float): Height above a turnpoint to arrive at, in feet.
+    landable_only (bool): Only consider airfields and outlandings (turnpoints.LANDABLE_STYLES).
+    limit (int): Most turnpoints to return.
+    terrain (TerrainModel): If given, paths that come within its clearance of the terrain are
+      not reachable.
+
+    Returns:
+    tuple of arrays: (indices, distances in nautical miles, courses to fly in degrees,
+    altitudes required in feet MSL), the largest margin (altitude - altitude required) first.
+    """
+    empty = (np.empty(0, dtype=np.intp),) + (np.empty(0),) * 3
+    if len(turnpoints) == 0:
+        return empty
+    height = altitude - arrival_altitude_agl - float(np.min(turnpoints.elevs))
+    best_range = range_per_foot(glide_ratio, safety_margin, Vg, [wind_speed], [wind_direction],
+                                [wind_direction, (wind_direction + 180) % 360]).max()
+    if height <= 0 or best_range <= 0:
+        return empty
+
+    indices, distances = turnpoints.within_radius(lat, lon, height * best_range)
+    if landable_only:
+        keep = turnpoints.landable[indices]
+        indices, distances = indices[keep], distances[keep]
+    lats, lons = turnpoints.lats[indices], turnpoints.lons[indices]
+
+    # The rings' heading is the bearing from the turnpoint out to the glider
+    headings = initial_bearings(lats, lons, lat, lon)
+    unit_ranges = range_per_foot(glide_ratio, safety_margin, Vg, [wind_speed], [wind_direction],
+                                 headings)[0]
+    arrival_altitudes = turnpoints.elevs[indices] + arrival_altitude_agl
+    with np.errstate(divide='ignore'):
+        required = np.where(unit_ranges > 0, arrival_altitudes + distances / unit_ranges, np.inf)
+    reachable = required <= altitude
+    if terrain is not None:
+        candidates = np.flatnonzero(reachable)
+        reachable[candidates] = clear_of_terrain(lat, lon, lats[candidates], lons[candidates],
+                                                 distances[candidates],
+                                                 arrival_altitudes[candidates],
+                                                 unit_ranges[candidates], terrain)
+
+    order = np.flatnonzero(reachable)
+    order = order[np.argsort(required[order], kind='stable')][:limit]
+    courses = initial_bearings(lat, lon, lats[order], lons[order])
+    return indices[order], distances[order], courses, required[order]
@@ -0,0 +1,79 @@
+import gzip
+import json
+
+from flask import Response, request
+
+from instrumentation import stage
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+# Responses smaller than this are sent uncompressed
+COMPRESS_MIN_SIZE = 1024
+# Content encodings offered, in order of preference when brotli is installed
+ENCODINGS = ('br', 'gzip')
+
+
+def encoded_etag(etag, encoding):
+    """
+    Return the ETag of one encoding of a response. A gzip or brotli body differs byte for byte
+    from the uncompressed one, so each encoding gets its own strong ETag, e.g. "<hash>-br".
+    """
+    return '%s-%s' % (etag, encoding) if encoding else etag
+
+
+def not_modified(etag):
+    """
+    Return a 304 response if the request's If-None-Match matches etag in any encoding, as a
+    strong or a weak (W/, as proxies that recompress send) ETag, otherwise None.
+    """
+    if etag is None:
+        return None
+    for encoding in (None,) + ENCODINGS:
+        tag = encoded_etag(etag, encoding)
+        if request.if_none_match.contains_weak(tag):
+            response = Response(status=304)
+            response.set_etag(tag)
+            response.vary.add('Accept-Encoding')
+            return response
+    return None
+
+
+def compressed_response(body, mimetype, etag=None):
+    """
+    Return body (bytes) as a response, compressed with brotli or gzip if the client accepts it.
+    The ETag gets the encoding as a suffix (see encoded_etag).
+    """
+    encodings = list(ENCODINGS) if brotli is not None else ['gzip']
+    encoding = request.accept_encodings.best_match(encodings) if len(body) >= COMPRESS_MIN_SIZE else None
+    if encoding:
+        with stage('compress'):
+            if encoding == 'br':
+                body = brotli.compress(body)
+            else:
+                body = gzip.compress(body, compresslevel=6)
+
+    response = Response(body, mimetype=mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    if etag is not None:
+        response.set_etag(encoded_etag(etag, encoding))
+    return response
+
+
+def json_response(payload, etag=None):
+    """
+    Return payload as a compact, optionally compressed JSON response with a strong ETag per
+    encoding.
+    """
+    body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return compressed_response(body, 'application/json', etag)
+
+
+def json_error(message, status=400):
+    response = json_response({'error': message})
+    response.status_code = status
+    return response
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import shapely
+
+from instrumentation import metrics
+
+# Number of ring geometries kept in memory per worker
+RING_CACHE_SIZE = int(os.environ.get('RING_CACHE_SIZE', '128'))
+# Optional directory for a second cache tier shared by all workers and kept across restarts
+RING_CACHE_DIR = os.environ.get('RING_CACHE_DIR')
+
+
+def canonical_key(**inputs):
+    """
+    Return a stable hash of the inputs, independent of argument order and NumPy scalar types.
+    """
+    def normalize(value):
+        if isinstance(value, (list, tuple)):
+            return [normalize(item) for item in value]
+        if hasattr(value, 'tolist'):
+            return normalize(value.tolist())
+        if isinstance(value, float):
+            return repr(round(value, 9))
+        return value
+
+    payload = json.dumps({name: normalize(value) for name, value in inputs.items()},
+                         sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class GeometryCache:
+    """
+    LRU cache of merged ring polygons, keyed by canonical_key of the ring inputs.
+
+    Values are lists with one list of shapely Polygons per altitude. Entries are kept in
+    memory up to max_entries; if a directory is given they are also written there, as the
+    WKB of a GeometryCollection with one GeometryCollection per altitude, so that other
+    workers, and the worker after a restart, can reuse them.
+    """
+
+    def __init__(self, max_entries=RING_CACHE_SIZE, directory=RING_CACHE_DIR):
+        self.max_entries = max_entries
+        self.directory = directory
+        self._entries = OrderedDict()
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.wkb')
+
+    def _count(self, key, hit):
+        metrics.count('gfp_geometry_cache_requests_total', result='hit' if hit else 'miss')
+        counts = self._counts.pop(key, None) or [0, 0]
+        counts[0 if hit else 1] += 1
+        self._counts[key] = counts
+        # Keep the counters for a bounded number of recently used keys
+        while len(self._counts) > 4 * max(self.max_entries, 1):
+            self._counts.popitem(last=False)
+
+    def _remember(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        """
+        Return the cached geometry for key, or None, and record the hit or miss.
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self._count(key, hit=True)
+                return value
+
+        if self.directory:
+            try:
+                with open(self._path(key), 'rb') as file:
+                    bands = shapely.get_parts(shapely.from_wkb(file.read()))
+                value = [list(shapely.get_parts(band)) for band in bands]
+            except (OSError, shapely.errors.ShapelyError):
+                value = None
+
+        with self._lock:
+            self._count(key, hit=value is not None)
+            if value is not None:
+                self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        """
+        Store the geometry for key in memory and, if configured, on disk.
+        """
+        with self._lock:
+            self._remember(key, value)
+
+        if self.directory:
+            payload = shapely.to_wkb(shapely.geometrycollections(
+                [shapely.geometrycollections(polygons) for polygons in value]))
+            # Write to a temporary file first so other workers never read a partial entry
+            handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            try:
+                with os.fdopen(handle, 'wb') as file:
+                    file.write(payload)
+                os.replace(temp_path, self._path(key))
+            except OSError:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached geometry for key, calling compute() and caching its result on a miss.
+        """
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def stats(self):
+        """
+        Return {key: {'hits': n, 'misses': n, 'cached': bool}} for recently used keys.
+        """
+        with self._lock:
+            return {key: {'hits': hits, 'misses': misses, 'cached': key in self._entries}
+                    for key, (hits, misses) in self._counts.items()}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._counts.clear()
+
+
+geometry_cache = GeometryCache()
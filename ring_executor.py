@@ -0,0 +1,84 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import shapely
+
+from ring_union import union_bands
+
+# Number of worker processes used to merge the altitude bands; 0 or 1 merges them in the
+# request's own process
+RING_WORKERS = int(os.environ.get('RING_WORKERS', '0'))
+# Smaller jobs (bands x rings) are merged in process, where they finish faster than the
+# round trip to the pool
+RING_PARALLEL_MIN_RINGS = int(os.environ.get('RING_PARALLEL_MIN_RINGS', '2000'))
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(workers=RING_WORKERS):
+    """
+    Return the process pool of this worker, creating it on first use.
+
+    The pool is kept for the life of the process so that every request reuses it. A pool
+    inherited from a parent process (e.g. a gunicorn master that preloaded the app) is not
+    reused in the forked worker.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=workers)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _union_band_chunk(ring_vertices, ring_reachable, nested):
+    """
+    Merge a contiguous chunk of bands in a pool process. The rings arrive as NumPy arrays and the
+    merged polygons are returned as WKB, so no shapely objects are pickled either way.
+    """
+    return [shapely.to_wkb(np.array(merged_polygons, dtype=object))
+            for merged_polygons in union_bands(ring_vertices, ring_reachable, nested)]
+
+
+def union_bands_parallel(ring_vertices, ring_reachable, nested=False, workers=RING_WORKERS):
+    """
+    Same as ring_union.union_bands, with the bands spread over a process pool.
+
+    The bands are split into one contiguous chunk per worker, so nested bands within a chunk
+    still start from the clusters of the band below. Small jobs, a pool size of 0 or 1, and a
+    broken pool all fall back to merging in this process.
+    """
+    band_count, location_count = ring_reachable.shape
+    if workers <= 1 or band_count < 2 or band_count * location_count < RING_PARALLEL_MIN_RINGS:
+        return union_bands(ring_vertices, ring_reachable, nested)
+
+    chunks = [chunk for chunk in np.array_split(np.arange(band_count), min(workers, band_count))
+              if chunk.size]
+    try:
+        pool = get_pool(workers)
+        futures = [pool.submit(_union_band_chunk,
+                               np.ascontiguousarray(ring_vertices[chunk[0]:chunk[-1] + 1]),
+                               np.ascontiguousarray(ring_reachable[chunk[0]:chunk[-1] + 1]),
+                               nested)
+                   for chunk in chunks]
+        merged_bands = []
+        for future in futures:
+            merged_bands.extend(list(shapely.from_wkb(wkb)) for wkb in future.result())
+        return merged_bands
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); start a fresh pool next time
+        shutdown_pool()
+        return union_bands(ring_vertices, ring_reachable, nested)
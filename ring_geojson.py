@@ -0,0 +1,166 @@
+import json
+
+import numpy as np
+from branca.element import MacroElement, Template
+from folium.elements import JSCSSMixin
+from folium.map import Layer
+
+# Decimal places kept in GeoJSON coordinates; 5 places is about 1 m
+GEOJSON_PRECISION = 5
+# Grid size used to quantize TopoJSON coordinates
+TOPOJSON_QUANTIZATION = 100000
+
+TOPOJSON_CLIENT_JS = 'https://unpkg.com/topojson-client@3/dist/topojson-client.min.js'
+
+RING_COLOR = 'blue'
+RING_LABEL_STYLE = ('font-size: 12pt; color: yellow; text-shadow: -1px 0 black, 0 1px black, '
+                    '1px 0 black, 0 -1px black;')
+
+
+def _altitude_value(altitude):
+    altitude = float(altitude)
+    return int(altitude) if altitude.is_integer() else altitude
+
+
+def _lon_lat(points, precision):
+    # Ring polygons are [lat, lon]; GeoJSON wants [lon, lat]
+    return np.round(np.asarray(points, dtype=np.float64)[:, ::-1], precision)
+
+
+def rings_feature_collection(polygon_altitudes, merged_rings, label_locations=None,
+                             precision=GEOJSON_PRECISION):
+    """
+    Return the merged rings of every band as one GeoJSON FeatureCollection.
+
+    Each band is one MultiPolygon Feature with its altitude as a property. Only the ring exteriors
+    are kept, as on the map.
+
+    Parameters:
+    polygon_altitudes (list): The altitude of every band.
+    merged_rings (list): One list of merged shapely Polygons ([lat, lon] coordinates) per band.
+    label_locations (function): Optional polygon -> [[lat, lon], ...] function; the label
+      positions of every band are added as a 'labels' property.
+    precision (int): Decimal places kept in the coordinates.
+
+    Returns:
+    dict: The FeatureCollection.
+    """
+    features = []
+    for altitude, merged_polygons in zip(polygon_altitudes, merged_rings):
+        if not merged_polygons:
+            continue
+        properties = {'altitude': _altitude_value(altitude)}
+        if label_locations is not None:
+            properties['labels'] = [np.round(label, precision).tolist()
+                                    for polygon in merged_polygons
+                                    for label in label_locations(polygon)]
+        features.append({
+            'type': 'Feature',
+            'properties': properties,
+            'geometry': {
+                'type': 'MultiPolygon',
+                'coordinates': [[_lon_lat(polygon.exterior.coords, precision).tolist()]
+                                for polygon in merged_polygons],
+            },
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def rings_topology(feature_collection, quantization=TOPOJSON_QUANTIZATION):
+    """
+    Encode a rings FeatureCollection as quantized, delta-encoded TopoJSON.
+
+    Every ring becomes one arc; the object holding the bands is named 'rings'.
+    """
+    rings = [np.asarray(ring, dtype=np.float64)
+             for feature in feature_collection['features']
+             for polygon in feature['geometry']['coordinates']
+             for ring in polygon]
+    if rings:
+        points = np.concatenate(rings)
+        low, high = points.min(axis=0), points.max(axis=0)
+    else:
+        low = high = np.zeros(2)
+    scale = np.where(high > low, (high - low) / (quantization - 1), 1.0)
+
+    arcs = []
+    geometries = []
+    for feature in feature_collection['features']:
+        polygons = []
+        for polygon in feature['geometry']['coordinates']:
+            arc_indexes = []
+            for ring in polygon:
+                quantized = np.round((np.asarray(ring) - low) / scale).astype(np.int64)
+                deltas = np.diff(quantized, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+                arc_indexes.append([len(arcs)])
+                arcs.append(deltas.tolist())
+            polygons.append(arc_indexes)
+        geometries.append({'type': 'MultiPolygon', 'arcs': polygons,
+                           'properties': feature['properties']})
+
+    return {
+        'type': 'Topology',
+        'transform': {'scale': scale.tolist(), 'translate': low.tolist()},
+        'objects': {'rings': {'type': 'GeometryCollection', 'geometries': geometries}},
+        'arcs': arcs,
+    }
+
+
+class RingLayer(JSCSSMixin, Layer):
+    """
+    Folium layer that draws every ring band from one embedded GeoJSON (or TopoJSON) payload,
+    styled and labelled in the browser from each band's altitude.
+
+    The rings and their labels form one layer, so the rings of several scenarios can be added to
+    one map with control=True and toggled from its LayerControl.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }}_data = {{ this.payload }};
+        {% if this.topojson %}
+        {{ this.get_name() }}_data = topojson.feature(
+            {{ this.get_name() }}_data, {{ this.get_name() }}_data.objects.rings);
+        {% endif %}
+        var {{ this.get_name() }}_colors = {{ this.colors }};
+        var {{ this.get_name() }} = L.featureGroup();
+        L.geoJSON({{ this.get_name() }}_data, {
+            style: function (feature) {
+                return {
+                    color: {{ this.get_name() }}_colors[feature.properties.altitude] || {{ this.default_color|tojson }},
+                    fill: false
+                };
+            },
+            onEachFeature: function (feature, layer) {
+                (feature.properties.labels || []).forEach(function (location) {
+                    L.marker(location, {
+                        icon: L.divIcon({
+                            className: 'empty',
+                            iconSize: [150, 36],
+                            iconAnchor: [0, 0],
+                            html: '<div style="{{ this.label_style }}">'
+                                + feature.properties.altitude + ' ft</div>'
+                        })
+                    }).addTo({{ this.get_name() }});
+                });
+            }
+        }).addTo({{ this.get_name() }});
+        {{ this.get_name() }}.addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+        """)
+
+    default_js = []
+
+    def __init__(self, feature_collection, topojson=False, colors=None, default_color=RING_COLOR,
+                 name=None, control=False, show=True):
+        super().__init__(name=name, overlay=True, control=control, show=show)
+        self._name = 'RingLayer'
+        self.topojson = topojson
+        data = rings_topology(feature_collection) if topojson else feature_collection
+        self.payload = json.dumps(data, separators=(',', ':'))
+        self.colors = json.dumps({_altitude_value(altitude): color
+                                  for altitude, color in (colors or {}).items()})
+        self.default_color = default_color
+        self.label_style = RING_LABEL_STYLE
+        if topojson:
+            self.default_js = [('topojson-client', TOPOJSON_CLIENT_JS)]
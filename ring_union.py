@@ -0,0 +1,161 @@
+import numpy as np
+import shapely
+from shapely.geometry import MultiPolygon, Polygon
+
+
+def connected_components(count, left, right, labels=None):
+    """
+    Label the connected components of a graph given as edge arrays.
+
+    Parameters:
+    count (int): Number of nodes.
+    left, right (array): Node indices of the edges.
+    labels (array): Optional starting labels, e.g. the components of a subgraph.
+
+    Returns:
+    array: For every node, the smallest node index of its component.
+    """
+    labels = np.arange(count) if labels is None else labels.copy()
+    while True:
+        # Hook the root of both ends of every edge onto the smaller root...
+        left_roots, right_roots = labels[left], labels[right]
+        smallest = np.minimum(left_roots, right_roots)
+        updated = labels.copy()
+        np.minimum.at(updated, left_roots, smallest)
+        np.minimum.at(updated, right_roots, smallest)
+        # ...then jump pointers until every node points at its root again
+        while True:
+            jumped = updated[updated]
+            if np.array_equal(jumped, updated):
+                break
+            updated = jumped
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+
+def polygon_parts(geometry):
+    """
+    Return the Polygons with a non-zero area of a union result.
+    """
+    parts = list(geometry.geoms) if isinstance(geometry, MultiPolygon) else [geometry]
+    return [part for part in parts if isinstance(part, Polygon) and part.area > 0]
+
+
+def union_bands(ring_vertices, ring_reachable, nested=False):
+    """
+    Merge the overlapping rings of every altitude band.
+
+    Instead of one unary_union over every ring, the rings of a band are grouped into clusters of
+    rings that overlap each other, and each cluster is unioned on its own; rings that overlap
+    nothing are passed through untouched. Candidate pairs come from one STRtree over the ring
+    bounding boxes of all bands and are narrowed per band with a bounding-circle test, so only
+    nearby rings are ever tested against each other. Candidates are tested closest first, in
+    batches, and pairs that earlier batches already put in the same cluster are skipped.
+
+    If nested is set the rings of each location only grow with the band, so rings that overlap in
+    one band also overlap in the next. The clusters of the previous band are then the starting
+    point for the next one, and a cluster whose rings all stayed the same (as rings cut all
+    around by the terrain do) brings its merged polygons into the next band's union in place of
+    its rings. A next-band cluster made of one such cluster is not unioned again at all.
+
+    Parameters:
+    ring_vertices (array, shape (A, L, H, 2)): Ring vertices per band and location.
+    ring_reachable (array of bool, shape (A, L)): Which rings to draw.
+    nested (bool): True if the bands are in ascending order and no ring shrinks with altitude.
+
+    Returns:
+    list: One list of merged shapely Polygons per band.
+    """
+    band_count, location_count = ring_reachable.shape
+    if location_count == 0:
+        return [[] for _ in range(band_count)]
+
+    # Candidate pairs: locations whose rings' bounding boxes over all bands overlap
+    has_rings = ring_reachable.any(axis=0)
+    box_locations = np.flatnonzero(has_rings)
+    drawn = np.where(ring_reachable[:, has_rings, None, None], ring_vertices[:, has_rings], np.nan)
+    low = np.nanmin(drawn, axis=(0, 2))
+    high = np.nanmax(drawn, axis=(0, 2))
+    boxes = shapely.box(low[:, 0], low[:, 1], high[:, 0], high[:, 1])
+    left, right = shapely.STRtree(boxes).query(boxes, predicate='intersects')
+    keep = left < right
+    left, right = box_locations[left[keep]], box_locations[right[keep]]
+
+    merged_bands = []
+    labels = np.arange(location_count)
+    # Merged polygons of the previous band's clusters, by label
+    previous_parts = {}
+    for band in range(band_count):
+        reachable = ring_reachable[band]
+        if not nested:
+            labels = np.arange(location_count)
+        polygons = np.full(location_count, None, dtype=object)
+        polygons[reachable] = shapely.polygons(ring_vertices[band][reachable])
+
+        # Every ring lies within the circle around its vertex centroid through its farthest vertex
+        centers = ring_vertices[band].mean(axis=1)
+        radii = np.linalg.norm(ring_vertices[band] - centers[:, None, :], axis=-1).max(axis=1)
+        distances = np.linalg.norm(centers[left] - centers[right], axis=-1)
+        pairs = (reachable[left] & reachable[right] & (distances <= radii[left] + radii[right])
+                 & (labels[left] != labels[right]))
+        order = np.flatnonzero(pairs)[np.argsort(distances[pairs], kind='stable')]
+        pair_left, pair_right = left[order], right[order]
+
+        batch_size = max(location_count, 256)
+        while pair_left.size:
+            batch_left, batch_right = pair_left[:batch_size], pair_right[:batch_size]
+            overlapping = shapely.intersects(polygons[batch_left], polygons[batch_right])
+            labels = connected_components(location_count, batch_left[overlapping],
+                                          batch_right[overlapping], labels)
+            pending = labels[pair_left[batch_size:]] != labels[pair_right[batch_size:]]
+            pair_left, pair_right = pair_left[batch_size:][pending], pair_right[batch_size:][pending]
+
+        if nested and band > 0:
+            # Clusters of the previous band whose rings are all drawn again unchanged
+            unchanged = reachable & ring_reachable[band - 1] & np.all(
+                ring_vertices[band] == ring_vertices[band - 1], axis=(1, 2))
+            changed_labels = previous_labels[ring_reachable[band - 1] & ~unchanged]
+            reusable = set(previous_parts) - set(changed_labels.tolist())
+        else:
+            reusable = set()
+
+        merged_polygons = []
+        band_parts = {}
+        members = np.flatnonzero(reachable)
+        member_labels = labels[members]
+        order = np.argsort(member_labels, kind='stable')
+        boundaries = np.flatnonzero(np.diff(member_labels[order])) + 1
+        for cluster_members in np.split(members[order], boundaries):
+            if not cluster_members.size:
+                continue
+            pieces = []
+            if reusable:
+                inner_labels = previous_labels[cluster_members]
+                reused = np.isin(inner_labels, list(reusable))
+                for label in np.unique(inner_labels[reused]):
+                    pieces.extend(previous_parts[label])
+                cluster_rings = polygons[cluster_members[~reused]]
+            else:
+                reused = None
+                cluster_rings = polygons[cluster_members]
+            if reused is not None and not cluster_rings.size \
+                    and np.unique(inner_labels).size == 1:
+                # The same cluster as in the previous band, with the same rings
+                parts = pieces
+            elif len(pieces) + cluster_rings.size == 1:
+                parts = polygon_parts(pieces[0] if pieces else cluster_rings[0])
+            else:
+                parts = polygon_parts(shapely.union_all(np.concatenate(
+                    (np.array(pieces, dtype=object), cluster_rings))))
+            band_parts[labels[cluster_members[0]]] = parts
+            merged_polygons.extend(parts)
+        merged_bands.append(merged_polygons)
+        previous_parts = band_parts
+        previous_labels = labels
+
+        if nested:
+            # Pairs in the same cluster stay there for every later band
+            apart = labels[left] != labels[right]
+            left, right = left[apart], right[apart]
+    return merged_bands
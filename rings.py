@@ -0,0 +1,454 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Same constants as the scalar reference implementation in utils.py
+KNOTS_TO_FPS = 1.68781
+FEET_PER_NM = 6076.12
+EARTH_RADIUS_NM = 3440.069
+MIN_SAFETY_MARGIN = 0.01
+
+DEFAULT_HEADING_STEP = 10
+
+# Ring resolution that refines headings only where the range changes quickly
+ADAPTIVE = 'adaptive'
+# Adaptive mode: coarsest and finest heading steps in degrees, and the largest relative
+# change in range allowed between neighbouring vertices
+ADAPTIVE_BASE_STEP = 20
+ADAPTIVE_MIN_STEP = 1
+ADAPTIVE_TOLERANCE = 0.03
+
+# Megabytes of range profiles and ring vertices the incremental ring engine keeps per worker
+RING_ENGINE_CACHE_MB = float(os.environ.get('RING_ENGINE_CACHE_MB', '64'))
+
+
+def ring_headings(step=DEFAULT_HEADING_STEP):
+    """
+    Return the headings, in degrees, of the vertices of a ring spaced step degrees apart.
+    """
+    return np.arange(0, 360, step, dtype=np.float64)
+
+
+def adaptive_headings(glide_ratio, safety_margin, Vg, wind_speeds, wind_directions,
+                      base_step=ADAPTIVE_BASE_STEP, min_step=ADAPTIVE_MIN_STEP,
+                      tolerance=ADAPTIVE_TOLERANCE):
+    """
+    Return ring headings that are dense only where the wind-corrected range changes fast.
+
+    Starting from headings base_step degrees apart, the gap between two neighbouring headings
+    is halved while their ranges differ by more than tolerance (relative to the larger
+    range) and the gap is wider than min_step. The range profile only depends on the wind
+    and the glider, so the headings are shared by every location with the same wind; with
+    several distinct winds the union of their headings is returned.
+
+    Returns:
+    array: Sorted headings in degrees, in [0, 360).
+    """
+    winds = set(zip(np.atleast_1d(wind_speeds).tolist(), np.atleast_1d(wind_directions).tolist()))
+    headings = set()
+    for wind_speed, wind_direction in winds:
+        gaps = ring_headings(base_step)
+        step = float(base_step)
+        headings.update(gaps.tolist())
+        while gaps.size and step > min_step:
+            profile = range_per_foot(glide_ratio, safety_margin, Vg, [wind_speed], [wind_direction],
+                                     np.concatenate((gaps, gaps + step)))[0]
+            start, end = profile[:gaps.size], profile[gaps.size:]
+            scale = np.maximum(np.abs(start), np.abs(end))
+            changing = np.abs(end - start) > tolerance * np.where(scale > 0, scale, 1)
+            step /= 2
+            midpoints = gaps[changing] + step
+            headings.update(midpoints.tolist())
+            gaps = np.concatenate((gaps[changing], midpoints))
+    return np.array(sorted(headings), dtype=np.float64)
+
+
+def resolve_headings(ring_resolution, glide_ratio, safety_margin, Vg, wind_speeds, wind_directions):
+    """
+    Return the ring headings for a ring resolution: either a heading step in degrees or ADAPTIVE.
+    """
+    if ring_resolution == ADAPTIVE:
+        return adaptive_headings(glide_ratio, safety_margin, Vg, wind_speeds, wind_directions)
+    step = float(ring_resolution)
+    if not 0 < step <= 90:
+        raise ValueError('Ring resolution must be between 0 and 90 degrees, got %r' % ring_resolution)
+    return ring_headings(step)
+
+
+def glide_ranges(altitudes, arrival_altitudes, glide_ratio, safety_margin, Vg, wind_speeds,
+                 wind_directions, headings):
+    """
+    Vectorized version of utils.glide_range over altitudes, locations and headings.
+
+    Parameters:
+    altitudes (array, shape (A,)): Initial altitudes in feet.
+    arrival_altitudes (array, shape (L,)): Arrival altitude MSL at each location in feet.
+    glide_ratio (float): The glide ratio of the aircraft.
+    safety_margin (float): Fraction of the glide ratio held in reserve.
+    Vg (float): The glide speed of the aircraft in still air in knots.
+    wind_speeds (array, shape (L,)): The wind speed at each location in knots.
+    wind_directions (array, shape (L,)): The direction the wind is coming from at each location, in degrees.
+    headings (array, shape (H,)): Headings from the location, in degrees.
+
+    Returns:
+    array, shape (A, L, H): Glide ranges in nautical miles.
+    """
+    altitudes = np.asarray(altitudes, dtype=np.float64)
+    arrival_altitudes = np.asarray(arrival_altitudes, dtype=np.float64)
+    initial_altitudes = altitudes[:, None] - arrival_altitudes[None, :]
+
+    return initial_altitudes[:, :, None] * range_per_foot(glide_ratio, safety_margin, Vg,
+                                                         wind_speeds, wind_directions,
+                                                         headings)[None, :, :]
+
+
+def range_per_foot(glide_ratio, safety_margin, Vg, wind_speeds, wind_directions, headings):
+    """
+    Return the wind-corrected glide range, in nautical miles per foot of altitude above
+    the arrival altitude, for every location and heading.
+
+    glide_ratio, safety_margin and Vg are either one value for every location or, to compare
+    gliders, arrays of shape (L,).
+
+    Returns:
+    array, shape (L, H)
+    """
+    Vg = np.asarray(Vg, dtype=np.float64)[..., None] * KNOTS_TO_FPS
+    glide_ratio = np.asarray(glide_ratio, dtype=np.float64)[..., None]
+    wind_speeds = np.asarray(wind_speeds, dtype=np.float64) * KNOTS_TO_FPS
+
+    # Reverse wind direction
+    wind_directions = (np.asarray(wind_directions, dtype=np.float64) + 180) % 360
+
+    # Effective wind speed along each heading
+    angle_diff = np.radians(wind_directions[:, None] - np.asarray(headings, dtype=np.float64)[None, :])
+    Vw = wind_speeds[:, None] * np.cos(angle_diff)
+
+    safety_margin = np.maximum(1 - np.asarray(safety_margin, dtype=np.float64),
+                               MIN_SAFETY_MARGIN)[..., None]
+
+    glide_ratio_wind = ((Vg - Vw) / Vg) * glide_ratio * safety_margin
+    return glide_ratio_wind / FEET_PER_NM
+
+
+def destination_points(lats, lons, distances, headings):
+    """
+    Vectorized version of utils.haversine.
+
+    Parameters:
+    lats, lons (array, shape (L,)): Starting points in degrees.
+    distances (array, shape (..., L, H)): Distances in nautical miles.
+    headings (array, shape (H,)): Bearings in degrees.
+
+    Returns:
+    tuple of arrays, shape (..., L, H): Latitudes and longitudes of the destinations in degrees.
+    """
+    lat1 = np.radians(np.asarray(lats, dtype=np.float64))[:, None]
+    lon1 = np.radians(np.asarray(lons, dtype=np.float64))[:, None]
+    brng = np.radians(np.asarray(headings, dtype=np.float64))[None, :]
+
+    d = np.asarray(distances, dtype=np.float64) / EARTH_RADIUS_NM
+    sin_lat1, cos_lat1 = np.sin(lat1), np.cos(lat1)
+    sin_d, cos_d = np.sin(d), np.cos(d)
+
+    lat2 = np.arcsin(sin_lat1 * cos_d + cos_lat1 * sin_d * np.cos(brng))
+    lon2 = lon1 + np.arctan2(np.sin(brng) * sin_d * cos_lat1, cos_d - sin_lat1 * np.sin(lat2))
+
+    return np.degrees(lat2), np.degrees(lon2)
+
+
+def great_circle_distances(lat, lon, lats, lons):
+    """
+    Return the great-circle distances in nautical miles from one point to many (haversine formula).
+
+    Parameters:
+    lat, lon (float): The point in degrees.
+    lats, lons (array): The other points in degrees.
+
+    Returns:
+    array: The distances, shaped like lats.
+    """
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lat2 = np.radians(np.asarray(lats, dtype=np.float64))
+    lon2 = np.radians(np.asarray(lons, dtype=np.float64))
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_NM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def initial_bearings(lats1, lons1, lats2, lons2):
+    """
+    Return the initial great-circle bearings in degrees from the points (lats1, lons1) to the
+    points (lats2, lons2); the arguments broadcast against each other.
+    """
+    lat1, lon1 = np.radians(lats1), np.radians(lons1)
+    lat2, lon2 = np.radians(lats2), np.radians(lons2)
+    dlon = lon2 - lon1
+    x = np.sin(dlon) * np.cos(lat2)
+    y = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlon)
+    return np.degrees(np.arctan2(x, y)) % 360
+
+
+def wind_field_ranges(altitudes, lats, lons, arrival_altitudes, glide_ratio, safety_margin, Vg,
+                      headings, wind_field, step, terrain=None):
+    """
+    Glide ranges through a wind field that changes with the position and the altitude.
+
+    Every ray is marched outward from its location in steps of step nautical miles. Over each
+    step, the glide path climbs by step / range per foot, with the range per foot of the wind
+    at the start of the step, so the path traces the altitude needed at every distance. A band's
+    range is where that path reaches the band's altitude. With a uniform wind field this is
+    exactly glide_ranges.
+
+    Parameters:
+    altitudes (array, shape (A,)): Ring altitudes in feet.
+    lats, lons, arrival_altitudes (array, shape (L,)): Locations and arrival altitudes MSL.
+    glide_ratio, safety_margin, Vg (float): Glider performance, as for glide_ranges.
+    headings (array, shape (H,)): Headings in degrees.
+    wind_field (wind_field.WindField): The winds.
+    step (float): Distance between wind samples in nautical miles.
+    terrain (terrain.TerrainModel): If given, every ray stops where the glide path comes within
+      the terrain clearance.
+
+    Returns:
+    array, shape (A, L, H): Glide ranges in nautical miles.
+    """
+    altitudes = np.asarray(altitudes, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    arrival_altitudes = np.asarray(arrival_altitudes, dtype=np.float64)
+    headings = np.asarray(headings, dtype=np.float64)
+    if altitudes.size == 0 or lats.size == 0:
+        return np.zeros((altitudes.size, lats.size, headings.size))
+
+    # Still-air range per foot, and an upper bound on the range with the strongest tailwind
+    still_air = glide_ratio * max(1 - safety_margin, MIN_SAFETY_MARGIN) / FEET_PER_NM
+    max_distance = (max(altitudes.max() - arrival_altitudes.min(), 0)
+                    * still_air * (Vg + wind_field.max_speed) / Vg)
+    steps = max(int(np.ceil(max_distance / step)), 1)
+    distances = step * np.arange(steps + 1)
+
+    ray_lats, ray_lons = destination_points(
+        lats, lons, np.broadcast_to(distances[:, None, None], (steps + 1, lats.size, headings.size)),
+        headings)
+    east, north = np.sin(np.radians(headings)), np.cos(np.radians(headings))
+    if terrain is not None:
+        clear_altitudes = terrain.elevations(ray_lats, ray_lons) + terrain.clearance
+
+    # Altitude the glide path needs at every sample, marched outward from the arrival altitude
+    path = np.empty((steps + 1, lats.size, headings.size))
+    path[0] = arrival_altitudes[:, None]
+    for k in range(1, steps + 1):
+        u, v = wind_field.wind_at(ray_lats[k - 1], ray_lons[k - 1], path[k - 1])
+        # Wind blowing outward along the ray is a headwind for the glider flying back in
+        unit_ranges = still_air * (Vg - (u * east + v * north)) / Vg
+        with np.errstate(divide='ignore', invalid='ignore'):
+            path[k] = np.where(unit_ranges > 0, path[k - 1] + step / unit_ranges, np.inf)
+        if terrain is not None:
+            path[k] = np.where(path[k] < clear_altitudes[k], np.inf, path[k])
+
+    # The path only climbs, so a band's range lies in the first step that ends at or above it
+    ends = np.minimum((path[None] < altitudes[:, None, None, None]).sum(axis=1), steps)
+    lower = np.take_along_axis(path, np.maximum(ends - 1, 0).reshape(-1, lats.size, headings.size),
+                               axis=0).reshape(ends.shape)
+    upper = np.take_along_axis(path, ends.reshape(-1, lats.size, headings.size),
+                               axis=0).reshape(ends.shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = np.where(np.isfinite(upper) & (upper > lower),
+                            (altitudes[:, None, None] - lower) / (upper - lower), 0.0)
+    ranges = distances[np.maximum(ends - 1, 0)] + step * np.clip(fraction, 0, 1)
+    return np.where(altitudes[:, None, None] > arrival_altitudes[None, :, None], ranges, 0.0)
+
+
+def compute_rings(altitudes, lats, lons, arrival_altitudes, wind_speeds, wind_directions,
+                  glide_ratio, safety_margin, Vg, headings=None, terrain=None, wind_field=None,
+                  wind_step=1.0):
+    """
+    Compute the glide-range ring around every location for every altitude in one pass.
+
+    Parameters:
+    altitudes (array, shape (A,)): Ring altitudes in feet.
+    lats, lons (array, shape (L,)): Location coordinates in degrees.
+    arrival_altitudes (array, shape (L,)): Arrival altitude MSL at each location in feet.
+    wind_speeds, wind_directions (array, shape (L,)): Wind at each location.
+    glide_ratio, safety_margin, Vg (float): Glider performance, as for glide_ranges.
+    headings (array, shape (H,)): Vertex headings in degrees, every 10 degrees by default.
+    terrain (terrain.TerrainModel): If given, every range is cut where the glide path meets
+      the terrain.
+    wind_field (wind_field.WindField): If given, the winds along every ray come from the field
+      (see wind_field_ranges) instead of wind_speeds and wind_directions.
+    wind_step (float): Distance between wind field samples in nautical miles.
+
+    Returns:
+    tuple:
+      vertices (array, shape (A, L, H, 2)): Ring vertices as [lat, lon] pairs.
+      reachable (array of bool, shape (A, L)): True where the altitude is at or above the
+        arrival altitude, i.e. where the ring should be drawn.
+    """
+    if headings is None:
+        headings = ring_headings()
+    altitudes = np.asarray(altitudes, dtype=np.float64)
+    arrival_altitudes = np.asarray(arrival_altitudes, dtype=np.float64)
+
+    if wind_field is not None:
+        ranges = wind_field_ranges(altitudes, lats, lons, arrival_altitudes, glide_ratio,
+                                   safety_margin, Vg, headings, wind_field, wind_step, terrain)
+        ring_lats, ring_lons = destination_points(lats, lons, ranges, headings)
+        reachable = altitudes[:, None] >= arrival_altitudes[None, :]
+        return np.stack((ring_lats, ring_lons), axis=-1), reachable
+
+    ranges = glide_ranges(altitudes, arrival_altitudes, glide_ratio, safety_margin, Vg,
+                          wind_speeds, wind_directions, headings)
+    if terrain is not None and ranges.size:
+        unit_ranges = range_per_foot(glide_ratio, safety_margin, Vg, wind_speeds, wind_directions,
+                                     headings)
+        # The glide path doesn't depend on the altitude, so one march per heading serves every band
+        ranges = np.minimum(ranges, terrain.ray_limits(lats, lons, arrival_altitudes, unit_ranges,
+                                                       headings, ranges.max(axis=(0, 2)))[None])
+    ring_lats, ring_lons = destination_points(lats, lons, ranges, headings)
+
+    vertices = np.stack((ring_lats, ring_lons), axis=-1)
+    reachable = altitudes[:, None] >= arrival_altitudes[None, :]
+    return vertices, reachable
+
+
+class IncrementalRingEngine:
+    """
+    Ring engine that reuses work across altitude bands and requests.
+
+    For one location the glide range is linear in (altitude - arrival altitude), so every band
+    is a scaled copy of the location's unit "range per foot" profile. The profile is computed
+    once per (location, wind, glider, headings) and memoized together with the ring vertices of
+    every band derived from it, so changing the band range or spacing only computes the bands
+    that are new. With terrain, the profile also keeps the terrain limit of every heading and
+    how far out it was searched.
+
+    The arrays kept take at most max_bytes: the least recently used profiles are dropped beyond
+    that, and the oldest bands of a profile beyond max_bands.
+    """
+
+    def __init__(self, max_bytes=int(RING_ENGINE_CACHE_MB * 2 ** 20), max_bands=64):
+        self.max_bytes = max_bytes
+        self.max_bands = max_bands
+        self._profiles = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _resize(self, profile, nbytes):
+        profile['nbytes'] += nbytes
+        self._bytes += nbytes
+
+    def compute_rings(self, altitudes, lats, lons, arrival_altitudes, wind_speeds, wind_directions,
+                      glide_ratio, safety_margin, Vg, headings=None, terrain=None, wind_field=None,
+                      wind_step=1.0):
+        """
+        Same as rings.compute_rings, computing only the (location, altitude) rings not seen before.
+
+        Ranges through a wind field are not linear in the altitude, so they are computed directly.
+        """
+        if wind_field is not None:
+            return compute_rings(altitudes, lats, lons, arrival_altitudes, wind_speeds,
+                                 wind_directions, glide_ratio, safety_margin, Vg, headings, terrain,
+                                 wind_field, wind_step)
+        if headings is None:
+            headings = ring_headings()
+        headings = np.asarray(headings, dtype=np.float64)
+        altitudes = np.asarray(altitudes, dtype=np.float64)
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        arrival_altitudes = np.asarray(arrival_altitudes, dtype=np.float64)
+        wind_speeds = np.broadcast_to(np.asarray(wind_speeds, dtype=np.float64), lats.shape)
+        wind_directions = np.broadcast_to(np.asarray(wind_directions, dtype=np.float64), lats.shape)
+        heading_key = headings.tobytes()
+        terrain_key = None if terrain is None else tuple(terrain.cache_key)
+
+        vertices = np.empty((altitudes.size, lats.size, headings.size, 2), dtype=np.float64)
+        with self._lock:
+            keys = [(lats[i], lons[i], arrival_altitudes[i], wind_speeds[i], wind_directions[i],
+                     glide_ratio, safety_margin, Vg, heading_key, terrain_key)
+                    for i in range(lats.size)]
+
+            # Compute the unit profiles of the locations not seen before in one pass
+            new = list({key: i for i, key in enumerate(keys) if key not in self._profiles}.values())
+            if new:
+                unit_ranges = range_per_foot(glide_ratio, safety_margin, Vg, wind_speeds[new],
+                                             wind_directions[new], headings)
+                for i, profile_unit_ranges in zip(new, unit_ranges):
+                    # A copy, so the profile doesn't keep the whole batch's array alive
+                    profile_unit_ranges = profile_unit_ranges.copy()
+                    self._profiles[keys[i]] = {'unit_ranges': profile_unit_ranges,
+                                               'bands': OrderedDict(),
+                                               'terrain_limits': None,
+                                               'terrain_searched': 0.0,
+                                               'nbytes': profile_unit_ranges.nbytes}
+                    self._bytes += profile_unit_ranges.nbytes
+
+            profiles = []
+            missing = []
+            for i, key in enumerate(keys):
+                profile = self._profiles[key]
+                self._profiles.move_to_end(key)
+                profiles.append(profile)
+                for a, altitude in enumerate(altitudes):
+                    band = profile['bands'].get(altitude)
+                    if band is None:
+                        missing.append((a, i))
+                    else:
+                        vertices[a, i] = band
+
+            if missing:
+                # Derive every missing band from the unit profiles in one vectorized pass
+                band_altitudes, band_locations = np.array(missing, dtype=np.intp).T
+                distances = ((altitudes[band_altitudes] - arrival_altitudes[band_locations])[:, None]
+                             * np.array([profiles[i]['unit_ranges'] for i in band_locations]))
+                if terrain is not None:
+                    distances = np.minimum(distances, self._terrain_limits(
+                        terrain, profiles, band_locations, distances, lats, lons,
+                        arrival_altitudes, headings))
+                band_lats, band_lons = destination_points(lats[band_locations], lons[band_locations],
+                                                          distances, headings)
+                bands = np.stack((band_lats, band_lons), axis=-1)
+                vertices[band_altitudes, band_locations] = bands
+                for (a, i), band in zip(missing, bands):
+                    profile_bands = profiles[i]['bands']
+                    previous = profile_bands.get(altitudes[a])
+                    # A copy, so an evicted band frees its memory
+                    profile_bands[altitudes[a]] = band.copy()
+                    self._resize(profiles[i], band.nbytes
+                                 - (0 if previous is None else previous.nbytes))
+                    while len(profile_bands) > self.max_bands:
+                        self._resize(profiles[i], -profile_bands.popitem(last=False)[1].nbytes)
+
+            while self._bytes > self.max_bytes and self._profiles:
+                self._bytes -= self._profiles.popitem(last=False)[1]['nbytes']
+
+        reachable = altitudes[:, None] >= arrival_altitudes[None, :]
+        return vertices, reachable
+
+    def _terrain_limits(self, terrain, profiles, band_locations, distances, lats, lons,
+                        arrival_altitudes, headings):
+        """
+        Return the terrain limits for the missing bands, marching further out only for the
+        locations whose profile wasn't searched far enough yet.
+        """
+        needed = np.zeros(lats.size)
+        np.maximum.at(needed, band_locations, distances.max(axis=1))
+        stale = [i for i in np.unique(band_locations)
+                 if profiles[i]['terrain_limits'] is None or profiles[i]['terrain_searched'] < needed[i]]
+        if stale:
+            limits = terrain.ray_limits(lats[stale], lons[stale], arrival_altitudes[stale],
+                                        np.array([profiles[i]['unit_ranges'] for i in stale]),
+                                        headings, needed[stale])
+            for i, profile_limits in zip(stale, limits):
+                previous = profiles[i]['terrain_limits']
+                profile_limits = np.array(profile_limits)
+                self._resize(profiles[i], profile_limits.nbytes
+                             - (0 if previous is None else previous.nbytes))
+                profiles[i]['terrain_limits'] = profile_limits
+                profiles[i]['terrain_searched'] = needed[i]
+        return np.array([profiles[i]['terrain_limits'] for i in band_locations])
+
+
+ring_engine = IncrementalRingEngine()
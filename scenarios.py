@@ -0,0 +1,135 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+from instrumentation import stage
+from rings import range_per_foot, resolve_headings, destination_points
+from ring_cache import geometry_cache
+from terrain import terrain_model
+from utils import ring_locations_of, ring_geometry_key, merge_ring_bands, RING_RESOLUTION
+
+
+@dataclass(frozen=True)
+class Scenario:
+    """
+    One glider and wind to compare over a shared set of locations.
+
+    safety_margin is a fraction (0.2 for 20%), wind_speed is in knots and wind_direction is the
+    direction the wind comes from in degrees.
+    """
+    name: str
+    glide_ratio: float
+    vg: float
+    safety_margin: float
+    wind_speed: float
+    wind_direction: float
+
+    @classmethod
+    def from_plan(cls, plan, name=None):
+        """
+        Return the scenario of a FlightPlan, named after its glider and wind by default.
+        """
+        if name is None:
+            glider = plan.selected_glider
+            if glider == 'other':
+                glider = 'L/D %g at %g kt' % (plan.glide_ratio, plan.vg)
+            name = '%s, wind %03.0f° at %g kt' % (glider, plan.wind_direction, plan.wind_speed)
+        return cls(name, plan.glide_ratio, plan.vg, plan.safety_margin, plan.wind_speed,
+                   plan.wind_direction)
+
+    def center_locations(self, center_locations):
+        """
+        Return the center locations with this scenario's wind.
+        """
+        return [(lat, lon, self.wind_speed, self.wind_direction) + tuple(rest)
+                for lat, lon, _, _, *rest in center_locations]
+
+
+def compute_scenario_rings(ring_locations, polygon_altitudes, scenarios,
+                           ring_resolution=RING_RESOLUTION, terrain=terrain_model):
+    """
+    Compute the merged rings of several scenarios over the same ring locations.
+
+    The scenarios sharing a set of headings (all of them, unless ring_resolution is adaptive)
+    are computed in one vectorized pass: the range profiles of every scenario come from one
+    range_per_foot call, the destination points of every scenario and band from one
+    destination_points call, and the terrain along the rays, which doesn't depend on the glider
+    or the wind, is sampled once.
+
+    Parameters:
+    ring_locations (list): (lat, lon, arrival_altitude_msl, wind_speed, wind_direction) tuples,
+      as from utils.ring_locations_of; the wind is replaced by each scenario's.
+    polygon_altitudes (list): The altitude of every band.
+    scenarios (list): Scenario objects.
+
+    Returns:
+    list: For every scenario, one list of merged shapely Polygons per altitude.
+    """
+    lats, lons, arrival_altitudes = \
+        np.array(ring_locations, dtype=np.float64).reshape(-1, 5).T[:3]
+    altitudes = np.asarray(polygon_altitudes, dtype=np.float64)
+    reachable = altitudes[:, None] >= arrival_altitudes[None, :]
+
+    groups = OrderedDict()
+    for s, scenario in enumerate(scenarios):
+        headings = resolve_headings(ring_resolution, scenario.glide_ratio, scenario.safety_margin,
+                                    scenario.vg, [scenario.wind_speed], [scenario.wind_direction])
+        groups.setdefault(headings.tobytes(), (headings, []))[1].append(s)
+
+    merged = [None] * len(scenarios)
+    for headings, members in groups.values():
+        group = [scenarios[s] for s in members]
+        with stage('rings'):
+            # One unit range profile per scenario; the wind is the same at every location
+            unit_ranges = range_per_foot([scenario.glide_ratio for scenario in group],
+                                         [scenario.safety_margin for scenario in group],
+                                         [scenario.vg for scenario in group],
+                                         [scenario.wind_speed for scenario in group],
+                                         [scenario.wind_direction for scenario in group],
+                                         headings)
+            ranges = ((altitudes[:, None] - arrival_altitudes[None, :])[None, :, :, None]
+                      * unit_ranges[:, None, None, :])
+            if terrain is not None and ranges.size:
+                limits = terrain.ray_limits(lats, lons, arrival_altitudes,
+                                            np.broadcast_to(unit_ranges[:, None, :],
+                                                            (len(group), lats.size, headings.size)),
+                                            headings, ranges.max(axis=(1, 3)))
+                ranges = np.minimum(ranges, limits[:, None])
+
+            ring_lats, ring_lons = destination_points(
+                lats, lons, ranges.reshape(-1, lats.size, headings.size), headings)
+            vertices = np.stack((ring_lats, ring_lons), axis=-1).reshape(ranges.shape + (2,))
+
+        for s, scenario, scenario_vertices in zip(members, group, vertices):
+            merged[s] = merge_ring_bands(scenario_vertices, reachable, polygon_altitudes,
+                                         [scenario.wind_speed], scenario.vg, ring_resolution)
+    return merged
+
+
+def scenario_ring_geometry(center_locations, polygon_altitudes, scenarios,
+                           ring_resolution=RING_RESOLUTION, terrain=terrain_model):
+    """
+    Return the merged rings of every scenario around the center locations.
+
+    Every scenario's rings are cached under the same key as a plan with that glider and wind,
+    so scenarios drawn before as maps (and the other way round) are not computed again; the
+    rest are computed together by compute_scenario_rings.
+
+    Returns:
+    list: For every scenario, one list of merged shapely Polygons per altitude.
+    """
+    keys = [ring_geometry_key(scenario.center_locations(center_locations), polygon_altitudes,
+                              scenario.glide_ratio, scenario.safety_margin, scenario.vg,
+                              ring_resolution, terrain)
+            for scenario in scenarios]
+    results = [geometry_cache.get(key) for key in keys]
+    missing = [s for s, result in enumerate(results) if result is None]
+    if missing:
+        computed = compute_scenario_rings(ring_locations_of(center_locations), polygon_altitudes,
+                                          [scenarios[s] for s in missing], ring_resolution,
+                                          terrain)
+        for s, merged_rings in zip(missing, computed):
+            geometry_cache.put(keys[s], merged_rings)
+            results[s] = merged_rings
+    return results
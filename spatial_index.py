@@ -0,0 +1,80 @@
+import numpy as np
+import shapely
+
+from rings import great_circle_distances
+
+NM_PER_DEGREE_LAT = 60.0
+
+
+class SpatialIndex:
+    """
+    R-tree (shapely STRtree) over a set of points, answering bounding box and radius queries.
+
+    Points are indexed as (lon, lat) so that boxes are given as south, west, north, east.
+    """
+
+    def __init__(self, lats, lons):
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.tree = shapely.STRtree(shapely.points(self.lons, self.lats))
+
+    def __len__(self):
+        return len(self.lats)
+
+    def _query_box(self, south, west, north, east):
+        return self.tree.query(shapely.box(west, south, east, north))
+
+    def within_bbox(self, south, west, north, east):
+        """
+        Return the indices of the points inside a box, in ascending order.
+
+        A box whose west edge is east of its east edge crosses the antimeridian.
+        """
+        if west <= east:
+            found = self._query_box(south, west, north, east)
+        else:
+            found = np.concatenate([self._query_box(south, west, north, 180.0),
+                                    self._query_box(south, -180.0, north, east)])
+        return np.unique(found).astype(np.intp)
+
+    def within_radius(self, lat, lon, radius_nm):
+        """
+        Return the indices of the points within radius_nm nautical miles of (lat, lon),
+        nearest first, and their distances.
+
+        Returns:
+        tuple: (indices, distances) arrays.
+        """
+        # Search the box around the circle, then keep the points truly inside it
+        dlat = radius_nm / NM_PER_DEGREE_LAT
+        south, north = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+        cos_lat = np.cos(np.radians(max(abs(south), abs(north))))
+        if south == -90.0 or north == 90.0 or radius_nm >= cos_lat * NM_PER_DEGREE_LAT * 180:
+            candidates = self.within_bbox(south, -180.0, north, 180.0)
+        else:
+            dlon = radius_nm / (NM_PER_DEGREE_LAT * cos_lat)
+            west = (lon - dlon + 180.0) % 360.0 - 180.0
+            east = (lon + dlon + 180.0) % 360.0 - 180.0
+            candidates = self.within_bbox(south, west, north, east)
+
+        distances = great_circle_distances(lat, lon, self.lats[candidates], self.lons[candidates])
+        inside = distances <= radius_nm
+        candidates, distances = candidates[inside], distances[inside]
+        order = np.argsort(distances, kind='stable')
+        return candidates[order], distances[order]
+
+    def nearest(self, lat, lon, count=1):
+        """
+        Return the indices of the count points nearest to (lat, lon), nearest first,
+        and their distances in nautical miles.
+        """
+        count = min(count, len(self))
+        if count <= 0:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        # Grow the search radius until it holds enough points
+        radius_nm = 10.0
+        while True:
+            indices, distances = self.within_radius(lat, lon, radius_nm)
+            if len(indices) >= count or radius_nm >= NM_PER_DEGREE_LAT * 180:
+                return indices[:count], distances[:count]
+            radius_nm *= 4
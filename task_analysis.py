@@ -0,0 +1,240 @@
+import os
+
+import numpy as np
+
+from reachability import great_circle_points
+from rings import range_per_foot, initial_bearings, great_circle_distances
+
+# Distance in nautical miles between the points of a task's altitude profile
+TASK_SAMPLE_NM = float(os.environ.get('TASK_SAMPLE_NM', '1.0'))
+# Farthest landable turnpoint considered from a point of a task, in nautical miles
+TASK_SEARCH_RADIUS_NM = float(os.environ.get('TASK_SEARCH_RADIUS_NM', '50'))
+
+NM_PER_DEGREE_LAT = 60.0
+# Most (sample, turnpoint) pairs evaluated at once
+MAX_TASK_PAIRS = 2000000
+# Heading step, in degrees, and relative slack of the range bounds sampled from a unit_range
+BOUND_HEADING_STEP = 0.25
+BOUND_SLACK = 1e-3
+
+
+def task_legs(task):
+    """
+    Return the points of a task in flying order, without repeated consecutive points.
+    """
+    points = []
+    for point in task['points']:
+        if not points or (point['lat'], point['lon']) != (points[-1]['lat'], points[-1]['lon']):
+            points.append(point)
+    return points
+
+
+def task_distance(task):
+    """
+    Return the length of a task through the centres of its points, in nautical miles.
+    """
+    points = task_legs(task)
+    if len(points) < 2:
+        return 0.0
+    lats = np.array([point['lat'] for point in points])
+    lons = np.array([point['lon'] for point in points])
+    return float(great_circle_distances(lats[:-1], lons[:-1], lats[1:], lons[1:]).sum())
+
+
+def sample_route(points, step=TASK_SAMPLE_NM):
+    """
+    Sample the route through the points every step nautical miles along each leg, with the
+    turnpoints themselves included.
+
+    Returns:
+    tuple of arrays: Latitudes, longitudes, distances along the route in nautical miles and
+    the leg of every sample.
+    """
+    lats, lons, distances, legs = [], [], [], []
+    covered = 0.0
+    for leg, (start, end) in enumerate(zip(points[:-1], points[1:])):
+        length = float(great_circle_distances(start['lat'], start['lon'], end['lat'], end['lon']))
+        count = max(int(np.ceil(length / step)), 1)
+        fractions = np.arange(count + (leg == len(points) - 2)) / count
+        leg_lats, leg_lons = great_circle_points(np.array([start['lat']]), np.array([start['lon']]),
+                                                 np.array([end['lat']]), np.array([end['lon']]),
+                                                 fractions[:, None])
+        lats.append(leg_lats[:, 0])
+        lons.append(leg_lons[:, 0])
+        distances.append(covered + fractions * length)
+        legs.append(np.full(fractions.size, leg))
+        covered += length
+    if not lats:
+        single = [[point['lat'] for point in points], [point['lon'] for point in points],
+                  [0.0] * len(points), [0] * len(points)]
+        return tuple(np.array(values, dtype=dtype) for values, dtype
+                     in zip(single, (np.float64, np.float64, np.float64, np.intp)))
+    return (np.concatenate(lats), np.concatenate(lons), np.concatenate(distances),
+            np.concatenate(legs))
+
+
+def altitudes_required(turnpoints, lats, lons, glide_ratio, safety_margin, Vg, wind_speed,
+                       wind_direction, arrival_altitude_agl, radius_nm=TASK_SEARCH_RADIUS_NM,
+                       unit_range=None):
+    """
+    Return, for every point, the lowest altitude from which a landable turnpoint can be reached
+    in the wind, and which turnpoint that is.
+
+    The landable turnpoints around all the points are taken from the spatial index at once; the
+    altitude needed to glide from every point to every one of them within radius_nm is then
+    evaluated with the glide model of the rings, in chunks of points. Turnpoints that cannot
+    beat the best one even with the wind straight behind are dropped by distance alone, before
+    any bearing is computed.
+
+    Parameters:
+    lats, lons (array, shape (S,)): The points in degrees.
+    glide_ratio, safety_margin, Vg: The glider, as for rings.range_per_foot.
+    wind_speed, wind_direction (float): The wind in knots and the direction it comes from.
+    arrival_altitude_agl (float): Height above the turnpoint to arrive at, in feet.
+    unit_range (function): Optional headings -> range per foot in nautical miles, used instead
+      of rings.range_per_foot for the glider and wind (e.g. a worst case over several winds).
+
+    Returns:
+    tuple of arrays, shape (S,): The altitudes required in feet MSL (inf where no landable
+    turnpoint is within radius_nm) and the row indices of the turnpoints (-1 there).
+    """
+    required = np.full(lats.shape, np.inf)
+    nearest = np.full(lats.shape, -1, dtype=np.intp)
+    if lats.size == 0 or len(turnpoints) == 0:
+        return required, nearest
+
+    dlat = radius_nm / NM_PER_DEGREE_LAT
+    south, north = max(lats.min() - dlat, -90.0), min(lats.max() + dlat, 90.0)
+    dlon = radius_nm / (NM_PER_DEGREE_LAT * max(np.cos(np.radians(max(abs(south), abs(north)))),
+                                                1e-6))
+    candidates = turnpoints.within_bbox(south, max(lons.min() - dlon, -180.0), north,
+                                        min(lons.max() + dlon, 180.0))
+    candidates = candidates[turnpoints.landable[candidates]]
+    if candidates.size == 0:
+        return required, nearest
+    candidate_lats = turnpoints.lats[candidates]
+    candidate_lons = turnpoints.lons[candidates]
+    arrival_altitudes = turnpoints.elevs[candidates] + arrival_altitude_agl
+
+    # Bounds on the range per foot over every heading, to skip the turnpoints that cannot be the
+    # best one before computing bearings
+    if unit_range is None:
+        def unit_range(headings):
+            return range_per_foot(glide_ratio, safety_margin, Vg, [wind_speed], [wind_direction],
+                                  headings)[0]
+
+        unit_bounds = unit_range([wind_direction, (wind_direction + 180) % 360])
+        best_unit, worst_unit = unit_bounds.max(), unit_bounds.min()
+    else:
+        # The extremes of another function are only known from samples, so they are widened
+        unit_bounds = unit_range(np.arange(0, 360, BOUND_HEADING_STEP))
+        best_unit = unit_bounds.max() * (1 + BOUND_SLACK)
+        worst_unit = unit_bounds.min() * (1 - BOUND_SLACK)
+    if best_unit <= 0:
+        return required, nearest
+
+    chunk = max(MAX_TASK_PAIRS // candidates.size, 1)
+    for start in range(0, lats.size, chunk):
+        end = min(start + chunk, lats.size)
+        distances = great_circle_distances(lats[start:end, None], lons[start:end, None],
+                                           candidate_lats[None, :], candidate_lons[None, :])
+        distances[distances > radius_nm] = np.inf
+        lower = arrival_altitudes[None, :] + distances / best_unit
+        if worst_unit > 0:
+            upper = (arrival_altitudes[None, :] + distances / worst_unit).min(axis=1)
+            samples, pairs = np.nonzero(lower <= upper[:, None])
+        else:
+            samples, pairs = np.nonzero(np.isfinite(lower))
+
+        # The rings' heading is the bearing from the turnpoint out to the glider
+        headings = initial_bearings(candidate_lats[pairs], candidate_lons[pairs],
+                                    lats[start + samples], lons[start + samples])
+        unit_ranges = unit_range(headings)
+        with np.errstate(divide='ignore'):
+            needed = np.where(unit_ranges > 0, arrival_altitudes[pairs]
+                              + distances[samples, pairs] / unit_ranges, np.inf)
+
+        # Keep the lowest altitude per sample: sort by sample, then by altitude needed
+        order = np.lexsort((needed, samples))
+        first = np.ones(order.size, dtype=bool)
+        first[1:] = samples[order][1:] != samples[order][:-1]
+        best = order[first]
+        found = np.isfinite(needed[best])
+        required[start + samples[best][found]] = needed[best][found]
+        nearest[start + samples[best][found]] = candidates[pairs[best][found]]
+    return required, nearest
+
+
+def analyze_tasks(turnpoints, tasks, glide_ratio, safety_margin, Vg, wind_speed, wind_direction,
+                  arrival_altitude_agl, step=TASK_SAMPLE_NM, radius_nm=TASK_SEARCH_RADIUS_NM):
+    """
+    Compute the final-glide altitude profile of every task: along every leg, the altitude
+    needed to reach the best landable turnpoint in the wind.
+
+    The samples of all the tasks are evaluated together by altitudes_required, so a whole
+    file of tasks costs one pass over the turnpoints around them.
+
+    Parameters:
+    turnpoints (TurnpointRepository): The turnpoint database.
+    tasks (list): Task dicts, as in TurnpointRepository.tasks.
+
+    Returns:
+    list: For every task, a dict with its distance, its legs and their highest altitude
+    required, the profile (distance along the task, lat, lon, altitude required and the
+    turnpoint to land at) and the highest altitude required with its place. Altitudes are None
+    where no landable turnpoint can be reached within radius_nm; a leg or task with such a point
+    is marked unreachable, and the critical point of an unreachable task is the first of them.
+    """
+    routes = [task_legs(task) for task in tasks]
+    samples = [sample_route(points, step) if points else None for points in routes]
+    present = [sample for sample in samples if sample is not None]
+    if present:
+        # Tasks of one file often share legs, so every distinct point is evaluated once
+        points_all = np.stack((np.concatenate([sample[0] for sample in present]),
+                               np.concatenate([sample[1] for sample in present])), axis=1)
+        unique, inverse = np.unique(points_all, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        required, nearest = altitudes_required(
+            turnpoints, unique[:, 0], unique[:, 1], glide_ratio, safety_margin, Vg, wind_speed,
+            wind_direction, arrival_altitude_agl, radius_nm)
+        required, nearest = required[inverse], nearest[inverse]
+
+    def altitude(value):
+        return round(float(value)) if np.isfinite(value) else None
+
+    results = []
+    offset = 0
+    for task, points, sample in zip(tasks, routes, samples):
+        result = {'name': task['name'], 'distance_nm': 0.0, 'legs': [], 'profile': [],
+                  'max_altitude_required': None, 'unreachable': False, 'critical_point': None}
+        results.append(result)
+        if sample is None:
+            continue
+        lats, lons, distances, legs = sample
+        task_required = required[offset:offset + lats.size]
+        task_nearest = nearest[offset:offset + lats.size]
+        offset += lats.size
+
+        result['distance_nm'] = round(float(distances[-1]), 2)
+        for leg, (start, end) in enumerate(zip(points[:-1], points[1:])):
+            result['legs'].append({
+                'from': start['name'], 'to': end['name'],
+                'distance_nm': round(float(great_circle_distances(start['lat'], start['lon'],
+                                                                  end['lat'], end['lon'])), 2),
+                'max_altitude_required': altitude(task_required[legs == leg].max()),
+                'unreachable': bool(np.isinf(task_required[legs == leg]).any()),
+            })
+        result['profile'] = [{
+            'distance_nm': round(float(distance), 2),
+            'lat': float(lat),
+            'lon': float(lon),
+            'altitude_required': altitude(value),
+            'landing': turnpoints.codes[index] if index >= 0 else None,
+        } for distance, lat, lon, value, index in zip(distances, lats, lons, task_required,
+                                                      task_nearest)]
+        # argmax returns the first of several unreachable points
+        worst = int(np.argmax(task_required))
+        result['max_altitude_required'] = altitude(task_required[worst])
+        result['unreachable'] = bool(np.isinf(task_required[worst]))
+        result['critical_point'] = result['profile'][worst]
+    return results
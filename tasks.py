@@ -0,0 +1,107 @@
+import json
+import os
+import uuid
+
+from celery import Celery
+from dotenv import load_dotenv
+from kombu.exceptions import OperationalError
+from redis.exceptions import RedisError
+
+from plans import FlightPlan
+from turnpoints import get_repository
+from utils import plan_map_html
+
+load_dotenv()
+
+# Compute maps on Celery workers instead of in the web request
+MAP_JOBS = os.environ.get('MAP_JOBS', 'false').lower() in ('1', 'true', 'yes')
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', CELERY_BROKER_URL)
+# Run jobs in the submitting process, e.g. with CELERY_BROKER_URL=memory:// for local testing
+CELERY_ALWAYS_EAGER = os.environ.get('CELERY_ALWAYS_EAGER', 'false').lower() in ('1', 'true', 'yes')
+# Seconds a finished map is kept for the page polling for it
+JOB_RESULT_EXPIRES = int(os.environ.get('JOB_RESULT_EXPIRES', '3600'))
+
+celery = Celery('gliderFlightPlanner', broker=CELERY_BROKER_URL, backend=CELERY_RESULT_BACKEND)
+celery.conf.update(
+    task_always_eager=CELERY_ALWAYS_EAGER,
+    task_store_eager_result=True,
+    task_track_started=True,
+    result_expires=JOB_RESULT_EXPIRES,
+    # Maps take seconds to compute, so hand them out one at a time to free workers
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
+    # Fail fast when Redis is down, so the web worker can draw the map itself
+    result_backend_transport_options={'retry_policy': {'max_retries': 1, 'interval_start': 0,
+                                                       'interval_step': 0.2}},
+)
+
+# Errors of an unreachable broker or result backend
+BACKEND_ERRORS = (OperationalError, RedisError, OSError)
+# State recorded for a job when it is queued; Celery reports unknown and expired jobs as PENDING
+JOB_SUBMITTED = 'SUBMITTED'
+
+# Job states as reported by /api/jobs/<job_id>
+JOB_STATES = {
+    JOB_SUBMITTED: 'pending',
+    'RECEIVED': 'pending',
+    'RETRY': 'pending',
+    'STARTED': 'running',
+    'SUCCESS': 'done',
+    'FAILURE': 'failed',
+    'REVOKED': 'failed',
+}
+
+
+@celery.task(name='tasks.render_map')
+def render_map(plan_json):
+    """
+    Compute the map of a plan, given as FlightPlan.to_json(). The plan travels with the job, as
+    workers don't share the web workers' plan store.
+
+    Returns:
+    dict: The plan ID and the map HTML.
+    """
+    plan = FlightPlan.from_dict(json.loads(plan_json))
+    center_locations = plan.center_locations(get_repository())
+    if not center_locations:
+        raise ValueError('None of the selected locations are in the turnpoint database')
+    return {'plan_id': plan.plan_id, 'map_html': plan_map_html(plan, center_locations)}
+
+
+def submit_map_job(plan):
+    """
+    Queue the map of a FlightPlan and return the job ID.
+
+    The job is recorded in the result backend before it is published, so that job_status can
+    tell it from an unknown one. Publishing is not retried, so an unreachable broker or backend
+    fails fast with one of BACKEND_ERRORS.
+    """
+    job_id = str(uuid.uuid4())
+    celery.backend.store_result(job_id, None, JOB_SUBMITTED)
+    return render_map.apply_async((plan.to_json(),), task_id=job_id, retry=False).id
+
+
+def job_status(job_id):
+    """
+    Return the state of a map job: 'pending', 'running', 'done' or 'failed', and the error of a
+    failed job, or None for a job that is unknown or whose result expired.
+
+    An unreachable result backend raises one of BACKEND_ERRORS.
+    """
+    result = celery.AsyncResult(job_id)
+    if result.state == 'PENDING':
+        return None
+    state = JOB_STATES.get(result.state, 'pending')
+    error = str(result.result) if state == 'failed' else None
+    return state, error
+
+
+def job_map_html(job_id):
+    """
+    Return the map HTML of a finished job, or None.
+    """
+    result = celery.AsyncResult(job_id)
+    if result.state != 'SUCCESS':
+        return None
+    return result.result['map_html']
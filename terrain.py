@@ -0,0 +1,219 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from rings import destination_points
+
+# Directory of 1x1 degree elevation tiles; terrain-aware rings are off when unset
+TERRAIN_DIR = os.environ.get('TERRAIN_DIR')
+# Height in feet the glide path must keep above the terrain
+TERRAIN_CLEARANCE = float(os.environ.get('TERRAIN_CLEARANCE', '500'))
+# Distance in nautical miles between terrain samples along each ring heading
+TERRAIN_STEP_NM = float(os.environ.get('TERRAIN_STEP_NM', '0.25'))
+# Number of tiles kept mapped per worker
+TERRAIN_TILE_CACHE_SIZE = int(os.environ.get('TERRAIN_TILE_CACHE_SIZE', '16'))
+
+FEET_PER_METER = 3.28084
+# Elevation of missing samples in SRTM .hgt files
+HGT_VOID = -32768
+TILE_EXTENSIONS = ('.npy', '.hgt')
+# Most terrain samples held in memory at once while marching the rays
+MAX_RAY_SAMPLES = 2000000
+
+
+def tile_name(lat, lon):
+    """
+    Return the SRTM-style name of the 1x1 degree tile whose south-west corner is (lat, lon),
+    e.g. 'N42W072'.
+    """
+    return '%s%02d%s%03d' % ('N' if lat >= 0 else 'S', abs(lat), 'E' if lon >= 0 else 'W', abs(lon))
+
+
+class TerrainModel:
+    """
+    Terrain elevations from a directory of memory-mapped 1x1 degree tiles.
+
+    Tiles are named after their south-west corner, as SRTM tiles are (N42W072), and are either
+    SRTM .hgt files or .npy arrays of elevations in meters. Like .hgt files, a .npy tile's first
+    row is its north edge, its last row its south edge, and its edge rows and columns overlap those
+    of its neighbours. The most recently used tiles are kept mapped in an LRU cache.
+    """
+
+    def __init__(self, directory, clearance=TERRAIN_CLEARANCE, step=TERRAIN_STEP_NM,
+                 cache_size=TERRAIN_TILE_CACHE_SIZE):
+        self.directory = directory
+        self.clearance = clearance
+        self.step = step
+        self.cache_size = cache_size
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def cache_key(self):
+        """
+        What the rings depend on besides the glide inputs, for ring cache keys: the settings and
+        the name, modification time and size of every tile, so that replacing a tile invalidates
+        the rings drawn over it.
+        """
+        return [os.path.abspath(self.directory), self.clearance, self.step, self._tile_versions()]
+
+    def _tile_versions(self):
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return []
+        versions = []
+        for entry in entries:
+            if entry.name.endswith(TILE_EXTENSIONS):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                versions.append((entry.name, stat.st_mtime_ns, stat.st_size))
+        return sorted(versions)
+
+    def _tile_path(self, name):
+        """
+        Return the path of a tile file and its (mtime, size) version, or (None, None).
+        """
+        for extension in TILE_EXTENSIONS:
+            path = os.path.join(self.directory, name + extension)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            return path, (stat.st_mtime_ns, stat.st_size)
+        return None, None
+
+    def _load_tile(self, path):
+        if path.endswith('.npy'):
+            return np.load(path, mmap_mode='r')
+        size = int(round(np.sqrt(os.path.getsize(path) // 2)))
+        return np.memmap(path, dtype='>i2', mode='r', shape=(size, size))
+
+    def tile(self, lat, lon):
+        """
+        Return the elevation array of the tile whose south-west corner is (lat, lon), or None.
+
+        A tile is loaded again when its file was replaced since it was mapped.
+        """
+        key = (lat, lon)
+        path, version = self._tile_path(tile_name(lat, lon))
+        with self._lock:
+            if key in self._tiles and self._tiles[key][0] == (path, version):
+                self._tiles.move_to_end(key)
+                return self._tiles[key][1]
+        data = None if path is None else self._load_tile(path)
+        with self._lock:
+            self._tiles[key] = ((path, version), data)
+            self._tiles.move_to_end(key)
+            while len(self._tiles) > self.cache_size:
+                self._tiles.popitem(last=False)
+        return data
+
+    def elevations(self, lats, lons):
+        """
+        Return the terrain elevation in feet at every point.
+
+        Each point gets the highest of the four samples around it, so that ridges between
+        samples are not underestimated. Where there is no terrain data, on missing tiles or next
+        to void samples, the elevation is unknown and the point gets inf, so that no glide path
+        is taken to clear it.
+
+        Parameters:
+        lats, lons (array): Coordinates in degrees.
+
+        Returns:
+        array: Elevations in feet, shaped like lats.
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = (np.asarray(lons, dtype=np.float64) + 180.0) % 360.0 - 180.0
+        flat_lats, flat_lons = lats.ravel(), lons.ravel()
+        result = np.full(flat_lats.shape, np.inf)
+
+        corners = np.stack((np.floor(flat_lats), np.floor(flat_lons)), axis=1).astype(np.int64)
+        tiles, inverse = np.unique(corners, axis=0, return_inverse=True)
+        for t, (tile_lat, tile_lon) in enumerate(tiles):
+            data = self.tile(int(tile_lat), int(tile_lon))
+            if data is None:
+                continue
+            points = np.flatnonzero(inverse.ravel() == t)
+            rows_count, columns_count = data.shape
+            rows = (tile_lat + 1 - flat_lats[points]) * (rows_count - 1)
+            columns = (flat_lons[points] - tile_lon) * (columns_count - 1)
+            row0 = np.clip(np.floor(rows).astype(np.intp), 0, rows_count - 2)
+            column0 = np.clip(np.floor(columns).astype(np.intp), 0, columns_count - 2)
+
+            samples = np.stack([data[row0 + dr, column0 + dc] for dr in (0, 1) for dc in (0, 1)])
+            samples = samples.astype(np.float64)
+            samples[samples == HGT_VOID] = np.inf
+            result[points] = samples.max(axis=0) * FEET_PER_METER
+
+        return result.reshape(lats.shape)
+
+    def ray_limits(self, lats, lons, arrival_altitudes, unit_ranges, headings, max_distances):
+        """
+        March along every heading from every location and return how far out the glide path
+        stays clear of the terrain.
+
+        Flying back to a location along a heading, the glider must be arrival_altitude + d /
+        unit_range feet high at d nautical miles out. The limit is the last sample before that
+        path comes within the clearance of the terrain, or reaches a point without terrain data.
+
+        Parameters:
+        lats, lons, arrival_altitudes (array, shape (L,)): The locations and their arrival
+          altitudes MSL in feet.
+        unit_ranges (array, shape (..., L, H)): Glide range per foot, from rings.range_per_foot.
+          Leading dimensions (e.g. one per scenario) share the terrain samples of the rays.
+        headings (array, shape (H,)): Headings in degrees.
+        max_distances (array, shape (..., L)): How far out to march from each location, in
+          nautical miles.
+
+        Returns:
+        array, shape (..., L, H): The limits in nautical miles; inf where the path is clear out
+        to max_distances.
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        arrival_altitudes = np.asarray(arrival_altitudes, dtype=np.float64)
+        unit_ranges = np.asarray(unit_ranges, dtype=np.float64)
+        headings = np.asarray(headings, dtype=np.float64)
+        shape = unit_ranges.shape
+        unit_ranges = unit_ranges.reshape(-1, lats.size, headings.size)
+        max_distances = np.broadcast_to(np.asarray(max_distances, dtype=np.float64),
+                                        shape[:-1]).reshape(-1, lats.size)
+        limits = np.full(unit_ranges.shape, np.inf)
+        if lats.size == 0 or unit_ranges.size == 0:
+            return limits.reshape(shape)
+
+        steps = max(int(np.ceil(max_distances.max() / self.step)), 1)
+        distances = self.step * np.arange(1, steps + 1)
+        # March the locations in chunks so the samples fit in memory
+        chunk = max(MAX_RAY_SAMPLES // (steps * max(headings.size, 1) * len(unit_ranges)), 1)
+        for start in range(0, lats.size, chunk):
+            end = min(start + chunk, lats.size)
+            ray_distances = np.broadcast_to(distances[:, None, None],
+                                            (steps, end - start, headings.size))
+            ray_lats, ray_lons = destination_points(lats[start:end], lons[start:end],
+                                                    ray_distances, headings)
+            # The rays don't depend on the glider or the wind, so every profile shares the samples
+            terrain = self.elevations(ray_lats, ray_lons)[:, None]
+
+            with np.errstate(divide='ignore'):
+                climb = np.where(unit_ranges[:, start:end] > 0, 1.0 / unit_ranges[:, start:end],
+                                 np.inf)
+            path = (arrival_altitudes[None, None, start:end, None]
+                    + distances[:, None, None, None] * climb[None])
+            blocked = ((path < terrain + self.clearance)
+                       & (distances[:, None, None, None] <= max_distances[None, :, start:end, None]))
+
+            first = np.argmax(blocked, axis=0)
+            limits[:, start:end] = np.where(blocked.any(axis=0), distances[first] - self.step,
+                                            np.inf)
+
+        return limits.reshape(shape)
+
+
+terrain_model = TerrainModel(TERRAIN_DIR) if TERRAIN_DIR else None
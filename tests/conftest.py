@@ -0,0 +1,10 @@
+import os
+import sys
+
+# The app's modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Map jobs run in the test process, without Redis
+os.environ.setdefault('CELERY_BROKER_URL', 'memory://')
+os.environ.setdefault('CELERY_RESULT_BACKEND', 'cache+memory://')
+os.environ.setdefault('CELERY_ALWAYS_EAGER', 'true')
@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+
+from altitude_grid import glider_class, wind_bucket, wind_cell, worst_range_per_foot, \
+    class_range, compute_grid, write_grids, AltitudeGridStore
+from benchmarks.bench_pipeline import write_synthetic_cup
+from rings import range_per_foot
+from task_analysis import altitudes_required
+from turnpoints import TurnpointRepository
+
+SPEEDS = [0.0, 10.0, 20.0]
+DIRECTIONS = [0.0, 45.0, 90.0, 135.0, 180.0, 225.0, 270.0, 315.0]
+MANIFEST = {'glide_step': 2.0, 'vg_step': 5.0, 'wind_speeds': SPEEDS,
+            'wind_directions': DIRECTIONS}
+
+
+@pytest.fixture(scope='module')
+def turnpoints(tmp_path_factory):
+    path = tmp_path_factory.mktemp('grid') / 'synthetic.cup'
+    write_synthetic_cup(str(path), 60, spread=2.0)
+    repository = TurnpointRepository(str(path))
+    repository.refresh()
+    return repository
+
+
+def test_wind_bucket_rounds_the_speed_up():
+    assert wind_bucket(14, 10, SPEEDS, DIRECTIONS) == (20.0, 0.0, False)
+    assert wind_bucket(10, 80, SPEEDS, DIRECTIONS) == (10.0, 90.0, False)
+    assert wind_bucket(0, 80, SPEEDS, DIRECTIONS) == (0.0, 0.0, False)
+    assert wind_bucket(0.5, 200, SPEEDS, DIRECTIONS) == (10.0, 180.0, False)
+
+
+def test_wind_bucket_reports_winds_above_the_strongest():
+    assert wind_bucket(25, 350, SPEEDS, DIRECTIONS) == (20.0, 0.0, True)
+
+
+def test_wind_cell_covers_halfway_to_the_neighbours():
+    assert wind_cell(20, 0, SPEEDS, DIRECTIONS) == (10.0, 20.0, -22.5, 22.5)
+    assert wind_cell(10, 90, SPEEDS, [90.0]) == (0.0, 10.0, -90.0, 270.0)
+
+
+def test_worst_range_is_below_every_glider_and_wind_of_the_cell():
+    rng = np.random.default_rng(0)
+    headings = np.arange(0, 360, 0.5)
+    for speed, direction in [(10.0, 0.0), (20.0, 45.0), (20.0, 315.0), (0.0, 0.0)]:
+        for glide_ratio, vg in [(34.0, 50.0), (40.0, 55.0)]:
+            worst = class_range(glide_ratio, vg, 0.5, speed, direction, MANIFEST)(headings)
+            speed_low, speed_high, first, last = wind_cell(speed, direction, SPEEDS, DIRECTIONS)
+            for _ in range(50):
+                wind_speed = rng.uniform(speed_low, speed_high)
+                wind_direction = rng.uniform(first, last) % 360
+                glider_vg = rng.uniform(vg - 2.5, vg + 2.5)
+                glider_ratio = rng.uniform(glide_ratio, glide_ratio + 2)
+                actual = range_per_foot(glider_ratio, 0.5, glider_vg, [wind_speed],
+                                        [wind_direction], headings)[0]
+                assert np.all(worst <= actual + 1e-12)
+
+
+def test_worst_range_matches_the_glide_model_for_one_wind():
+    headings = np.arange(0, 360, 7.0)
+    worst = worst_range_per_foot(34, 0.5, 50, 50, 15, 15, 270, 270, headings)
+    expected = range_per_foot(34, 0.5, 50, [15], [270], headings)[0]
+    np.testing.assert_allclose(worst, expected, rtol=1e-12)
+
+
+def test_grid_never_understates_the_altitude_required(turnpoints):
+    lats = np.linspace(42.5, 44.0, 12)
+    lons = np.linspace(-72.8, -71.2, 12)
+    grid_lats, grid_lons = np.meshgrid(lats, lons, indexing='ij')
+    for wind_speed, wind_direction, vg in [(14.0, 20.0, 52.4), (9.0, 200.0, 47.6),
+                                           (20.0, 300.0, 50.0)]:
+        speed, direction, exceeded = wind_bucket(wind_speed, wind_direction, SPEEDS, DIRECTIONS)
+        assert not exceeded
+        glide_ratio, class_vg = glider_class(35.0, vg, 2.0, 5.0)
+        grid = compute_grid(turnpoints, lats, lons,
+                            class_range(glide_ratio, class_vg, 0.5, speed, direction, MANIFEST),
+                            1500, 50)
+        exact, _ = altitudes_required(turnpoints, grid_lats.ravel(), grid_lons.ravel(), 35.0, 0.5,
+                                      vg, wind_speed, wind_direction, 1500, 50)
+        exact = exact.reshape(grid.shape)
+        reachable = np.isfinite(exact)
+        assert reachable.any()
+        # Where the grid finds a landing the glider finds one too, never from lower
+        assert np.all(np.isnan(grid[~reachable]))
+        covered = ~np.isnan(grid)
+        assert covered.any()
+        assert np.all(grid[covered] >= exact[covered] - 0.5)
+
+
+def test_store_finds_the_covering_grid(tmp_path, turnpoints):
+    lats, lons = np.linspace(42.5, 44.0, 4), np.linspace(-72.8, -71.2, 4)
+    grids = []
+    for speed, direction in [(0.0, 0.0)] + [(s, d) for s in SPEEDS[1:] for d in DIRECTIONS]:
+        values = compute_grid(turnpoints, lats, lons,
+                              class_range(34.0, 50.0, 0.5, speed, direction, MANIFEST), 1500, 50)
+        grids.append(({'region': 'synthetic', 'glide_ratio': 34.0, 'vg': 50.0,
+                       'safety_margin': 0.5, 'arrival_altitude': 1500, 'wind_speed': speed,
+                       'wind_direction': direction, 'south': 42.5, 'west': -72.8,
+                       'dlat': 0.5, 'dlon': float(lons[1] - lons[0])}, values))
+    write_grids(str(tmp_path), grids, dict(MANIFEST, step_nm=30, radius_nm=50))
+
+    store = AltitudeGridStore(str(tmp_path))
+    grid, exceeded = store.find('synthetic', 35.0, 49.0, 0.5, 1500, 14, 30)
+    assert (grid.entry['wind_speed'], grid.entry['wind_direction'], exceeded) == (20.0, 45.0,
+                                                                                  False)
+    grid, exceeded = store.find('synthetic', 35.0, 49.0, 0.5, 1500, 30, 30)
+    assert exceeded
+    assert store.find('synthetic', 35.0, 60.0, 0.5, 1500, 14, 30) is None
+    assert AltitudeGridStore(str(tmp_path / 'missing')).find('synthetic', 35.0, 49.0, 0.5, 1500,
+                                                             14, 30) is None
+
+
+def test_contours_without_grids_are_unavailable(monkeypatch):
+    import app
+    monkeypatch.setattr(app, 'get_altitude_grids', lambda: AltitudeGridStore(None))
+    response = app.app.test_client().get('/api/altitude-grid/contours?altitudes=3000')
+    assert response.status_code == 503
+    assert response.get_json()['error'] == 'No precomputed grids are available'
@@ -0,0 +1,73 @@
+import pytest
+
+import app
+
+
+@pytest.fixture
+def renders(monkeypatch):
+    """
+    Start from an empty index page cache and count how often the page is rendered.
+    """
+    monkeypatch.setattr(app, '_index_page', {'version': None, 'body': None, 'etag': None})
+    calls = []
+
+    def render_index_page():
+        calls.append(1)
+        return original()
+    original = app.render_index_page
+    monkeypatch.setattr(app, 'render_index_page', render_index_page)
+    return calls
+
+
+@pytest.fixture
+def client():
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['agreed_to_terms'] = True
+    return client
+
+
+def test_index_page_is_rendered_once_and_revalidated(client, renders):
+    first = client.get('/index', headers={'Accept-Encoding': 'identity'})
+    assert first.status_code == 200
+    assert first.headers['Cache-Control'] == 'private, no-cache'
+    etag, weak = first.get_etag()
+    assert not weak and etag == app._index_page['etag']
+
+    second = client.get('/index', headers={'Accept-Encoding': 'identity'})
+    assert second.get_data() == first.get_data() and second.get_etag() == (etag, False)
+    revalidated = client.get('/index', headers={'If-None-Match': '"%s"' % etag})
+    assert revalidated.status_code == 304 and revalidated.get_data() == b''
+    assert revalidated.headers['Cache-Control'] == 'private, no-cache'
+    assert len(renders) == 1
+
+    # A compressed copy has its own ETag, which revalidates the same way
+    gzipped = client.get('/index', headers={'Accept-Encoding': 'gzip'})
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    assert gzipped.get_etag() == (etag + '-gzip', False)
+    assert client.get('/index', headers={'If-None-Match': '"%s-gzip"' % etag}).status_code == 304
+    assert len(renders) == 1
+
+
+def test_index_page_is_rendered_again_when_its_inputs_change(client, renders, monkeypatch):
+    etag = client.get('/index').get_etag()[0]
+    version = app.index_version()
+
+    monkeypatch.setattr(app, 'index_version', lambda: version + ('changed',))
+    response = client.get('/index', headers={'If-None-Match': '"%s"' % etag})
+    # Same page, so the same ETag, but it was rendered again to find out
+    assert response.status_code == 304
+    assert len(renders) == 2
+    assert app._index_page['version'] == version + ('changed',)
+    client.get('/index')
+    assert len(renders) == 2
+
+
+def test_index_page_with_flashed_messages_is_not_cached(client, renders):
+    with client.session_transaction() as session:
+        session['_flashes'] = [('danger', 'Pick at least one turnpoint')]
+    response = client.get('/index')
+    assert response.status_code == 200
+    assert 'Pick at least one turnpoint' in response.get_data(as_text=True)
+    assert response.get_etag() == (None, None)
+    assert app._index_page['etag'] is None
@@ -0,0 +1,114 @@
+import logging
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+from instrumentation import Metrics, configure_logging, server_timing, stage, start_request, \
+    finish_request, TIME_BUCKETS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def samples(text):
+    """
+    Parse Prometheus text into {(name, labels): value}.
+    """
+    parsed = {}
+    for line in text.splitlines():
+        if line.startswith('#'):
+            continue
+        match = re.match(r'^(\w+)(?:\{(.*)\})? (\S+)$', line)
+        assert match, line
+        labels = tuple(sorted(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', match.group(2) or '')))
+        parsed[(match.group(1), labels)] = float(match.group(3))
+    return parsed
+
+
+def test_histogram_buckets_are_cumulative():
+    metrics = Metrics()
+    for seconds in (0.003, 0.02, 0.02, 40.0):
+        metrics.observe('gfp_request_seconds', seconds, endpoint='index')
+    values = samples(metrics.render())
+
+    def bucket(le):
+        return values[('gfp_request_seconds_bucket', (('endpoint', 'index'), ('le', le)))]
+
+    counts = [bucket(repr(float(bound))) for bound in TIME_BUCKETS]
+    assert counts[:4] == [0, 1, 1, 3]
+    assert counts == sorted(counts) and counts[-1] == 3
+    assert bucket('+Inf') == 4
+    assert values[('gfp_request_seconds_count', (('endpoint', 'index'),))] == 4
+    assert values[('gfp_request_seconds_sum', (('endpoint', 'index'),))] == pytest.approx(40.043)
+
+
+def test_counters_gauges_and_label_escaping():
+    metrics = Metrics()
+    metrics.count('gfp_requests_total', endpoint='map', method='GET', status=200)
+    metrics.count('gfp_requests_total', 2, endpoint='map', method='GET', status=200)
+    metrics.set('gfp_turnpoints_loaded', 5)
+    metrics.set('gfp_turnpoints_loaded', 7)
+    metrics.count('gfp_geometry_cache_requests_total', result='a "quoted" \\ value')
+    text = metrics.render()
+    values = samples(text)
+
+    assert values[('gfp_requests_total', (('endpoint', 'map'), ('method', 'GET'),
+                                          ('status', '200')))] == 3
+    assert values[('gfp_turnpoints_loaded', ())] == 7
+    assert 'gfp_geometry_cache_requests_total{result="a \\"quoted\\" \\\\ value"} 1.0' in text
+    assert '# TYPE gfp_request_seconds histogram' in text
+    metrics.clear()
+    assert samples(metrics.render()) == {}
+
+
+def test_server_timing_adds_up_repeated_stages():
+    assert server_timing([('rings', 0.01), ('union', 0.002), ('rings', 0.005)], 0.05) \
+        == 'rings;dur=15.0, union;dur=2.0, total;dur=50.0'
+    assert server_timing([]) == ''
+
+    start_request()
+    with stage('render'):
+        pass
+    timings = finish_request()
+    assert [name for name, _ in timings] == ['render']
+    # Outside a request the stages are only counted in the histograms
+    with stage('render'):
+        pass
+    assert finish_request() == []
+
+
+def test_responses_carry_server_timing_and_are_counted():
+    import app
+    client = app.app.test_client()
+    response = client.get('/api/turnpoints?limit=1')
+    assert re.fullmatch(r'(\w+;dur=\d+\.\d, )*total;dur=\d+\.\d',
+                        response.headers['Server-Timing'])
+
+    values = samples(client.get('/metrics').get_data(as_text=True))
+    assert values[('gfp_requests_total', (('endpoint', 'api_turnpoints'), ('method', 'GET'),
+                                          ('status', str(response.status_code))))] >= 1
+
+
+def test_configure_logging_keeps_existing_setup():
+    root = logging.getLogger()
+    handler = logging.NullHandler()
+    level = root.level
+    root.addHandler(handler)
+    root.setLevel(logging.WARNING)
+    try:
+        configure_logging('DEBUG')
+        assert root.level == logging.WARNING
+        assert handler in root.handlers
+    finally:
+        root.removeHandler(handler)
+        root.setLevel(level)
+
+
+def test_configure_logging_sets_up_stderr_when_nothing_is():
+    code = ('import logging, instrumentation; instrumentation.configure_logging("DEBUG"); '
+            'root = logging.getLogger(); print(root.level, len(root.handlers))')
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True,
+                            text=True, check=True).stdout
+    assert output.split() == [str(logging.DEBUG), '1']
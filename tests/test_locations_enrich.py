@@ -0,0 +1,57 @@
+import csv
+
+from utilities.locationsDataEnrich import Geocoder, GeocodeCache, enrich_locations
+
+
+class FakeGeocoder(Geocoder):
+    name = 'fake'
+
+    def __init__(self):
+        super().__init__(workers=1, rate=1000.0)
+        self.points = []
+
+    def reverse(self, lat, lon):
+        self.points.append((lat, lon))
+        return ('North' if lat > 42.5 else 'South', 'County %d' % round(lon))
+
+
+def enrich(tmp_path, name, text, chunk_size=2):
+    source, output = tmp_path / name, tmp_path / ('enriched_' + name)
+    source.write_text(text)
+    geocoder = FakeGeocoder()
+    cache = GeocodeCache(':memory:', geocoder.name)
+    try:
+        counts = enrich_locations(str(source), str(output), geocoder, cache,
+                                  chunk_size=chunk_size)
+    finally:
+        cache.close()
+    with open(output, newline='') as file:
+        return counts, list(csv.reader(file))
+
+
+def test_blank_rows_and_names_of_a_csv_file_are_not_a_task_section(tmp_path, capsys):
+    (rows, lookups), written = enrich(tmp_path, 'fields.csv', (
+        'name,code,lat,lon\n'
+        'Sterling,3B3,42.426,-71.793\n'
+        '\n'
+        ',,,\n'
+        ',NONAME,42.9,-72.3\n'
+        'Related Tasks Field,RTF,42.1,-71.1\n'
+        'Orange,ORE,42.57,-72.29\n'))
+    assert (rows, lookups) == (4, 4)
+    assert [row[1] for row in written] == ['code', '3B3', 'NONAME', 'RTF', 'ORE']
+    assert written[2][-2:] == ['North', 'County -72']
+    assert 'Skipped 2 blank rows' in capsys.readouterr().err
+
+
+def test_the_task_section_of_a_cup_file_is_copied(tmp_path):
+    (rows, lookups), written = enrich(tmp_path, 'fields.cup', (
+        'name,code,country,lat,lon,elev,style\n'
+        '"Sterling","3B3",US,4225.560N,07147.580W,459ft,5\n'
+        '"Orange","ORE",US,4234.200N,07217.400W,555ft,5\n'
+        '"Sterling again","3B3",US,4225.560N,07147.580W,459ft,5\n'
+        '-----Related Tasks-----\n'
+        '"Task","3B3","ORE","3B3"\n'))
+    assert (rows, lookups) == (3, 2)
+    assert written[-2:] == [['-----Related Tasks-----'], ['Task', '3B3', 'ORE', '3B3']]
+    assert written[1][-2:] == ['South', 'County -72']
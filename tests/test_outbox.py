@@ -0,0 +1,186 @@
+import json
+import os
+import smtplib
+
+import pytest
+
+import outbox as outbox_module
+from outbox import Outbox, CLAIM_TIMEOUT_SECONDS
+
+
+class FakeTransport:
+    """
+    Records the messages sent, raising the queued errors first.
+    """
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.sent = []
+        self.closed = 0
+
+    def send(self, message):
+        if self.errors:
+            error = self.errors.pop(0)
+            if error is not None:
+                raise error
+        self.sent.append(message)
+
+    def close(self):
+        self.closed += 1
+
+
+class FakeClock:
+    def __init__(self, now=1000000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def time_ns(self):
+        return int(self.now * 1e9)
+
+    def perf_counter(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(outbox_module, 'time', clock)
+    return clock
+
+
+def make_outbox(tmp_path, transport, **options):
+    options.setdefault('retry_seconds', 60)
+    return Outbox(str(tmp_path), transport, sender='planner@example.com', **options)
+
+
+def entry(box, state, message_id):
+    with open(box._path(state, message_id)) as file:
+        return json.load(file)
+
+
+def test_queued_messages_are_sent_and_removed(tmp_path, clock):
+    transport = FakeTransport()
+    box = make_outbox(tmp_path, transport)
+    first = box.enqueue('pilot@example.com', 'Hello', 'First')
+    clock.now += 1
+    box.enqueue('pilot@example.com', 'Hello again', 'Second')
+    assert len(box.pending()) == 2 and box.pending()[0] == first
+
+    assert box.deliver() == 2
+    assert [message['Subject'] for message in transport.sent] == ['Hello', 'Hello again']
+    assert transport.sent[0]['From'] == 'planner@example.com'
+    assert transport.sent[0].get_content().strip() == 'First'
+    assert box.pending() == []
+    assert os.listdir(tmp_path / 'sending') == []
+    assert box.deliver() == 0
+    assert transport.closed == 1
+
+
+def test_batches_are_limited(tmp_path, clock):
+    transport = FakeTransport()
+    box = make_outbox(tmp_path, transport, batch_size=2)
+    for number in range(5):
+        box.enqueue('pilot@example.com', 'Message %d' % number, 'Body')
+    assert box.deliver() == 2
+    assert len(box.pending()) == 3
+
+
+def test_failed_messages_are_retried_with_backoff(tmp_path, clock):
+    error = smtplib.SMTPDataError(451, b'Try again later')
+    transport = FakeTransport([error, error])
+    box = make_outbox(tmp_path, transport)
+    message_id = box.enqueue('pilot@example.com', 'Hello', 'Body')
+
+    assert box.deliver() == 0
+    queued = entry(box, 'pending', message_id)
+    assert queued['attempts'] == 1
+    assert queued['next_attempt'] == clock.now + 60
+    # Not due yet: nothing is sent
+    clock.now += 59
+    assert box.deliver() == 0
+    assert entry(box, 'pending', message_id)['attempts'] == 1
+
+    clock.now += 1
+    assert box.deliver() == 0
+    queued = entry(box, 'pending', message_id)
+    assert queued['attempts'] == 2
+    assert queued['next_attempt'] == clock.now + 120
+
+    clock.now += 120
+    assert box.deliver() == 1
+    assert box.pending() == []
+
+
+def test_connection_errors_end_the_batch(tmp_path, clock):
+    transport = FakeTransport([ConnectionRefusedError('Connection refused')])
+    box = make_outbox(tmp_path, transport)
+    for number in range(3):
+        box.enqueue('pilot@example.com', 'Message %d' % number, 'Body')
+        clock.now += 1
+
+    assert box.deliver() == 0
+    assert transport.sent == []
+    assert [entry(box, 'pending', message_id)['attempts'] for message_id in box.pending()] \
+        == [1, 0, 0]
+    assert box.deliver() == 2
+
+
+def test_messages_are_dead_lettered_after_the_last_attempt(tmp_path, clock):
+    transport = FakeTransport([smtplib.SMTPRecipientsRefused({})] * 8)
+    box = make_outbox(tmp_path, transport, max_attempts=8)
+    message_id = box.enqueue('nobody@example.com', 'Hello', 'Body')
+
+    for attempt in range(8):
+        clock.now += outbox_module.MAX_RETRY_SECONDS
+        assert box.deliver() == 0
+    assert box.pending() == []
+    failed = entry(box, 'failed', message_id)
+    assert failed['attempts'] == 8
+    assert failed['error']
+    assert transport.errors == []
+
+
+def test_stale_claims_are_returned_to_the_queue(tmp_path, clock):
+    transport = FakeTransport()
+    box = make_outbox(tmp_path, transport)
+    stale = box.enqueue('pilot@example.com', 'Stale', 'Body')
+    fresh = box.enqueue('pilot@example.com', 'Fresh', 'Body')
+    # Two senders claimed the messages; the first one died long ago
+    for message_id in (stale, fresh):
+        os.replace(box._path('pending', message_id), box._path('sending', message_id))
+    now = os.stat(box._path('sending', fresh)).st_mtime
+    os.utime(box._path('sending', stale), (now - CLAIM_TIMEOUT_SECONDS - 1,) * 2)
+    clock.now = now
+
+    assert box.deliver() == 1
+    assert [message['Subject'] for message in transport.sent] == ['Stale']
+    assert os.listdir(tmp_path / 'sending') == [fresh + '.json']
+
+
+def test_unreadable_messages_are_moved_aside(tmp_path, clock):
+    box = make_outbox(tmp_path, FakeTransport())
+    (tmp_path / 'pending' / 'broken.json').write_text('{')
+    assert box.deliver() == 0
+    assert os.listdir(tmp_path / 'failed') == ['broken.json']
+
+
+def test_the_app_starts_the_sender_on_its_first_request_only_when_enabled(tmp_path,
+                                                                           monkeypatch):
+    import app
+    # Importing the app starts no sender
+    assert app.outbox._thread is None
+    box = make_outbox(tmp_path, FakeTransport(), poll_seconds=60)
+    monkeypatch.setattr(app, 'outbox', box)
+    client = app.app.test_client()
+
+    client.get('/user-guide')
+    assert box._thread is None
+
+    monkeypatch.setattr(app, 'OUTBOX_SENDER', True)
+    client.get('/user-guide')
+    try:
+        assert box._thread.is_alive()
+    finally:
+        box.stop()
@@ -0,0 +1,112 @@
+import os
+
+import pytest
+
+from plans import FlightPlan, CustomLocation, PlanError, PlanStore, MAX_PLAN_BANDS, \
+    MAX_PLAN_LOCATIONS
+
+
+def make_plan(**changes):
+    fields = dict(selected_glider='other', glide_ratio=34.0, vg=50.0, safety_margin=0.5,
+                  wind_speed=10.0, wind_direction=270.0, arrival_altitude=1500.0,
+                  ring_spacing='thousands', ring_start_alt=3000, ring_end_alt=8000,
+                  selected_codes=('3B3',))
+    fields.update(changes)
+    return FlightPlan(**fields)
+
+
+def test_plan_accepts_the_largest_band_count():
+    # Both ends get a ring: MAX_PLAN_BANDS rings span MAX_PLAN_BANDS - 1 spacings
+    plan = make_plan(ring_start_alt=0, ring_end_alt=1000 * (MAX_PLAN_BANDS - 1))
+    assert len(plan.polygon_altitudes()) == MAX_PLAN_BANDS
+    plan = make_plan(ring_spacing='evenThousands', ring_start_alt=0,
+                     ring_end_alt=2000 * (MAX_PLAN_BANDS - 1))
+    assert len(plan.polygon_altitudes()) == MAX_PLAN_BANDS
+
+
+def test_plan_rejects_too_many_bands():
+    with pytest.raises(PlanError, match='Too many rings'):
+        make_plan(ring_start_alt=0, ring_end_alt=1000 * MAX_PLAN_BANDS)
+    with pytest.raises(PlanError, match='Too many rings'):
+        make_plan(ring_spacing='oddThousands', ring_start_alt=1000,
+                  ring_end_alt=1000 + 2000 * MAX_PLAN_BANDS)
+    with pytest.raises(PlanError, match='Too many rings'):
+        make_plan(ring_start_alt=-10 ** 9, ring_end_alt=10 ** 9)
+
+
+@pytest.mark.parametrize('value', [float('nan'), float('inf'), float('-inf')])
+def test_plan_rejects_non_finite_altitudes(value):
+    with pytest.raises(PlanError, match='arrival altitude'):
+        make_plan(arrival_altitude=value)
+    with pytest.raises(PlanError, match='Invalid altitude for Field'):
+        make_plan(custom_locations=(CustomLocation('Field', value, 42.5, -71.8),))
+
+
+def test_non_finite_altitudes_from_links_are_rejected():
+    import app
+    client = app.app.test_client()
+    response = client.get('/map?selected_glider=other&glide_ratio=34&vg=50&safety_margin=0.5'
+                          '&wind_speed=10&wind_direction=270&arrival_altitude=nan'
+                          '&ring_spacing=thousands&ring_start_alt=3000&ring_end_alt=5000'
+                          '&selected_rows=%5B%273B3%27%5D')
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        assert session['_flashes'] == [('danger', 'The arrival altitude must be a number')]
+
+
+def test_plan_rejects_too_many_locations():
+    make_plan(selected_codes=tuple('C%d' % i for i in range(MAX_PLAN_LOCATIONS)))
+    with pytest.raises(PlanError, match='Too many locations'):
+        make_plan(selected_codes=tuple('C%d' % i for i in range(MAX_PLAN_LOCATIONS)),
+                  custom_locations=(CustomLocation('Field', 500.0, 42.5, -71.8),))
+
+
+def test_store_keeps_the_most_recently_saved_files(tmp_path):
+    store = PlanStore(str(tmp_path), max_entries=1, max_files=3)
+    plans = [make_plan(ring_end_alt=4000 + 1000 * i) for i in range(5)]
+    plan_ids = []
+    for age, plan in enumerate(plans[:3]):
+        plan_ids.append(store.save(plan))
+        os.utime(tmp_path / (plan_ids[-1] + '.json'), (age, age))
+    # Saving the oldest plan again makes it the most recent one
+    store.save(plans[0])
+    plan_ids += [store.save(plan) for plan in plans[3:]]
+
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        plan_id + '.json' for plan_id in (plan_ids[0], plan_ids[3], plan_ids[4]))
+    assert PlanStore(str(tmp_path)).get(plan_ids[0]) == plans[0]
+    assert PlanStore(str(tmp_path)).get(plan_ids[1]) is None
+
+
+def test_legacy_links_are_drawn_without_storing_the_plan(tmp_path, monkeypatch):
+    import app
+    monkeypatch.setattr(app, 'plan_store', PlanStore(str(tmp_path)))
+    client = app.app.test_client()
+    response = client.get('/map?selected_glider=other&glide_ratio=34&vg=50&safety_margin=0.5'
+                          '&wind_speed=10&wind_direction=270&arrival_altitude=1500'
+                          '&ring_spacing=thousands&ring_start_alt=3000&ring_end_alt=5000'
+                          '&selected_rows=%5B%273B3%27%5D')
+    assert response.status_code == 200
+    assert b'replaceState' not in response.data
+    assert os.listdir(tmp_path) == []
+
+
+def test_rings_of_a_plan_whose_forecast_expired_are_rejected(tmp_path, monkeypatch):
+    import app
+    import plans
+    store = PlanStore(str(tmp_path))
+    monkeypatch.setattr(app, 'plan_store', store)
+    plan_id = store.save(make_plan(wind_forecast='2024-04-20T18'))
+    calls = []
+
+    def get_wind_field(hour):
+        # The forecast is found for the plan, then removed before its locations are resolved
+        calls.append(hour)
+        if len(calls) > 1:
+            raise ValueError('No wind forecast for %r' % hour)
+        return None
+    monkeypatch.setattr(plans, 'get_wind_field', get_wind_field)
+
+    response = app.app.test_client().get('/api/rings/%s' % plan_id)
+    assert response.status_code == 400
+    assert response.get_json()['error'] == "No wind forecast for '2024-04-20T18'"
@@ -0,0 +1,91 @@
+from math import radians, degrees, sin, cos, asin, atan2, sqrt
+
+import numpy as np
+import pytest
+
+from benchmarks.bench_pipeline import write_synthetic_cup
+from reachability import reachable_turnpoints
+from rings import EARTH_RADIUS_NM
+from turnpoints import TurnpointRepository
+from utils import glide_range
+
+# Largest difference allowed from the scalar reference, in feet
+TOLERANCE_FEET = 1e-6
+
+
+@pytest.fixture(scope='module')
+def turnpoints(tmp_path_factory):
+    path = tmp_path_factory.mktemp('reachable') / 'synthetic.cup'
+    write_synthetic_cup(str(path), 400, spread=2.0)
+    repository = TurnpointRepository(str(path))
+    repository.refresh()
+    return repository
+
+
+def scalar_distance_and_bearing(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(radians, (lat1, lon1, lat2, lon2))
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+    distance = 2 * EARTH_RADIUS_NM * asin(sqrt(min(max(a, 0.0), 1.0)))
+    bearing = atan2(sin(lon2 - lon1) * cos(lat2),
+                    cos(lat1) * sin(lat2) - sin(lat1) * cos(lat2) * cos(lon2 - lon1))
+    return distance, degrees(bearing) % 360
+
+
+def scalar_reachable(turnpoints, lat, lon, altitude, glide_ratio, safety_margin, Vg, wind_speed,
+                     wind_direction, arrival_altitude_agl):
+    """
+    The altitude required at every landable turnpoint the glider reaches, one at a time with
+    the scalar glide_range.
+    """
+    required = {}
+    for i in np.flatnonzero(turnpoints.landable):
+        arrival = float(turnpoints.elevs[i]) + arrival_altitude_agl
+        # The ring around the turnpoint must reach the glider along the bearing out to it
+        distance, heading = scalar_distance_and_bearing(float(turnpoints.lats[i]),
+                                                        float(turnpoints.lons[i]), lat, lon)
+        if altitude <= arrival:
+            continue
+        reach = glide_range(altitude, arrival, glide_ratio, safety_margin, Vg, wind_speed,
+                            wind_direction, heading)
+        if reach >= distance:
+            # The range grows linearly with the height above the arrival altitude
+            required[int(i)] = arrival + distance * (altitude - arrival) / reach
+    return required
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_reachable_turnpoints_match_the_scalar_reference(turnpoints, seed):
+    rng = np.random.default_rng(seed)
+    lat, lon = rng.uniform(42.5, 44.0), rng.uniform(-73.0, -71.0)
+    altitude = rng.uniform(5000, 12000)
+    glide_ratio, safety_margin, Vg = rng.uniform(25, 50), rng.uniform(0, 0.6), rng.uniform(45, 60)
+    wind_speed, wind_direction = rng.uniform(0, 30), rng.uniform(0, 360)
+
+    indices, distances, courses, required = reachable_turnpoints(
+        turnpoints, lat, lon, altitude, glide_ratio, safety_margin, Vg, wind_speed,
+        wind_direction, 1000, limit=len(turnpoints), terrain=None)
+    expected = scalar_reachable(turnpoints, lat, lon, altitude, glide_ratio, safety_margin, Vg,
+                                wind_speed, wind_direction, 1000)
+
+    assert expected
+    assert sorted(indices.tolist()) == sorted(expected)
+    np.testing.assert_allclose(required, [expected[i] for i in indices], rtol=0,
+                               atol=TOLERANCE_FEET)
+    # The largest margin first, and the course flown back to each turnpoint
+    assert np.all(np.diff(required) >= 0)
+    for i, distance, course in zip(indices, distances, courses):
+        expected_distance, expected_course = scalar_distance_and_bearing(
+            lat, lon, float(turnpoints.lats[i]), float(turnpoints.lons[i]))
+        assert distance == pytest.approx(expected_distance, abs=1e-9)
+        assert (course - expected_course + 180) % 360 - 180 == pytest.approx(0, abs=1e-9)
+
+
+def test_reachable_turnpoints_are_limited_and_empty_below_the_arrival_altitude(turnpoints):
+    indices, _, _, required = reachable_turnpoints(turnpoints, 43.25, -72.0, 8000, 40, 0.2, 50,
+                                                   0, 0, 1000, limit=5, terrain=None)
+    everything = reachable_turnpoints(turnpoints, 43.25, -72.0, 8000, 40, 0.2, 50, 0, 0, 1000,
+                                      limit=len(turnpoints), terrain=None)
+    assert indices.tolist() == everything[0][:5].tolist()
+    low = reachable_turnpoints(turnpoints, 43.25, -72.0, float(np.min(turnpoints.elevs)) + 999,
+                               40, 0.2, 50, 0, 0, 1000, terrain=None)
+    assert all(array.size == 0 for array in low)
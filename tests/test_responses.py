@@ -0,0 +1,54 @@
+import gzip
+
+import pytest
+from flask import Flask
+
+import responses
+from responses import compressed_response, not_modified
+
+BODY = b'{"rings":[]}' * 200
+
+
+@pytest.fixture
+def flask_app():
+    return Flask(__name__)
+
+
+def respond(flask_app, accept_encoding, etag='abc'):
+    with flask_app.test_request_context(headers={'Accept-Encoding': accept_encoding}):
+        return compressed_response(BODY, 'application/json', etag)
+
+
+def test_each_encoding_gets_its_own_etag(flask_app):
+    identity = respond(flask_app, 'identity')
+    gzipped = respond(flask_app, 'gzip')
+    assert identity.get_etag() == ('abc', False)
+    assert gzipped.get_etag() == ('abc-gzip', False)
+    assert gzip.decompress(gzipped.get_data()) == BODY
+    if responses.brotli is not None:
+        compressed = respond(flask_app, 'br, gzip')
+        assert compressed.get_etag() == ('abc-br', False)
+        assert responses.brotli.decompress(compressed.get_data()) == BODY
+    # Small bodies are never compressed, so keep the plain ETag
+    with flask_app.test_request_context(headers={'Accept-Encoding': 'gzip'}):
+        assert compressed_response(b'{}', 'application/json', 'abc').get_etag() == ('abc', False)
+
+
+@pytest.mark.parametrize('if_none_match, matched', [
+    ('"abc"', 'abc'), ('"abc-gzip"', 'abc-gzip'), ('"abc-br"', 'abc-br'),
+    ('W/"abc-gzip"', 'abc-gzip'), ('"other", W/"abc"', 'abc'), ('*', 'abc'),
+])
+def test_any_encoding_of_the_etag_is_not_modified(flask_app, if_none_match, matched):
+    with flask_app.test_request_context(headers={'If-None-Match': if_none_match}):
+        response = not_modified('abc')
+    assert response.status_code == 304
+    assert response.get_etag() == (matched, False)
+
+
+@pytest.mark.parametrize('if_none_match', ['"abcd"', '"abc-deflate"', '"ab"'])
+def test_other_etags_are_modified(flask_app, if_none_match):
+    with flask_app.test_request_context(headers={'If-None-Match': if_none_match}):
+        assert not_modified('abc') is None
+    with flask_app.test_request_context():
+        assert not_modified('abc') is None
+        assert not_modified(None) is None
@@ -0,0 +1,26 @@
+import os
+
+from shapely.geometry import box
+
+from ring_cache import GeometryCache, canonical_key
+
+
+def test_disk_tier_round_trips_the_polygons_of_every_band(tmp_path):
+    value = [[box(0, 0, 1, 1), box(2, 2, 3, 3)], [], [box(0, 0, 5, 5).difference(box(1, 1, 2, 2))]]
+    key = canonical_key(rings=[1.5, 2])
+    GeometryCache(directory=str(tmp_path)).put(key, value)
+    assert os.listdir(tmp_path) == [key + '.wkb']
+
+    cached = GeometryCache(directory=str(tmp_path)).get(key)
+    assert [[polygon.wkt for polygon in band] for band in cached] == \
+        [[polygon.wkt for polygon in band] for band in value]
+
+
+def test_unreadable_entries_are_misses(tmp_path):
+    cache = GeometryCache(directory=str(tmp_path))
+    (tmp_path / 'truncated.wkb').write_bytes(b'\x01\x07\x00\x00')
+    (tmp_path / 'garbage.wkb').write_bytes(b'not wkb at all')
+    assert cache.get('truncated') is None
+    assert cache.get('garbage') is None
+    assert cache.get('missing') is None
+    assert cache.stats()['garbage'] == {'hits': 0, 'misses': 1, 'cached': False}
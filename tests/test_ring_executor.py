@@ -0,0 +1,66 @@
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pytest
+import shapely
+
+import ring_executor
+from ring_executor import union_bands_parallel, shutdown_pool
+from ring_union import union_bands
+from rings import compute_rings, ring_headings
+from tests.test_ring_union import TOLERANCE_AREA
+
+
+@pytest.fixture(scope='module')
+def rings():
+    rng = np.random.default_rng(5)
+    lats, lons = rng.uniform(42.2, 42.8, 40), rng.uniform(-71.9, -71.1, 40)
+    return compute_rings(np.arange(2000.0, 10000.0, 1000.0), lats, lons,
+                         rng.uniform(1000, 2000, 40), np.full(40, 15.0), np.full(40, 250.0), 35,
+                         0.3, 50, ring_headings())
+
+
+@pytest.fixture
+def pool():
+    yield
+    shutdown_pool()
+
+
+def assert_same_bands(merged, expected):
+    assert len(merged) == len(expected)
+    for merged_polygons, expected_polygons in zip(merged, expected):
+        assert len(merged_polygons) == len(expected_polygons)
+        difference = shapely.unary_union(merged_polygons).symmetric_difference(
+            shapely.unary_union(expected_polygons))
+        assert difference.area < TOLERANCE_AREA
+
+
+@pytest.mark.parametrize('workers', [2, 3, 20])
+@pytest.mark.parametrize('nested', [False, True])
+def test_parallel_merge_equals_the_in_process_merge(rings, pool, monkeypatch, nested, workers):
+    monkeypatch.setattr(ring_executor, 'RING_PARALLEL_MIN_RINGS', 0)
+    ring_vertices, ring_reachable = rings
+    merged = union_bands_parallel(ring_vertices, ring_reachable, nested=nested, workers=workers)
+    assert ring_executor._pool is not None
+    assert_same_bands(merged, union_bands(ring_vertices, ring_reachable, nested))
+
+
+def test_small_jobs_are_merged_in_process(rings, pool, monkeypatch):
+    monkeypatch.setattr(ring_executor, 'RING_PARALLEL_MIN_RINGS', 10 ** 6)
+    ring_vertices, ring_reachable = rings
+    merged = union_bands_parallel(ring_vertices, ring_reachable, workers=4)
+    assert ring_executor._pool is None
+    assert_same_bands(merged, union_bands(ring_vertices, ring_reachable))
+
+
+def test_a_broken_pool_falls_back_to_merging_in_process(rings, pool, monkeypatch):
+    class BrokenPool:
+        def submit(self, *args):
+            raise BrokenProcessPool('A worker died')
+
+    monkeypatch.setattr(ring_executor, 'RING_PARALLEL_MIN_RINGS', 0)
+    monkeypatch.setattr(ring_executor, 'get_pool', lambda workers: BrokenPool())
+    ring_vertices, ring_reachable = rings
+    merged = union_bands_parallel(ring_vertices, ring_reachable, workers=2)
+    assert_same_bands(merged, union_bands(ring_vertices, ring_reachable))
+    assert ring_executor._pool is None
@@ -0,0 +1,111 @@
+import json
+import re
+
+import numpy as np
+import pytest
+import shapely
+
+from ring_geojson import rings_feature_collection, rings_topology, GEOJSON_PRECISION, \
+    TOPOJSON_CLIENT_JS, TOPOJSON_QUANTIZATION
+from utils import plot_map, ring_label_locations, RING_LABEL_COUNT
+
+ALTITUDES = [3000, 4500.5, 6000]
+
+
+@pytest.fixture
+def merged_rings():
+    # Polygons are [lat, lon]; the middle band is empty
+    return [
+        [shapely.Point(42.5, -71.5).buffer(0.1), shapely.Point(43.1, -72.2).buffer(0.05)],
+        [],
+        [shapely.Point(42.6, -71.6).buffer(0.4)],
+    ]
+
+
+def decode_topology(topology):
+    """
+    Return the [lon, lat] rings of every geometry of a rings topology, as topojson-client would.
+    """
+    scale = np.array(topology['transform']['scale'])
+    translate = np.array(topology['transform']['translate'])
+    arcs = [np.cumsum(np.array(arc), axis=0) * scale + translate for arc in topology['arcs']]
+    return [[[arcs[index] for indexes in polygon for index in indexes]
+             for polygon in geometry['arcs']]
+            for geometry in topology['objects']['rings']['geometries']]
+
+
+def test_feature_collection_has_one_feature_per_band(merged_rings):
+    collection = rings_feature_collection(ALTITUDES, merged_rings, ring_label_locations)
+    json.dumps(collection)
+    features = collection['features']
+    assert [feature['properties']['altitude'] for feature in features] == [3000, 6000]
+    assert isinstance(features[0]['properties']['altitude'], int)
+
+    for feature, merged_polygons in zip(features, [merged_rings[0], merged_rings[2]]):
+        assert feature['geometry']['type'] == 'MultiPolygon'
+        assert len(feature['properties']['labels']) == RING_LABEL_COUNT * len(merged_polygons)
+        for polygon, coordinates in zip(merged_polygons, feature['geometry']['coordinates']):
+            # GeoJSON is [lon, lat], rounded, with the exterior ring only
+            assert len(coordinates) == 1
+            expected = np.asarray(polygon.exterior.coords)[:, ::-1]
+            np.testing.assert_allclose(coordinates[0], expected, rtol=0,
+                                       atol=0.5 * 10 ** -GEOJSON_PRECISION)
+            assert coordinates[0][0] == coordinates[0][-1]
+
+    assert rings_feature_collection([4500.5], [[shapely.Point(0, 0).buffer(1)]])['features'][0][
+        'properties'] == {'altitude': 4500.5}
+    assert rings_feature_collection(ALTITUDES, [[], [], []]) == {'type': 'FeatureCollection',
+                                                                 'features': []}
+
+
+def test_topology_decodes_to_the_feature_collection(merged_rings):
+    collection = rings_feature_collection(ALTITUDES, merged_rings, ring_label_locations)
+    topology = json.loads(json.dumps(rings_topology(collection)))
+    geometries = topology['objects']['rings']['geometries']
+    assert [geometry['properties'] for geometry in geometries] \
+        == [feature['properties'] for feature in collection['features']]
+
+    # Each coordinate comes back within half a quantization step
+    points = np.concatenate([ring for feature in collection['features']
+                             for polygon in feature['geometry']['coordinates'] for ring in polygon])
+    tolerance = (points.max(axis=0) - points.min(axis=0)) / (TOPOJSON_QUANTIZATION - 1) / 2
+    decoded = decode_topology(topology)
+    for feature, polygons in zip(collection['features'], decoded):
+        for rings, decoded_rings in zip(feature['geometry']['coordinates'], polygons):
+            for ring, decoded_ring in zip(rings, decoded_rings):
+                assert np.all(np.abs(decoded_ring - np.asarray(ring)) <= tolerance + 1e-12)
+
+    empty = rings_topology({'type': 'FeatureCollection', 'features': []})
+    assert empty['arcs'] == [] and empty['objects']['rings']['geometries'] == []
+
+
+def embedded_payload(html):
+    match = re.search(r'var \w+_data = (\{.*?\});\n', html)
+    assert match
+    return json.loads(match.group(1))
+
+
+@pytest.mark.parametrize('ring_output', ['geojson', 'topojson', 'folium'])
+def test_map_embeds_the_rings_as_one_payload(ring_output):
+    center_locations = [(42.5, -71.5, 10, 270, 1400, '3B3', 'Airport', ''),
+                        (42.6, -71.8, 10, 270, 1500, 'FIT', 'Airport', '')]
+    html = plot_map(42.55, -71.65, 36, 0.3, 50, center_locations, [3000, 5000], 1000, 'ASK 21',
+                    10, 270, ring_output=ring_output)
+    if ring_output == 'folium':
+        assert '_data = ' not in html
+        # One polygon and RING_LABEL_COUNT labels per merged ring of each band
+        assert html.count('L.polygon') >= 2
+        assert html.count('3000 ft') >= RING_LABEL_COUNT
+        assert html.count('5000 ft') >= RING_LABEL_COUNT
+        return
+
+    payload = embedded_payload(html)
+    assert (TOPOJSON_CLIENT_JS in html) == (ring_output == 'topojson')
+    if ring_output == 'topojson':
+        assert payload['type'] == 'Topology'
+        altitudes = [geometry['properties']['altitude']
+                     for geometry in payload['objects']['rings']['geometries']]
+    else:
+        assert payload['type'] == 'FeatureCollection'
+        altitudes = [feature['properties']['altitude'] for feature in payload['features']]
+    assert altitudes == [3000, 5000]
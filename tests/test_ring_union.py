@@ -0,0 +1,87 @@
+import os
+
+import numpy as np
+import pytest
+import shapely
+
+from ring_union import union_bands
+from rings import compute_rings, ring_headings
+from terrain import TerrainModel
+
+# Largest area, in square degrees, by which a merged band may differ from unary_union
+TOLERANCE_AREA = 1e-9
+
+
+def assert_same_area(merged_polygons, rings):
+    expected = shapely.unary_union(rings)
+    merged = shapely.unary_union(merged_polygons) if merged_polygons else shapely.Polygon()
+    assert merged.symmetric_difference(expected).area < TOLERANCE_AREA
+    assert abs(sum(polygon.area for polygon in merged_polygons) - expected.area) < TOLERANCE_AREA
+
+
+def band_rings(ring_vertices, ring_reachable, band):
+    return list(shapely.polygons(ring_vertices[band][ring_reachable[band]]))
+
+
+def ridge_terrain(directory):
+    elevations = np.zeros((121, 121), dtype=np.int16)
+    # A 3000 m ridge along 42.7N and another along 71.6W
+    elevations[35:38] = 3000
+    elevations[:, 47:50] = 3000
+    np.save(os.path.join(str(directory), 'N42W072.npy'), elevations)
+    return TerrainModel(str(directory), clearance=500, step=0.25)
+
+
+@pytest.mark.parametrize('with_terrain', [False, True])
+@pytest.mark.parametrize('nested', [False, True])
+def test_merged_bands_equal_the_union_of_their_rings(tmp_path, nested, with_terrain):
+    rng = np.random.default_rng(3)
+    lats, lons = rng.uniform(42.2, 42.8, 30), rng.uniform(-71.9, -71.1, 30)
+    arrival_altitudes = rng.uniform(1000, 2000, 30)
+    altitudes = np.arange(2000.0, 9000.0, 1000.0)
+    terrain = ridge_terrain(tmp_path) if with_terrain else None
+    ring_vertices, ring_reachable = compute_rings(
+        altitudes, lats, lons, arrival_altitudes, np.full(30, 10.0), np.full(30, 270.0), 35, 0.3,
+        50, ring_headings(), terrain=terrain)
+    if with_terrain:
+        # Some rings stop growing where the ridges cut them
+        assert np.any(np.all(ring_vertices[-1] == ring_vertices[-2], axis=(1, 2))
+                      & ring_reachable[-2])
+
+    merged = union_bands(ring_vertices, ring_reachable, nested=nested)
+    assert len(merged) == altitudes.size
+    for band, merged_polygons in enumerate(merged):
+        assert_same_area(merged_polygons, band_rings(ring_vertices, ring_reachable, band))
+        # Merged polygons of one band never overlap each other
+        assert shapely.unary_union(merged_polygons).area == pytest.approx(
+            sum(polygon.area for polygon in merged_polygons), abs=TOLERANCE_AREA)
+
+
+def square(x, y, size):
+    return [(x, y), (x + size, y), (x + size, y + size), (x, y + size)]
+
+
+def test_unchanged_clusters_are_reused_in_the_next_band(monkeypatch):
+    # Two overlapping rings that stop growing, and a third ring apart that keeps growing and
+    # joins them in the last band
+    ring_vertices = np.array([
+        [square(0, 0, 2), square(1, 1, 2), square(10, 0, 1)],
+        [square(0, 0, 2), square(1, 1, 2), square(9, 0, 2)],
+        [square(0, 0, 2), square(1, 1, 2), square(2, 0, 9)],
+    ], dtype=np.float64)
+    ring_reachable = np.ones((3, 3), dtype=bool)
+    unions = []
+
+    def union_all(geometries, *args, **kwargs):
+        unions.append(len(geometries))
+        return shapely_union_all(geometries, *args, **kwargs)
+    shapely_union_all = shapely.union_all
+    monkeypatch.setattr(shapely, 'union_all', union_all)
+
+    merged = union_bands(ring_vertices, ring_reachable, nested=True)
+    # The first band unions the two rings; the second reuses their merged polygon as it is; the
+    # third unions it with the grown ring
+    assert unions == [2, 2]
+    assert merged[1][0] is merged[0][0]
+    for band, merged_polygons in enumerate(merged):
+        assert_same_area(merged_polygons, band_rings(ring_vertices, ring_reachable, band))
@@ -0,0 +1,185 @@
+import numpy as np
+import pytest
+
+from rings import glide_ranges, destination_points, compute_rings, great_circle_distances, \
+    ring_headings, IncrementalRingEngine, adaptive_headings, resolve_headings, range_per_foot, \
+    ADAPTIVE, ADAPTIVE_BASE_STEP, ADAPTIVE_MIN_STEP, ADAPTIVE_TOLERANCE
+from utils import glide_range, haversine
+
+# Largest difference allowed from the scalar reference, in nautical miles
+TOLERANCE_NM = 1e-9
+
+
+def scalar_ranges(altitudes, arrival_altitudes, glide_ratio, safety_margin, Vg, wind_speeds,
+                  wind_directions, headings):
+    return np.array([[[glide_range(altitude, arrival, glide_ratio, safety_margin, Vg, speed,
+                                   direction, heading) for heading in headings]
+                      for arrival, speed, direction in zip(arrival_altitudes, wind_speeds,
+                                                           wind_directions)]
+                     for altitude in altitudes])
+
+
+def assert_same_points(lats, lons, expected_lats, expected_lons):
+    # Compared by distance, so that longitudes a turn apart and points at a pole agree
+    distances = great_circle_distances(lats, lons, expected_lats, expected_lons)
+    assert np.nanmax(distances) < TOLERANCE_NM
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_glide_ranges_match_the_scalar_reference(seed):
+    rng = np.random.default_rng(seed)
+    altitudes = rng.uniform(0, 15000, 4)
+    arrival_altitudes = rng.uniform(0, 5000, 6)
+    wind_speeds = rng.uniform(0, 60, 6)
+    wind_directions = rng.uniform(0, 360, 6)
+    headings = rng.uniform(0, 360, 12)
+    glide_ratio, safety_margin, Vg = rng.uniform(20, 60), rng.uniform(0, 0.99), rng.uniform(40, 70)
+
+    ranges = glide_ranges(altitudes, arrival_altitudes, glide_ratio, safety_margin, Vg,
+                          wind_speeds, wind_directions, headings)
+    expected = scalar_ranges(altitudes, arrival_altitudes, glide_ratio, safety_margin, Vg,
+                             wind_speeds, wind_directions, headings)
+    np.testing.assert_allclose(ranges, expected, rtol=0, atol=TOLERANCE_NM)
+
+
+def test_glide_ranges_in_calm_air_and_in_a_wind_as_fast_as_the_glider():
+    headings = np.arange(0, 360, 15.0)
+    # Calm air, a safety margin above 100% (clamped) and a wind equal to the best glide speed
+    for wind_speed, safety_margin in [(0.0, 0.5), (0.0, 1.5), (55.0, 0.2)]:
+        ranges = glide_ranges([6000], [1000], 35, safety_margin, 55, [wind_speed], [270],
+                              headings)
+        expected = scalar_ranges([6000], [1000], 35, safety_margin, 55, [wind_speed], [270],
+                                 headings)
+        np.testing.assert_allclose(ranges, expected, rtol=0, atol=TOLERANCE_NM)
+    # Downwind of the location the glider flies straight into a wind as fast as itself and
+    # reaches nothing
+    assert abs(glide_ranges([6000], [1000], 35, 0.2, 55, [55.0], [270], [90])[0, 0, 0]) \
+        < TOLERANCE_NM
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_destination_points_match_the_scalar_reference(seed):
+    rng = np.random.default_rng(seed)
+    lats = rng.uniform(-89, 89, 8)
+    lons = rng.uniform(-180, 180, 8)
+    headings = rng.uniform(0, 360, 10)
+    distances = rng.uniform(0, 200, (3, 8, 10))
+
+    ring_lats, ring_lons = destination_points(lats, lons, distances, headings)
+    for index in np.ndindex(distances.shape):
+        _, location, heading = index
+        expected = haversine(lons[location], lats[location], distances[index], headings[heading])
+        assert_same_points(ring_lats[index], ring_lons[index], *expected)
+
+
+@pytest.mark.parametrize('lat, lon', [(90.0, 0.0), (-90.0, 45.0), (89.9999, 10.0),
+                                      (42.5, 179.9), (-33.0, -179.95), (0.0, 180.0)])
+def test_destination_points_at_the_poles_and_the_antimeridian(lat, lon):
+    headings = np.arange(0, 360, 30.0)
+    distances = np.full((1, len(headings)), 25.0)
+    ring_lats, ring_lons = destination_points([lat], [lon], distances, headings)
+    for heading, ring_lat, ring_lon in zip(headings, ring_lats[0], ring_lons[0]):
+        expected_lat, expected_lon = haversine(lon, lat, 25.0, heading)
+        assert_same_points(ring_lat, ring_lon, expected_lat, expected_lon)
+        # Every point is still 25 nm from the start
+        assert abs(great_circle_distances(lat, lon, ring_lat, ring_lon) - 25.0) < 1e-6
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_compute_rings_matches_the_scalar_reference(seed):
+    rng = np.random.default_rng(seed)
+    # Locations near a pole and on both sides of the antimeridian among random ones
+    lats = np.concatenate(([89.5, -89.5, 10.0, -10.0], rng.uniform(-80, 80, 4)))
+    lons = np.concatenate(([0.0, 120.0, 179.99, -179.99], rng.uniform(-180, 180, 4)))
+    arrival_altitudes = rng.uniform(0, 4000, 8)
+    wind_speeds = np.concatenate(([0.0, 50.0], rng.uniform(0, 40, 6)))
+    wind_directions = rng.uniform(0, 360, 8)
+    altitudes = np.array([1000.0, 5000.0, 9000.0])
+    headings = ring_headings()
+    glide_ratio, safety_margin, Vg = 38.0, 0.3, 50.0
+
+    vertices, reachable = compute_rings(altitudes, lats, lons, arrival_altitudes, wind_speeds,
+                                        wind_directions, glide_ratio, safety_margin, Vg,
+                                        headings)
+    assert vertices.shape == (3, 8, len(headings), 2)
+    np.testing.assert_array_equal(reachable, altitudes[:, None] >= arrival_altitudes[None, :])
+    for band, location, vertex in np.ndindex(vertices.shape[:3]):
+        distance = glide_range(altitudes[band], arrival_altitudes[location], glide_ratio,
+                               safety_margin, Vg, wind_speeds[location],
+                               wind_directions[location], headings[vertex])
+        expected = haversine(lons[location], lats[location], distance, headings[vertex])
+        assert_same_points(*vertices[band, location, vertex], *expected)
+
+
+def engine_bytes(engine):
+    return sum(profile['unit_ranges'].nbytes
+               + sum(band.nbytes for band in profile['bands'].values())
+               + (0 if profile['terrain_limits'] is None else profile['terrain_limits'].nbytes)
+               for profile in engine._profiles.values())
+
+
+def test_incremental_engine_matches_compute_rings_within_its_byte_budget():
+    rng = np.random.default_rng(7)
+    headings = ring_headings()
+    # One location's profile with four bands takes (1 + 4 * 2) * 36 * 8 bytes
+    engine = IncrementalRingEngine(max_bytes=10 * 9 * headings.size * 8, max_bands=4)
+    for _ in range(6):
+        lats = rng.uniform(40, 45, 5)
+        # A location twice in one request shares its profile
+        lats[1] = lats[0]
+        lons = np.concatenate(([-72.0, -72.0], rng.uniform(-75, -70, 3)))
+        arrival_altitudes = np.full(5, 1500.0)
+        altitudes = rng.choice(np.arange(2000.0, 12000.0, 1000.0), 3, replace=False)
+        vertices, reachable = engine.compute_rings(altitudes, lats, lons, arrival_altitudes,
+                                                   10.0, 270.0, 36, 0.5, 50, headings)
+        expected, expected_reachable = compute_rings(altitudes, lats, lons, arrival_altitudes,
+                                                     np.full(5, 10.0), np.full(5, 270.0), 36,
+                                                     0.5, 50, headings)
+        np.testing.assert_allclose(vertices, expected, rtol=0, atol=1e-12)
+        np.testing.assert_array_equal(reachable, expected_reachable)
+        assert engine._bytes == engine_bytes(engine) <= engine.max_bytes
+        assert all(len(profile['bands']) <= 4 for profile in engine._profiles.values())
+
+
+def test_adaptive_headings_stay_coarse_in_calm_air():
+    np.testing.assert_array_equal(adaptive_headings(36, 0.3, 50, [0.0], [0.0]),
+                                  ring_headings(ADAPTIVE_BASE_STEP))
+
+
+@pytest.mark.parametrize('wind_speed, wind_direction', [(10.0, 270.0), (35.0, 45.0), (49.0, 180.0)])
+def test_adaptive_headings_keep_neighbouring_ranges_within_the_tolerance(wind_speed,
+                                                                         wind_direction):
+    headings = adaptive_headings(36, 0.3, 50, [wind_speed], [wind_direction])
+    assert np.all(np.diff(headings) > 0) and headings[0] == 0 and headings[-1] < 360
+    assert set(ring_headings(ADAPTIVE_BASE_STEP).tolist()) <= set(headings.tolist())
+    assert headings.size > 360 // ADAPTIVE_BASE_STEP
+
+    # Around the ring, every two neighbouring vertices have ranges within the tolerance of each
+    # other unless they are already at the finest step
+    profile = range_per_foot(36, 0.3, 50, [wind_speed], [wind_direction], headings)[0]
+    following = np.roll(profile, -1)
+    gaps = np.diff(np.append(headings, 360.0))
+    changing = np.abs(following - profile) > ADAPTIVE_TOLERANCE * np.maximum(profile, following)
+    assert np.all(gaps[changing] <= ADAPTIVE_MIN_STEP)
+    # Dense only where the range changes fast: some gaps are left at the base step
+    assert np.any(gaps == ADAPTIVE_BASE_STEP)
+
+
+def test_adaptive_headings_are_shared_by_locations_with_the_same_wind():
+    one = adaptive_headings(36, 0.3, 50, [20.0], [90.0])
+    other = adaptive_headings(36, 0.3, 50, [30.0], [300.0])
+    np.testing.assert_array_equal(adaptive_headings(36, 0.3, 50, [20.0] * 5, [90.0] * 5), one)
+    both = adaptive_headings(36, 0.3, 50, [20.0, 30.0, 20.0], [90.0, 300.0, 90.0])
+    np.testing.assert_array_equal(both, np.union1d(one, other))
+
+
+def test_resolve_headings():
+    np.testing.assert_array_equal(resolve_headings(ADAPTIVE, 36, 0.3, 50, [25.0], [200.0]),
+                                  adaptive_headings(36, 0.3, 50, [25.0], [200.0]))
+    np.testing.assert_array_equal(resolve_headings('15', 36, 0.3, 50, [25.0], [200.0]),
+                                  ring_headings(15))
+    np.testing.assert_array_equal(resolve_headings(2.5, 36, 0.3, 50, [0.0], [0.0]),
+                                  ring_headings(2.5))
+    for ring_resolution in (0, -5, 91, 'fine'):
+        with pytest.raises(ValueError):
+            resolve_headings(ring_resolution, 36, 0.3, 50, [0.0], [0.0])
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+import shapely
+
+from plans import PlanStore
+from scenarios import Scenario, compute_scenario_rings
+from utils import compute_merged_rings, ring_locations_of
+from tests.test_plans import make_plan
+
+SHARED = {'selectedRows': ['3B3'], 'gliderSelection': 'other', 'glideRatio': 34, 'vg': 50,
+          'safetyMargin': 50, 'windSpeed': 10, 'windDirection': 270, 'arrivalAltitude': 1500,
+          'ringSpacingSelection': 'thousands', 'ringStartAlt': 3000, 'ringEndAlt': 5000}
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    import app
+    monkeypatch.setattr(app, 'plan_store', PlanStore(str(tmp_path)))
+    return app.app.test_client()
+
+
+def assert_same_rings(merged_rings, expected_rings):
+    assert len(merged_rings) == len(expected_rings)
+    for merged, expected in zip(merged_rings, expected_rings):
+        difference = shapely.unary_union(merged).symmetric_difference(
+            shapely.unary_union(expected))
+        assert difference.area < 1e-12
+
+
+def test_scenarios_computed_together_match_separate_plans():
+    import app
+    plan = make_plan(selected_codes=('3B3', '1B6'), ring_end_alt=6000)
+    center_locations = plan.center_locations(app.get_repository())
+    scenarios = [Scenario('calm', 34.0, 50.0, 0.5, 0.0, 0.0),
+                 Scenario('west wind', 40.0, 55.0, 0.3, 15.0, 270.0),
+                 Scenario('north wind', 28.0, 45.0, 0.2, 25.0, 10.0)]
+    merged = compute_scenario_rings(ring_locations_of(center_locations),
+                                    plan.polygon_altitudes(), scenarios, terrain=None)
+    for scenario, merged_rings in zip(scenarios, merged):
+        expected = compute_merged_rings(
+            ring_locations_of(scenario.center_locations(center_locations)),
+            plan.polygon_altitudes(), scenario.glide_ratio, scenario.safety_margin, scenario.vg,
+            terrain=None)
+        assert_same_rings(merged_rings, expected)
+
+
+def test_scenario_names_default_to_the_glider_and_wind():
+    assert Scenario.from_plan(make_plan()).name == 'L/D 34 at 50 kt, wind 270° at 10 kt'
+    assert Scenario.from_plan(make_plan(), 'Mine').name == 'Mine'
+
+
+def test_batch_scenarios_take_the_shared_fields_they_leave_out(client):
+    response = client.post('/api/rings/batch', json=dict(SHARED, scenarios=[
+        {}, {'name': 'Strong wind', 'windSpeed': 25, 'windDirection': 90},
+        {'glideRatio': 40, 'vg': 55, 'safetyMargin': 20}]))
+    assert response.status_code == 200
+    first, second, third = response.get_json()['scenarios']
+    assert (first['glide_ratio'], first['wind_speed'], first['wind_direction']) == (34, 10, 270)
+    assert first['name'] == 'L/D 34 at 50 kt, wind 270° at 10 kt'
+    assert (second['name'], second['wind_speed'], second['wind_direction']) \
+        == ('Strong wind', 25, 90)
+    assert (third['glide_ratio'], third['vg'], third['safety_margin'], third['wind_speed']) \
+        == (40, 55, 0.2, 10)
+    assert len({scenario['plan_id'] for scenario in (first, second, third)}) == 3
+
+    # Each scenario is stored as the plan it stands for, and draws the same rings
+    single = client.post('/api/rings', json=dict(SHARED, windSpeed=25, windDirection=90))
+    assert single.get_json()['metadata']['plan_id'] == second['plan_id']
+    assert single.get_json()['rings'] == second['rings']
+    metadata = response.get_json()['metadata']
+    assert metadata['altitudes'] == [3000, 4000, 5000]
+
+
+def test_batch_scenarios_are_capped(client, monkeypatch):
+    import app
+    monkeypatch.setattr(app, 'BATCH_MAX_SCENARIOS', 2)
+    response = client.post('/api/rings/batch', json=dict(SHARED, scenarios=[{}, {}, {}]))
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'At most 2 scenarios can be computed at once'
+    assert client.post('/api/rings/batch',
+                       json=dict(SHARED, scenarios=[{}, {'windSpeed': 0}])).status_code == 200
+
+
+@pytest.mark.parametrize('body, message', [
+    (dict(SHARED), 'Expected a JSON object with a non-empty scenarios list'),
+    (dict(SHARED, scenarios=[]), 'Expected a JSON object with a non-empty scenarios list'),
+    (dict(SHARED, scenarios={'windSpeed': 5}),
+     'Expected a JSON object with a non-empty scenarios list'),
+    ([SHARED], 'Expected a JSON object with a non-empty scenarios list'),
+    (dict(SHARED, scenarios=[{}, 'calm']), 'Scenario 2 must be a JSON object'),
+    (dict(SHARED, scenarios=[{'name': 7}]), 'The name of scenario 1 must be a string'),
+    (dict(SHARED, scenarios=[{'safetyMargin': 150}]), 'safety margin'),
+    (dict(SHARED, scenarios=[{}, {'glideRatio': 'steep'}]), 'steep'),
+    (dict(SHARED, scenarios=[{'gliderSelection': 'no-such-glider'}]), 'Unknown glider'),
+    (dict(SHARED, selectedRows=['NOWHERE'], scenarios=[{}]),
+     'None of the selected locations are in the turnpoint database'),
+])
+def test_invalid_batches_are_rejected(client, body, message):
+    response = client.post('/api/rings/batch', json=body)
+    assert response.status_code == 400
+    assert message in response.get_json()['error']
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from rings import great_circle_distances
+from spatial_index import SpatialIndex
+
+
+@pytest.fixture(scope='module')
+def points():
+    rng = np.random.default_rng(11)
+    # Clusters near the antimeridian and a pole among points spread over the globe
+    lats = np.concatenate((rng.uniform(-90, 90, 1500), rng.uniform(-5, 5, 200),
+                           rng.uniform(85, 90, 100)))
+    lons = np.concatenate((rng.uniform(-180, 180, 1500), rng.uniform(175, 180, 100),
+                           rng.uniform(-180, -175, 100), rng.uniform(-180, 180, 100)))
+    return lats, lons, SpatialIndex(lats, lons)
+
+
+@pytest.mark.parametrize('box', [(-10, -20, 10, 20), (40, -75, 45, -70), (-4, 178, 4, -178),
+                                 (80, -180, 90, 180), (0, 0, 0, 0), (-90, 170, 90, -170)])
+def test_bbox_queries_match_a_brute_force_filter(points, box):
+    lats, lons, index = points
+    south, west, north, east = box
+    in_lon = (lons >= west) & (lons <= east) if west <= east else (lons >= west) | (lons <= east)
+    expected = np.flatnonzero((lats >= south) & (lats <= north) & in_lon)
+    np.testing.assert_array_equal(index.within_bbox(*box), expected)
+
+
+@pytest.mark.parametrize('lat, lon, radius_nm', [(0, 0, 600), (43, -72, 300), (0, 179.5, 400),
+                                                 (88, 30, 500), (-30, 100, 6000)])
+def test_radius_queries_match_a_brute_force_filter(points, lat, lon, radius_nm):
+    lats, lons, index = points
+    distances = great_circle_distances(lat, lon, lats, lons)
+    expected = np.flatnonzero(distances <= radius_nm)
+    indices, found = index.within_radius(lat, lon, radius_nm)
+    assert sorted(indices.tolist()) == expected.tolist()
+    np.testing.assert_allclose(found, distances[indices], rtol=0, atol=1e-9)
+    assert np.all(np.diff(found) >= 0)
+
+
+@pytest.mark.parametrize('lat, lon', [(0, 0), (43, -72), (-3, -179.9), (89.5, 0), (-89, 10)])
+def test_nearest_matches_a_brute_force_sort(points, lat, lon):
+    lats, lons, index = points
+    distances = great_circle_distances(lat, lon, lats, lons)
+    for count in (1, 5, 40):
+        indices, found = index.nearest(lat, lon, count)
+        np.testing.assert_allclose(found, np.sort(distances)[:count], rtol=0, atol=1e-9)
+        np.testing.assert_allclose(distances[indices], found, rtol=0, atol=1e-9)
+    assert len(index.nearest(lat, lon, 10 ** 6)[0]) == len(lats)
+    assert index.nearest(lat, lon, 0)[0].size == 0
+
+
+def turnpoint_query(query):
+    import app
+    return app.app.test_client().get('/api/turnpoints' + query)
+
+
+def test_turnpoint_pages_are_filtered_sorted_and_paged():
+    page = turnpoint_query('?draw=3&search=sterling&start=0&length=2'
+                           '&order[0][column]=2&order[0][dir]=desc').get_json()
+    assert page['draw'] == 3
+    assert page['recordsFiltered'] >= 1 and len(page['data']) <= 2
+    everything = turnpoint_query('?search=sterling&length=-1&order[0][column]=2'
+                                 '&order[0][dir]=desc').get_json()
+    assert everything['data'][:2] == page['data']
+    assert len(everything['data']) == everything['recordsFiltered']
+
+    near = turnpoint_query('?near=42.43,-71.79&radius=5').get_json()
+    assert '3B3' in [row[0] for row in near['data']]
+    assert turnpoint_query('?bbox=0,0,1,1').get_json()['recordsFiltered'] == 0
+
+
+@pytest.mark.parametrize('query, message', [
+    ('?bbox=1,2,3', 'bbox needs 4 comma-separated numbers'),
+    ('?bbox=a,b,c,d', 'could not convert'),
+    ('?bbox=45,-72,42,-70', 'bbox must be south,west,north,east'),
+    ('?bbox=nan,-72,43,-70', 'bbox must be south,west,north,east'),
+    ('?bbox=42,-190,43,-70', 'bbox must be south,west,north,east'),
+    ('?near=42.4,-71.8', 'radius is required'),
+    ('?near=42.4&radius=5', 'near needs 2 comma-separated numbers'),
+    ('?near=95,-71.8&radius=5', 'near must be lat,lon'),
+    ('?near=42.4,-71.8&radius=-1', 'radius must be a distance'),
+    ('?near=42.4,-71.8&radius=inf', 'radius must be a distance'),
+    ('?order[0][column]=7', 'unknown column 7'),
+    ('?order[0][column]=-1', 'unknown column -1'),
+    ('?start=x', 'invalid literal'),
+    ('?draw=1.5', 'invalid literal'),
+])
+def test_invalid_turnpoint_queries_are_rejected(query, message):
+    response = turnpoint_query(query)
+    assert response.status_code == 400
+    error = response.get_json()['error']
+    assert error.startswith('Invalid turnpoint query: ') and message in error
@@ -0,0 +1,84 @@
+import io
+
+import pytest
+
+from task_analysis import analyze_tasks
+from turnpoints import TurnpointRepository, read_cup, parse_cup_tasks
+
+CUP = '''name,code,country,lat,lon,elev,style,rwdir,rwlen,rwwidth,freq,desc
+"Home","HOME",US,4200.000N,07200.000W,500ft,5,90,3000ft,75ft,,"Home field"
+"Tower","TWR",US,4230.000N,07200.000W,1000ft,1,,,,,""
+"Far Peak","FAR",US,4500.000N,07200.000W,3000ft,7,,,,,""
+-----Related Tasks-----
+"Tower and back","???","Home","Tower","Home","???"
+Options,NoStart=12:00:00,Short=false
+ObsZone=0,Style=2,R1=3000m,A1=45,Line=1
+ObsZone=2,Style=3,R1=500m,A1=180
+"Inline","Home","Nowhere","Home"
+Point=1,"Lake","LAKE",US,4215.000N,07130.000W,300ft,1,,,,,""
+"Far and back","Home","Far Peak","Home"
+'''
+
+
+def parse(text=CUP):
+    file = io.StringIO(text)
+    waypoints, task_rows = read_cup(file)
+    return waypoints, parse_cup_tasks(task_rows, waypoints, region=3)
+
+
+def test_read_cup_splits_the_waypoints_from_the_tasks():
+    waypoints, tasks = parse()
+    assert [row['code'] for row in waypoints] == ['HOME', 'TWR', 'FAR']
+    assert [task['name'] for task in tasks] == ['Tower and back', 'Inline', 'Far and back']
+    assert all(task['region'] == 3 for task in tasks)
+    # Without a task section there are no tasks
+    assert parse(CUP.split('-----Related Tasks-----')[0])[1] == []
+
+
+def test_task_options_and_observation_zones_belong_to_the_task_above():
+    task = parse()[1][0]
+    assert [point['code'] for point in task['points']] == ['HOME', 'TWR', 'HOME']
+    assert task['missing'] == ['???', '???']
+    assert task['options'] == {'NoStart': '12:00:00', 'Short': 'false'}
+    assert task['observation_zones'] == [
+        {'ObsZone': '0', 'Style': '2', 'R1': '3000m', 'A1': '45', 'Line': '1'},
+        {'ObsZone': '2', 'Style': '3', 'R1': '500m', 'A1': '180'}]
+    assert task['points'][1] == {'name': 'Tower', 'code': 'TWR', 'lat': 42.5, 'lon': -72.0,
+                                 'elev': 1000.0}
+    assert parse()[1][1]['options'] == {}
+
+
+def test_point_lines_define_task_points_inline():
+    task = parse()[1][1]
+    assert task['missing'] == []
+    assert [point['code'] for point in task['points']] == ['HOME', 'LAKE', 'HOME']
+    assert task['points'][1]['lat'] == pytest.approx(42.25)
+    assert task['points'][1]['lon'] == pytest.approx(-71.5)
+    assert task['points'][1]['elev'] == 300.0
+
+
+def test_legs_out_of_reach_of_a_landing_are_unreachable(tmp_path):
+    path = tmp_path / 'tasks.cup'
+    path.write_text(CUP)
+    turnpoints = TurnpointRepository(str(path))
+    turnpoints.refresh()
+    near, far = analyze_tasks(turnpoints, [turnpoints.tasks[0], turnpoints.tasks[2]], 35, 0.5,
+                              50, 0, 0, 1000, radius_nm=50)
+
+    assert not near['unreachable']
+    assert not any(leg['unreachable'] for leg in near['legs'])
+    assert near['max_altitude_required'] == max(leg['max_altitude_required']
+                                                for leg in near['legs'])
+    assert near['critical_point']['landing'] == 'HOME'
+
+    # Home is the only landable turnpoint; beyond 50 nm of it nothing can be reached
+    assert far['unreachable']
+    assert [leg['unreachable'] for leg in far['legs']] == [True, True]
+    assert far['max_altitude_required'] is None
+    assert all(leg['max_altitude_required'] is None for leg in far['legs'])
+    critical = far['critical_point']
+    assert critical['altitude_required'] is None and critical['landing'] is None
+    # The critical point is where the glider first goes out of reach, just past 50 nm
+    assert 50 <= critical['distance_nm'] <= 51
+    reachable = [point for point in far['profile'] if point['altitude_required'] is not None]
+    assert reachable and all(point['landing'] == 'HOME' for point in reachable)
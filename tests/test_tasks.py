@@ -0,0 +1,85 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+from redis.exceptions import ConnectionError
+
+import tasks
+from plans import PlanStore
+from tests.test_plans import make_plan
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    import app
+    store = PlanStore(str(tmp_path))
+    monkeypatch.setattr(app, 'plan_store', store)
+    monkeypatch.setattr(app, 'MAP_JOBS', True)
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['agreed_to_terms'] = True
+    return client
+
+
+def test_map_job_is_submitted_polled_and_served(client):
+    response = client.post('/index', data={
+        'gliderSelection': 'other', 'glideRatio': '34', 'vg': '50', 'safetyMargin': '50',
+        'windSpeed': '10', 'windDirection': '270', 'arrivalAltitude': '1500',
+        'ringSpacingSelection': 'thousands', 'ringStartAlt': '3000', 'ringEndAlt': '5000',
+        'selectedRows[]': ['3B3']})
+    assert response.status_code == 200
+    page = response.get_data(as_text=True)
+    assert 'mapStatus' in page
+    job_id = page.split('/api/jobs/')[1].split('"')[0]
+
+    response = client.get('/api/jobs/%s' % job_id)
+    assert response.status_code == 200
+    assert response.get_json() == {'job_id': job_id, 'state': 'done'}
+    response = client.get('/jobs/%s/map' % job_id)
+    assert response.status_code == 200
+    assert b'folium' in response.data
+
+
+def test_submitted_job_is_pending_until_it_runs(client):
+    job_id = 'queued-job'
+    tasks.celery.backend.store_result(job_id, None, tasks.JOB_SUBMITTED)
+    assert client.get('/api/jobs/%s' % job_id).get_json()['state'] == 'pending'
+    assert client.get('/jobs/%s/map' % job_id).status_code == 404
+
+
+def test_failed_job_reports_its_error(client):
+    job_id = tasks.submit_map_job(make_plan(selected_codes=('NOWHERE',)))
+    payload = client.get('/api/jobs/%s' % job_id).get_json()
+    assert payload['state'] == 'failed'
+    assert 'None of the selected locations' in payload['error']
+
+
+def test_worker_draws_the_map_without_the_web_plan_store(tmp_path):
+    # A worker on another machine: its own empty plan store, and nothing saved in the web one
+    plan = make_plan()
+    script = ('import json, sys; import tasks; '
+              'result = tasks.render_map(sys.argv[1]); '
+              'print(json.dumps({"plan_id": result["plan_id"], '
+              '"folium": "folium" in result["map_html"]}))')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, '-c', script, plan.to_json()], cwd=root,
+                            env=dict(os.environ, PLAN_STORE_DIR=str(tmp_path / 'worker_plans')),
+                            capture_output=True, text=True, check=True).stdout
+    assert json.loads(output.splitlines()[-1]) == {'plan_id': plan.plan_id, 'folium': True}
+    assert os.listdir(tmp_path / 'worker_plans') == []
+
+
+def test_unknown_job_is_not_found(client):
+    response = client.get('/api/jobs/no-such-job')
+    assert response.status_code == 404
+    assert 'Unknown or expired job' in response.get_json()['error']
+
+
+def test_unreachable_backend_is_unavailable(client, monkeypatch):
+    def unreachable(job_id):
+        raise ConnectionError('Error 111 connecting to localhost:6379. Connection refused.')
+    monkeypatch.setattr(tasks.celery, 'AsyncResult', unreachable)
+    assert client.get('/api/jobs/some-job').status_code == 503
+    assert client.get('/jobs/some-job/map').status_code == 503
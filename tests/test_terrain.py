@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+
+from rings import compute_rings, range_per_foot, ring_headings
+from terrain import TerrainModel, HGT_VOID
+
+LAT, LON = 42.5, -71.5
+HEADINGS = np.array([0.0, 90.0, 180.0, 270.0])
+# Range per foot of a 35:1 glider with a 50% margin in calm air
+UNIT_RANGES = range_per_foot(35, 0.5, 50, [0.0], [0.0], HEADINGS)
+
+
+def write_tile(directory, name, elevations):
+    np.save(os.path.join(str(directory), name + '.npy'), elevations)
+
+
+def flat_tile(elevation=0):
+    return np.full((121, 121), elevation, dtype=np.int16)
+
+
+def test_flat_terrain_leaves_the_rings_unchanged(tmp_path):
+    write_tile(tmp_path, 'N42W072', flat_tile(50))
+    terrain = TerrainModel(str(tmp_path), clearance=500, step=0.25)
+    limits = terrain.ray_limits([LAT], [LON], [1000.0], UNIT_RANGES, HEADINGS, [20.0])
+    assert np.all(np.isinf(limits))
+
+    altitudes = np.array([2000.0, 4000.0])
+    arguments = (altitudes, [LAT], [LON], [1000.0], [0.0], [0.0], 35, 0.5, 50, ring_headings())
+    vertices, reachable = compute_rings(*arguments, terrain=terrain)
+    expected, expected_reachable = compute_rings(*arguments)
+    np.testing.assert_array_equal(vertices, expected)
+    np.testing.assert_array_equal(reachable, expected_reachable)
+
+
+def test_a_ridge_cuts_the_rays_that_cross_it(tmp_path):
+    elevations = flat_tile()
+    # A 3000 m ridge along 42.7N, 12 nm north of the location
+    elevations[35:38] = 3000
+    write_tile(tmp_path, 'N42W072', elevations)
+    terrain = TerrainModel(str(tmp_path), clearance=500, step=0.25)
+    limits = terrain.ray_limits([LAT], [LON], [1000.0], UNIT_RANGES, HEADINGS, [20.0])[0]
+
+    # Points north of 42.683N, 11 nm out, take the ridge's samples
+    assert 10.75 <= limits[0] <= 11.0
+    assert np.all(np.isinf(limits[1:]))
+    # Closer in than the ridge nothing is cut
+    near = terrain.ray_limits([LAT], [LON], [1000.0], UNIT_RANGES, HEADINGS, [10.0])
+    assert np.all(np.isinf(near))
+
+
+def test_missing_tiles_and_void_samples_block_the_rays(tmp_path):
+    elevations = flat_tile()
+    # Void samples along 71.3W, 8.8 nm east of the location
+    elevations[:, 84] = HGT_VOID
+    write_tile(tmp_path, 'N42W072', elevations)
+    terrain = TerrainModel(str(tmp_path), clearance=500, step=0.25)
+
+    assert np.isinf(terrain.elevations([LAT, 43.5], [-71.3, LON])).all()
+    limits = terrain.ray_limits([LAT], [LON], [1000.0], UNIT_RANGES, HEADINGS, [20.0])[0]
+    assert 8.0 <= limits[1] < 9.0
+    assert np.isinf(limits[0]) and np.isinf(limits[2])
+    # The tiles north and south of this one are missing, so the rays stop where it ends, 30 nm out
+    far = terrain.ray_limits([LAT], [LON], [1000.0], UNIT_RANGES, HEADINGS, [40.0])[0]
+    assert 29.0 <= far[0] < 30.5 and 29.0 <= far[2] < 30.5
+
+
+def test_replacing_a_tile_changes_the_cache_key_and_the_elevations(tmp_path):
+    write_tile(tmp_path, 'N42W072', flat_tile(100))
+    terrain = TerrainModel(str(tmp_path))
+    key = terrain.cache_key
+    assert terrain.elevations([LAT], [LON])[0] == 100 * 3.28084
+    assert terrain.cache_key == key
+
+    write_tile(tmp_path, 'N42W072', np.full((241, 241), 200, dtype=np.int16))
+    assert terrain.cache_key != key
+    assert terrain.elevations([LAT], [LON])[0] == 200 * 3.28084
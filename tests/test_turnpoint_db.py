@@ -0,0 +1,91 @@
+import os
+
+import numpy as np
+import pytest
+
+from turnpoint_db import compile_turnpoints, open_turnpoints, STRING_COLUMNS, NUMERIC_COLUMNS, \
+    MAGIC
+from turnpoints import TurnpointRepository, TURNPOINT_FILE, read_cup, parse_latitude, \
+    parse_longitude, parse_elevation
+
+
+@pytest.fixture(scope='module')
+def compiled(tmp_path_factory):
+    repository = TurnpointRepository(TURNPOINT_FILE)
+    repository.refresh()
+    path = str(tmp_path_factory.mktemp('tpdb') / 'turnpoints.tpdb')
+    assert compile_turnpoints(repository, path) == len(repository)
+    return repository, path
+
+
+def test_compiled_columns_match_the_parsed_file(compiled):
+    repository, path = compiled
+    columns = open_turnpoints(path)
+    with open(TURNPOINT_FILE) as file:
+        waypoints, _ = read_cup(file)
+    assert len(columns['codes']) == len(waypoints) > 0
+
+    assert list(columns['codes']) == [row['code'] for row in waypoints]
+    assert list(columns['names']) == [row['name'] for row in waypoints]
+    assert list(columns['descriptions']) == [row.get('desc') or '' for row in waypoints]
+    assert list(columns['style_codes']) == [row['style'] for row in waypoints]
+    np.testing.assert_array_equal(columns['lats'], [parse_latitude(row['lat']) for row in waypoints])
+    np.testing.assert_array_equal(columns['lons'],
+                                  [parse_longitude(row['lon']) for row in waypoints])
+    np.testing.assert_array_equal(columns['elevs'],
+                                  [parse_elevation(row['elev']) for row in waypoints])
+    # The numeric columns are views of the file, not copies
+    assert isinstance(columns['lats'].base, np.memmap)
+
+    for name in STRING_COLUMNS:
+        assert list(columns[name]) == list(getattr(repository, name))
+    for name in NUMERIC_COLUMNS:
+        np.testing.assert_array_equal(columns[name], getattr(repository, name))
+    assert columns['region_names'] == repository.region_names
+    assert columns['tasks'] == repository.tasks
+
+
+def test_compiled_code_index_matches_the_parsed_one(compiled):
+    repository, path = compiled
+    code_index = open_turnpoints(path)['code_index']
+    assert len(code_index) == len(repository.code_index)
+    for code, row in repository.code_index.items():
+        assert code_index[code] == row
+    assert '3B3' in code_index
+    assert code_index.get('NOWHERE') is None
+    assert code_index.get('3B3\0') is None
+    with pytest.raises(KeyError):
+        code_index['NOWHERE']
+
+
+def test_repository_maps_a_compiled_database(compiled):
+    repository, path = compiled
+    mapped = TurnpointRepository(path)
+    assert mapped.refresh()
+    assert [mapped.record(i) for i in range(len(mapped))] \
+        == [repository.record(i) for i in range(len(repository))]
+
+
+def test_truncated_and_corrupt_databases_are_rejected(compiled, tmp_path):
+    _, path = compiled
+    with open(path, 'rb') as file:
+        data = file.read()
+    header_end = len(MAGIC) + 8 + int.from_bytes(data[len(MAGIC):len(MAGIC) + 8], 'little')
+
+    cases = {
+        'truncated': (data[:len(data) // 2], 'truncated'),
+        'header_cut': (data[:header_end - 10], 'corrupt header'),
+        'not_json': (data[:len(MAGIC) + 8] + b'{' * (header_end - len(MAGIC) - 8)
+                     + data[header_end:], 'corrupt header'),
+        'wrong_magic': (b'NOTATPDB' + data[len(MAGIC):], 'not a compiled turnpoint database'),
+        'empty': (b'', 'not a compiled turnpoint database'),
+    }
+    for name, (contents, message) in cases.items():
+        broken = str(tmp_path / (name + '.tpdb'))
+        with open(broken, 'wb') as file:
+            file.write(contents)
+        with pytest.raises(ValueError, match=message):
+            open_turnpoints(broken)
+        with pytest.raises(ValueError):
+            TurnpointRepository(broken).refresh()
+    assert os.path.getsize(path) == len(data)
@@ -0,0 +1,111 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from benchmarks.bench_pipeline import write_synthetic_cup
+from turnpoints import TurnpointRepository, TURNPOINT_FILE, get_repository
+
+
+@pytest.fixture(scope='module')
+def sterling():
+    repository = TurnpointRepository(TURNPOINT_FILE)
+    repository.refresh()
+    return repository
+
+
+def test_lookup_by_code(sterling):
+    assert '3B3' in sterling and 'NOWHERE' not in sterling
+    i = sterling.code_index['3B3']
+    record = sterling.record(i)
+    assert record['code'] == '3B3'
+    assert record['region'] == 'Sterling_MA_2024_04'
+    assert (record['lat'], record['lon']) == (float(sterling.lats[i]), float(sterling.lons[i]))
+    assert sterling.table_row(i)[:2] == ['3B3', record['name']]
+    np.testing.assert_array_equal(sterling.indices(['NOWHERE', '3B3', '3B3']), [i])
+
+
+def test_search_matches_code_name_and_description_in_any_case(sterling):
+    name = sterling.names[sterling.code_index['3B3']]
+    expected = [i for i in range(len(sterling))
+                if 'sterling' in '\n'.join((sterling.codes[i], sterling.names[i],
+                                            sterling.descriptions[i])).lower()]
+    assert sterling.code_index['3B3'] in expected
+    np.testing.assert_array_equal(sterling.select(search='STERling'), expected)
+    assert sterling.code_index['3B3'] in sterling.select(search=name.lower())
+    assert sterling.select(search='no such turnpoint').size == 0
+    # Filters combine
+    assert sterling.select(region='Sterling_MA_2024_04', search='sterling').tolist() == expected
+    assert sterling.select(region='Elsewhere', search='sterling').size == 0
+
+
+def test_sort_orders_the_selection(sterling):
+    indices = sterling.select(search='sterling')
+    by_elev = sterling.sort(indices, 'elev')
+    assert sorted(by_elev.tolist()) == sorted(indices.tolist())
+    assert np.all(np.diff(sterling.elevs[by_elev]) >= 0)
+    assert sterling.sort(indices, 'elev', descending=True).tolist() == by_elev[::-1].tolist()
+
+
+def test_refresh_reloads_changed_files_only(tmp_path):
+    path = tmp_path / 'region.cup'
+    write_synthetic_cup(str(path), 20)
+    repository = TurnpointRepository(str(path))
+    assert repository.refresh()
+    assert not repository.refresh()
+    snapshot = repository.snapshot()
+    version = repository.version
+
+    write_synthetic_cup(str(path), 30, seed=1)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert repository.refresh()
+    assert len(repository) == 30 and repository.version != version
+    # A snapshot keeps the columns it was taken with
+    assert len(snapshot) == 20 and snapshot.version == version
+    assert len(snapshot.lats) == len(snapshot.names) == 20
+
+
+def test_columns_are_immutable(sterling):
+    columns = sterling.columns
+    with pytest.raises(AttributeError):
+        columns.codes = ()
+    with pytest.raises(ValueError):
+        columns.lats[0] = 0.0
+    with pytest.raises(TypeError):
+        columns.code_index['3B3'] = 0
+
+
+def test_readers_never_see_columns_of_two_versions(tmp_path):
+    small, large = tmp_path / 'small.cup', tmp_path / 'large.cup'
+    write_synthetic_cup(str(small), 10)
+    write_synthetic_cup(str(large), 200, seed=1)
+    repository = TurnpointRepository(str(small))
+    repository.refresh()
+    done = threading.Event()
+
+    def reload():
+        for _ in range(50):
+            for path in (large, small):
+                repository._load_columns([], [])
+                repository.path = str(path)
+                repository.refresh()
+        done.set()
+
+    thread = threading.Thread(target=reload)
+    thread.start()
+    torn = 0
+    while not done.is_set():
+        columns = repository.columns
+        lengths = {len(columns.codes), len(columns.names), len(columns.lats), len(columns.lons),
+                   len(columns.elevs), len(columns.region_ids)}
+        torn += len(lengths) != 1 or len(columns.landable) != len(columns.codes)
+    thread.join()
+    assert torn == 0
+
+
+def test_get_repository_returns_a_snapshot():
+    first = get_repository()
+    assert first is not get_repository()
+    assert first.columns is get_repository().columns
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from rings import glide_ranges, wind_field_ranges, ring_headings
+from wind_field import WindField, wind_components
+
+LATS = np.array([40.0, 42.0, 45.0])
+LONS = np.array([-75.0, -72.0, -70.0, -68.0])
+ALTITUDES = np.array([0.0, 6000.0, 15000.0])
+
+
+def uniform_field(wind_speed, wind_direction):
+    u, v = wind_components(wind_speed, wind_direction)
+    shape = (ALTITUDES.size, LATS.size, LONS.size)
+    return WindField(LATS, LONS, ALTITUDES, np.full(shape, u), np.full(shape, v))
+
+
+@pytest.mark.parametrize('wind_speed, wind_direction', [(0.0, 0.0), (15.0, 250.0), (30.0, 45.0)])
+def test_a_uniform_wind_field_gives_the_ranges_of_its_wind(wind_speed, wind_direction):
+    altitudes = np.array([2000.0, 5000.0, 9000.0])
+    lats, lons = np.array([42.5, 43.0]), np.array([-72.0, -71.2])
+    arrival_altitudes = np.array([1000.0, 1800.0])
+    headings = ring_headings()
+
+    ranges = wind_field_ranges(altitudes, lats, lons, arrival_altitudes, 36, 0.3, 50, headings,
+                               uniform_field(wind_speed, wind_direction), 1.0)
+    expected = glide_ranges(altitudes, arrival_altitudes, 36, 0.3, 50, [wind_speed] * 2,
+                            [wind_direction] * 2, headings)
+    np.testing.assert_allclose(ranges, expected, rtol=0, atol=1e-9)
+
+
+def test_winds_are_interpolated_linearly_between_grid_points():
+    # A wind linear in every axis is reproduced exactly by the interpolation
+    z, y, x = np.meshgrid(ALTITUDES, LATS, LONS, indexing='ij')
+    field = WindField(LATS, LONS, ALTITUDES, 2.0 * y - 0.5 * x + z / 1000.0, 3.0 - y + x / 4.0)
+    rng = np.random.default_rng(0)
+    lats, lons = rng.uniform(40, 45, 50), rng.uniform(-75, -68, 50)
+    altitudes = rng.uniform(0, 15000, 50)
+    u, v = field.wind_at(lats, lons, altitudes)
+    np.testing.assert_allclose(u, 2.0 * lats - 0.5 * lons + altitudes / 1000.0, rtol=0, atol=1e-9)
+    np.testing.assert_allclose(v, 3.0 - lats + lons / 4.0, rtol=0, atol=1e-9)
+
+    # Grid points give their own winds, and halfway between two the mean of them
+    assert field.wind_at([42.0], [-70.0], [6000.0])[0][0] == pytest.approx(2 * 42 + 35 + 6)
+    u, _ = field.wind_at([43.5], [-71.0], [10500.0])
+    assert u[0] == pytest.approx(np.mean([field.u[z, 1:3, 1:3] for z in (1, 2)]))
+
+    # Outside the grid the winds at its edges are held
+    u, v = field.wind_at([50.0, 30.0], [-80.0, -60.0], [30000.0, -100.0])
+    assert u.tolist() == pytest.approx([field.u[2, 2, 0], field.u[0, 0, 3]])
+    assert v.tolist() == pytest.approx([field.v[2, 2, 0], field.v[0, 0, 3]])
+
+
+def test_speed_and_direction_round_trip_through_the_components():
+    field = uniform_field(22.0, 310.0)
+    speeds, directions = field.speed_direction([41.0, 44.0], [-73.0, -69.0], [1000.0, 12000.0])
+    np.testing.assert_allclose(speeds, 22.0)
+    np.testing.assert_allclose(directions, 310.0)
+
+
+def test_forecast_files_must_fill_a_grid(tmp_path):
+    path = tmp_path / '2024-06-01T18.csv'
+    rows = ['lat,lon,altitude,wind_speed,wind_direction']
+    rows += ['%s,%s,%s,10,270' % (lat, lon, altitude) for lat in (42, 43) for lon in (-72, -71)
+             for altitude in (0, 5000)]
+    path.write_text('\n'.join(rows))
+    field = WindField.from_csv(str(path))
+    assert field.name == '2024-06-01T18'
+    np.testing.assert_allclose(field.speed_direction([42.5], [-71.5], [2500])[0], 10.0)
+
+    path.write_text('\n'.join(rows[:-1]))
+    with pytest.raises(ValueError, match='complete'):
+        WindField.from_csv(str(path))
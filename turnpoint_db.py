@@ -0,0 +1,218 @@
+import json
+import os
+import tempfile
+from collections.abc import Sequence
+
+import numpy as np
+
+# A compiled turnpoint database is one file: MAGIC, the header length as a little-endian uint64,
+# a JSON header describing the arrays, then the arrays themselves, each ALIGNMENT-aligned so they
+# can be memory-mapped in place
+MAGIC = b'GFPTDB01'
+ALIGNMENT = 64
+COMPILED_EXTENSION = '.tpdb'
+
+STRING_COLUMNS = ('codes', 'names', 'countries', 'style_codes', 'styles', 'descriptions')
+NUMERIC_COLUMNS = ('lats', 'lons', 'elevs', 'region_ids', 'name_order')
+REQUIRED_ARRAYS = NUMERIC_COLUMNS + tuple(name + '_offsets' for name in STRING_COLUMNS) + (
+    'sorted_codes', 'code_rows', 'strings')
+
+
+class StringColumn(Sequence):
+    """
+    Read-only sequence of the strings of one column, decoded on access from the UTF-8 string
+    table of a compiled database.
+    """
+
+    def __init__(self, blob, offsets):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        start, end = self._offsets[i], self._offsets[i + 1]
+        return self._blob[start:end].tobytes().decode('utf-8')
+
+
+class CodeIndex:
+    """
+    Code -> row index lookup over the sorted code column of a compiled database, by binary search.
+    """
+
+    def __init__(self, sorted_codes, rows):
+        self._sorted_codes = sorted_codes
+        self._rows = rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    def get(self, code, default=None):
+        key = code.encode('utf-8')
+        if len(key) > self._sorted_codes.dtype.itemsize:
+            return default
+        # 'S' arrays drop trailing NULs, so a key must not end with one to match exactly
+        if key.endswith(b'\0'):
+            return default
+        position = int(np.searchsorted(self._sorted_codes, key))
+        if position < len(self._rows) and self._sorted_codes[position] == key:
+            return int(self._rows[position])
+        return default
+
+    def __contains__(self, code):
+        return self.get(code) is not None
+
+    def __getitem__(self, code):
+        i = self.get(code)
+        if i is None:
+            raise KeyError(code)
+        return i
+
+
+def _string_table(columns):
+    """
+    Return the UTF-8 string table of several string columns and the offsets of every column.
+    """
+    parts = []
+    offsets = {}
+    position = 0
+    for name, values in columns.items():
+        encoded = [value.encode('utf-8') for value in values]
+        lengths = np.fromiter((len(value) for value in encoded), dtype=np.int64, count=len(encoded))
+        offsets[name] = position + np.concatenate([[0], np.cumsum(lengths)])
+        position += int(lengths.sum())
+        parts.extend(encoded)
+    return np.frombuffer(b''.join(parts), dtype=np.uint8), offsets
+
+
+def compile_turnpoints(repository, output):
+    """
+    Write the turnpoints of a loaded TurnpointRepository to a compiled database file.
+
+    The file is written next to output and then moved into place, so a running app never maps a
+    partial file.
+
+    Parameters:
+    repository (TurnpointRepository): The parsed turnpoints.
+    output (str): Path of the compiled database, normally ending in .tpdb.
+
+    Returns:
+    int: The number of turnpoints written.
+    """
+    count = len(repository)
+    blob, offsets = _string_table({name: getattr(repository, name) for name in STRING_COLUMNS})
+
+    # Later rows win on duplicate codes, as in TurnpointRepository.code_index
+    unique_rows = np.array(sorted(repository.code_index.values()), dtype=np.int64)
+    codes = np.array([repository.codes[i].encode('utf-8') for i in unique_rows],
+                     dtype='S%d' % max([1] + [len(code.encode('utf-8')) for code in repository.codes]))
+    code_order = np.argsort(codes, kind='stable')
+
+    arrays = {
+        'lats': np.asarray(repository.lats, dtype='<f8'),
+        'lons': np.asarray(repository.lons, dtype='<f8'),
+        'elevs': np.asarray(repository.elevs, dtype='<f8'),
+        'region_ids': np.asarray(repository.region_ids, dtype='<i8'),
+        'name_order': np.asarray(repository.name_order, dtype='<i8'),
+        'sorted_codes': codes[code_order],
+        'code_rows': unique_rows[code_order].astype('<i8'),
+        'strings': blob,
+    }
+    arrays.update({name + '_offsets': offsets[name].astype('<i8') for name in STRING_COLUMNS})
+
+    header = {'count': count, 'regions': list(repository.region_names),
+              'tasks': list(repository.tasks), 'arrays': {}}
+    position = 0
+    for name, array in arrays.items():
+        header['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape),
+                                  'offset': position}
+        position += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    data_start = -(-(len(MAGIC) + 8 + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+
+    directory = os.path.dirname(os.path.abspath(output))
+    handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as file:
+            file.write(MAGIC)
+            file.write(len(header_bytes).to_bytes(8, 'little'))
+            file.write(header_bytes)
+            for name, array in arrays.items():
+                file.seek(data_start + header['arrays'][name]['offset'])
+                file.write(np.ascontiguousarray(array).tobytes())
+            file.truncate(data_start + position)
+        os.replace(temp_path, output)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return count
+
+
+def open_turnpoints(path):
+    """
+    Memory-map a compiled database.
+
+    Nothing is parsed or copied: the numeric columns are read-only views of the file and the
+    strings are decoded on access, so opening takes the same time whatever the size, and every
+    process mapping the file shares the page cache.
+
+    Returns:
+    dict: The columns of TurnpointRepository (codes, names, ..., lats, lons, elevs, region_ids,
+    name_order, code_index, region_names and tasks).
+
+    Raises:
+    ValueError: If the file is not a compiled database, or is truncated or corrupt.
+    """
+    with open(path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a compiled turnpoint database' % path)
+        header_length = int.from_bytes(file.read(8), 'little')
+        try:
+            header = json.loads(file.read(header_length).decode('utf-8'))
+            specs = dict(header['arrays'])
+            missing = [name for name in REQUIRED_ARRAYS if name not in specs]
+        except (ValueError, KeyError, TypeError):
+            raise ValueError('%s has a corrupt header' % path)
+        if missing:
+            raise ValueError('%s has no %s array' % (path, missing[0]))
+        size = os.fstat(file.fileno()).st_size
+    data_start = -(-(len(MAGIC) + 8 + header_length) // ALIGNMENT) * ALIGNMENT
+
+    arrays = {}
+    for name, spec in specs.items():
+        try:
+            dtype = np.dtype(spec['dtype'])
+            shape = tuple(int(length) for length in spec['shape'])
+            offset = data_start + int(spec['offset'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError('%s has a corrupt header' % path)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        # A file cut short by a failed copy would otherwise map past its end
+        if nbytes and offset + nbytes > size:
+            raise ValueError('%s is truncated: %s ends past the end of the file' % (path, name))
+        if nbytes == 0:
+            arrays[name] = np.empty(shape, dtype=dtype)
+        else:
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r', shape=shape, offset=offset)
+
+    lengths = {name: len(arrays[name]) for name in NUMERIC_COLUMNS}
+    lengths.update({name: len(arrays[name + '_offsets']) - 1 for name in STRING_COLUMNS})
+    if set(lengths.values()) != {header.get('count')} \
+            or len(arrays['sorted_codes']) != len(arrays['code_rows']):
+        raise ValueError('%s is corrupt: its columns have different lengths' % path)
+    if any(len(arrays[name + '_offsets']) and arrays[name + '_offsets'][-1] > len(arrays['strings'])
+           for name in STRING_COLUMNS):
+        raise ValueError('%s is corrupt: its strings end past the string table' % path)
+
+    columns = {name: arrays[name].view(np.ndarray) for name in NUMERIC_COLUMNS}
+    columns['name_order'] = columns['name_order'].astype(np.intp, copy=False)
+    columns['region_ids'] = columns['region_ids'].astype(np.intp, copy=False)
+    columns.update({name: StringColumn(arrays['strings'], arrays[name + '_offsets'])
+                    for name in STRING_COLUMNS})
+    columns['code_index'] = CodeIndex(arrays['sorted_codes'], arrays['code_rows'])
+    columns['region_names'] = tuple(header['regions'])
+    columns['tasks'] = tuple(header.get('tasks', ()))
+    return columns
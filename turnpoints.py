@@ -0,0 +1,529 @@
+import copy
+import csv
+import logging
+import os
+import threading
+import time
+from types import MappingProxyType
+
+import numpy as np
+
+from instrumentation import stage, metrics
+from spatial_index import SpatialIndex
+from turnpoint_db import open_turnpoints, COMPILED_EXTENSION
+
+# Default turnpoint database.
+# Just replace  .cup extension with .csv and it works
+# Several regional files, or directories of them, can be given separated by os.pathsep (':'),
+# or a single database compiled by utilities/compileTurnpoints.py
+TURNPOINT_FILE = os.environ.get('TURNPOINT_FILE', 'data/Sterling_MA_2024_04.csv')
+TURNPOINT_EXTENSIONS = ('.cup', '.csv')
+
+# Columns of the turnpoint table on the index page
+TABLE_COLUMNS = ('code', 'name', 'elev', 'lat', 'lon', 'style', 'desc')
+
+# .cup styles of the turnpoints a glider can land at: grass, outlanding, gliding and solid airfields
+LANDABLE_STYLES = ('2', '3', '4', '5')
+
+# Marker line that separates the waypoint section of a .cup file from the task section
+RELATED_TASKS_MARKER = 'Related Tasks'
+
+FEET_PER_METER = 3.28084
+
+logger = logging.getLogger(__name__)
+
+type_mapping = {
+    '0': 'Unknown',
+    '1': 'Waypoint',
+    '2': 'Airfield - grass runway',
+    '3': 'Outlanding',
+    '4': 'Gliding Airfield',
+    '5': 'Airfield - solid surface runway',
+    '6': 'Mountain Pass',
+    '7': 'Mountain Top',
+    '8': 'Transmitter Mast',
+    '9': 'VOR',
+    '10': 'NDB',
+    '11': 'Cooling Tower',
+    '12': 'Dam',
+    '13': 'Tunnel',
+    '14': 'Bridge',
+    '15': 'PowerPlant',
+    '16': 'Castle',
+    '17': 'Intersection'
+}
+
+
+def parse_latitude(value):
+    """
+    Convert a .cup latitude (DDMM.mmmN) to signed decimal degrees.
+    """
+    degrees = float(value[0:2]) + float(value[2:-1]) / 60
+    return degrees * ((-1, 1)[value[-1] == 'N'])
+
+
+def parse_longitude(value):
+    """
+    Convert a .cup longitude (DDDMM.mmmW) to signed decimal degrees.
+    """
+    degrees = float(value[0:3]) + float(value[3:-1]) / 60
+    return degrees * ((-1, 1)[value[-1] == 'E'])
+
+
+def parse_elevation(value):
+    """
+    Convert a .cup elevation ('730ft', '437.0m' or a bare number in feet) to feet.
+    """
+    value = value.strip()
+    if value.endswith('ft'):
+        return float(value[:-2])
+    elif value.endswith('m'):
+        return float(value[:-1]) * FEET_PER_METER
+    elif value:
+        return float(value)
+    return 0.0
+
+
+def read_cup(file):
+    """
+    Read an open .cup/.csv file in one pass.
+
+    Returns:
+    tuple: The waypoint rows as dicts, up to the Related Tasks section (or the first row without
+    a name), and the rows of the Related Tasks section as lists of fields.
+    """
+    reader = csv.DictReader(file)
+    waypoints = []
+    in_tasks = False
+    for row in reader:
+        if not row['name'] or RELATED_TASKS_MARKER in row['name']:
+            in_tasks = RELATED_TASKS_MARKER in (row['name'] or '')
+            break
+        waypoints.append(row)
+
+    task_rows = []
+    for fields in reader.reader:
+        if in_tasks:
+            task_rows.append(fields)
+        elif fields and RELATED_TASKS_MARKER in fields[0]:
+            in_tasks = True
+    return waypoints, task_rows
+
+
+def cup_options(fields):
+    """
+    Return the key=value fields of a task's Options or ObsZone line as a dict.
+    """
+    return dict(field.split('=', 1) for field in fields if '=' in field)
+
+
+def parse_cup_tasks(task_rows, waypoints, region=0, fieldnames=None):
+    """
+    Build the tasks of a .cup file's Related Tasks section.
+
+    Each task line names its points (takeoff, start, turnpoints, finish and landing) after the
+    file's waypoints; it may be followed by an Options line, ObsZone lines and, in newer files,
+    Point=n lines that define point n of the task inline. Points that name no waypoint, such as
+    the '???' placeholders for an unknown takeoff, are listed in 'missing'.
+
+    Parameters:
+    task_rows (list): The rows of the section, from read_cup.
+    waypoints (list): The file's waypoint rows, from read_cup.
+    region (int): The region ID of the file.
+    fieldnames (list): The file's column names, for Point= lines (default: the waypoint keys).
+
+    Returns:
+    list: One dict per task with name, region, points ({name, code, lat, lon, elev} dicts),
+    options, observation_zones and missing.
+    """
+    by_name = {}
+    for row in waypoints:
+        by_name.setdefault(row['name'], row)
+        by_name.setdefault(row['code'], row)
+    if fieldnames is None:
+        fieldnames = list(waypoints[0].keys()) if waypoints else []
+
+    def point(row):
+        return {'name': row['name'], 'code': row.get('code') or '',
+                'lat': parse_latitude(row['lat']), 'lon': parse_longitude(row['lon']),
+                'elev': parse_elevation(row.get('elev') or '')}
+
+    tasks = []
+    for fields in task_rows:
+        if not fields or not any(field.strip() for field in fields):
+            continue
+        first = fields[0].strip()
+        if tasks and first == 'Options':
+            tasks[-1]['options'].update(cup_options(fields[1:]))
+        elif tasks and first.startswith('ObsZone='):
+            tasks[-1]['observation_zones'].append(cup_options(fields))
+        elif tasks and first.startswith('Point='):
+            index = int(first.split('=', 1)[1])
+            row = dict(zip(fieldnames, fields[1:]))
+            task = tasks[-1]
+            if 0 <= index < len(task['names']) and row.get('lat') and row.get('lon'):
+                task['inline'][index] = row
+        else:
+            tasks.append({'name': first, 'region': region, 'names': fields[1:], 'inline': {},
+                          'options': {}, 'observation_zones': []})
+
+    for task in tasks:
+        names, inline = task.pop('names'), task.pop('inline')
+        task['points'] = []
+        task['missing'] = []
+        for index, name in enumerate(names):
+            row = inline.get(index) or by_name.get(name)
+            if row is None:
+                task['missing'].append(name)
+                continue
+            try:
+                task['points'].append(point(row))
+            except (KeyError, ValueError, IndexError):
+                task['missing'].append(name)
+    return tasks
+
+
+def turnpoint_files(spec):
+    """
+    Expand a TURNPOINT_FILE setting into a list of .cup/.csv files.
+
+    The setting holds one or more files or directories separated by os.pathsep; every .cup and
+    .csv file in a directory is loaded, in name order. A compiled .tpdb database must be the
+    only entry.
+    """
+    paths = []
+    for entry in spec.split(os.pathsep):
+        entry = entry.strip()
+        if not entry:
+            continue
+        if os.path.isdir(entry):
+            paths.extend(sorted(os.path.join(entry, name) for name in os.listdir(entry)
+                                if name.lower().endswith(TURNPOINT_EXTENSIONS)))
+        else:
+            paths.append(entry)
+    return paths
+
+
+def region_name(path):
+    """
+    Return the region a turnpoint file holds, named after the file, e.g. 'Sterling_MA_2024_04'.
+    """
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+class TurnpointColumns:
+    """
+    One immutable version of the columns of a TurnpointRepository.
+
+    A repository swaps its whole TurnpointColumns on reload, in one assignment, so a reader
+    holding one never sees the columns of two versions mixed. The structures derived from the
+    columns (the R-tree, the landable mask, sort ranks and search text) are built on first use
+    and belong to the version they were built from.
+    """
+
+    FIELDS = ('codes', 'names', 'countries', 'style_codes', 'styles', 'descriptions', 'lats', 'lons',
+              'elevs', 'region_names', 'region_ids', 'code_index', 'name_order', 'tasks')
+
+    def __init__(self, version=None, **columns):
+        # The files and modification times the columns were loaded from
+        object.__setattr__(self, 'version', version)
+        for name in self.FIELDS:
+            values = columns[name]
+            if isinstance(values, np.ndarray):
+                values = values.view()
+                values.flags.writeable = False
+            elif isinstance(values, dict):
+                values = MappingProxyType(values)
+            object.__setattr__(self, name, values)
+        object.__setattr__(self, '_derived', {})
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Turnpoint columns are immutable')
+
+    def _derive(self, key, build):
+        # Two threads may both build a structure; either result is the same
+        value = self._derived.get(key)
+        if value is None:
+            value = self._derived.setdefault(key, build())
+        return value
+
+    @property
+    def spatial_index(self):
+        return self._derive('spatial_index', lambda: SpatialIndex(self.lats, self.lons))
+
+    @property
+    def landable(self):
+        return self._derive('landable', lambda: np.fromiter(
+            (style in LANDABLE_STYLES for style in self.style_codes), dtype=bool,
+            count=len(self.codes)))
+
+    @property
+    def search_text(self):
+        return self._derive('search_text', lambda: tuple(
+            '\n'.join(fields).lower() for fields in zip(self.codes, self.names, self.descriptions)))
+
+    def sort_ranks(self, column):
+        def build():
+            if column == 'name':
+                order = self.name_order
+            else:
+                values = {'code': self.codes, 'elev': self.elevs, 'lat': self.lats,
+                          'lon': self.lons, 'style': self.styles, 'desc': self.descriptions}[column]
+                order = np.array(sorted(range(len(self.codes)), key=values.__getitem__),
+                                 dtype=np.intp)
+            ranks = np.empty(len(self.codes), dtype=np.intp)
+            ranks[order] = np.arange(len(self.codes))
+            return ranks
+        return self._derive(('sort_ranks', column), build)
+
+
+class TurnpointRepository:
+    """
+    In-memory, columnar store of the turnpoints of one or more regional .cup/.csv files.
+
+    The files are parsed once and kept as parallel columns (NumPy arrays for the
+    numeric fields, tuples for the strings) together with a code -> index lookup,
+    the region of every row and an R-tree over the coordinates. The tasks of the files'
+    Related Tasks sections are parsed in the same pass (see parse_cup_tasks). The files are
+    only re-read when one of them is added, removed or modified. A compiled database is
+    memory-mapped rather than parsed, with the same columns.
+
+    The columns are read as attributes (repository.codes, repository.lats, ...) of the current
+    TurnpointColumns. Code that reads several columns while another thread may reload them
+    reads them from a snapshot (see get_repository).
+    """
+
+    def __init__(self, path=TURNPOINT_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._load_columns([], [])
+
+    def __getattr__(self, name):
+        if name in TurnpointColumns.FIELDS:
+            return getattr(self._columns, name)
+        raise AttributeError(name)
+
+    @property
+    def columns(self):
+        """
+        The current TurnpointColumns.
+        """
+        return self._columns
+
+    def snapshot(self):
+        """
+        Return a copy of the repository that keeps the current columns, whatever reloads follow.
+        """
+        return copy.copy(self)
+
+    def _load_columns(self, rows, region_names, tasks=(), version=None):
+        codes = tuple(row['code'] for row in rows)
+        names = tuple(row['name'] for row in rows)
+        style_codes = tuple(row['style'] for row in rows)
+        self._set_columns(
+            version,
+            codes=codes,
+            names=names,
+            countries=tuple(row.get('country') or '' for row in rows),
+            style_codes=style_codes,
+            styles=tuple(type_mapping.get(style, style) for style in style_codes),
+            descriptions=tuple(row.get('desc') or '' for row in rows),
+            lats=np.array([parse_latitude(row['lat']) for row in rows], dtype=np.float64),
+            lons=np.array([parse_longitude(row['lon']) for row in rows], dtype=np.float64),
+            elevs=np.array([parse_elevation(row['elev']) for row in rows], dtype=np.float64),
+            region_names=tuple(region_names),
+            region_ids=np.array([row['region'] for row in rows], dtype=np.intp),
+            # Later rows win on duplicate codes, as the old per-request lookups did; with several
+            # regions that means the region loaded last
+            code_index={code: i for i, code in enumerate(codes)},
+            name_order=np.array(sorted(range(len(rows)), key=names.__getitem__), dtype=np.intp),
+            tasks=tuple(tasks),
+        )
+
+    def _set_columns(self, version, **columns):
+        # Built in full before it is published, with its version, in one assignment
+        self._columns = TurnpointColumns(version=version, **columns)
+
+    def refresh(self):
+        """
+        Reload the files if any of them changed on disk since they were last parsed.
+
+        A compiled database (see turnpoint_db) is memory-mapped instead of parsed.
+
+        Returns:
+        bool: True if the files were (re)loaded.
+        """
+        paths = turnpoint_files(self.path)
+        mtime = tuple((path, os.stat(path).st_mtime_ns) for path in paths)
+        if mtime == self._columns.version:
+            return False
+        with self._lock:
+            if mtime == self._columns.version:
+                return False
+            start = time.perf_counter()
+            with stage('parse'):
+                compiled = [path for path in paths if path.endswith(COMPILED_EXTENSION)]
+                if compiled:
+                    if len(paths) > 1:
+                        raise ValueError('A compiled turnpoint database must be the only turnpoint file')
+                    self._set_columns(mtime, **open_turnpoints(compiled[0]))
+                else:
+                    rows = []
+                    tasks = []
+                    for region, path in enumerate(paths):
+                        with open(path, 'r') as file:
+                            waypoints, task_rows = read_cup(file)
+                        for row in waypoints:
+                            row['region'] = region
+                        rows.extend(waypoints)
+                        tasks.extend(parse_cup_tasks(task_rows, waypoints, region))
+                    self._load_columns(rows, [region_name(path) for path in paths], tasks,
+                                       mtime)
+            metrics.set('gfp_turnpoints_loaded', len(self.codes))
+            logger.info('Loaded %d turnpoints from %d files in %.3f s', len(self.codes), len(paths),
+                        time.perf_counter() - start)
+        return True
+
+    @property
+    def version(self):
+        """
+        The files and modification times that were last loaded.
+        """
+        return self._columns.version
+
+    @property
+    def spatial_index(self):
+        """
+        The R-tree over the turnpoints, built on first use.
+        """
+        return self._columns.spatial_index
+
+    @property
+    def landable(self):
+        """
+        Boolean array of the turnpoints with a LANDABLE_STYLES style, built on first use.
+        """
+        return self._columns.landable
+
+    def __len__(self):
+        return len(self._columns.codes)
+
+    def __contains__(self, code):
+        return code in self._columns.code_index
+
+    def indices(self, codes):
+        """
+        Return the row indices of the given codes, in database order, skipping unknown codes.
+        """
+        code_index = self._columns.code_index
+        return np.array(sorted({code_index[code] for code in codes if code in code_index}),
+                        dtype=np.intp)
+
+    def regions(self):
+        """
+        Return the (name, turnpoint count) of every region, in load order.
+        """
+        columns = self._columns
+        counts = np.bincount(columns.region_ids, minlength=len(columns.region_names))
+        return [(name, int(count)) for name, count in zip(columns.region_names, counts)]
+
+    def within_bbox(self, south, west, north, east):
+        """
+        Return the row indices of the turnpoints inside a box, in database order.
+        """
+        return self._columns.spatial_index.within_bbox(south, west, north, east)
+
+    def within_radius(self, lat, lon, radius_nm):
+        """
+        Return the row indices of the turnpoints within radius_nm nautical miles of a point,
+        nearest first, and their distances.
+        """
+        return self._columns.spatial_index.within_radius(lat, lon, radius_nm)
+
+    def select(self, region=None, bbox=None, near=None, radius_nm=None, search=None):
+        """
+        Return the row indices of the turnpoints matching every given filter, in database order.
+
+        Parameters:
+        region (str): Region name.
+        bbox (tuple): (south, west, north, east) in degrees.
+        near (tuple): (lat, lon) in degrees, used with radius_nm.
+        radius_nm (float): Search radius around near in nautical miles.
+        search (str): Case-insensitive text to find in the code, name or description.
+
+        Returns:
+        array: The row indices.
+        """
+        columns = self._columns
+        count = len(columns.codes)
+        selected = np.ones(count, dtype=bool)
+        if region is not None:
+            if region not in columns.region_names:
+                return np.empty(0, dtype=np.intp)
+            selected &= columns.region_ids == columns.region_names.index(region)
+        if bbox is not None:
+            inside = np.zeros(count, dtype=bool)
+            inside[columns.spatial_index.within_bbox(*bbox)] = True
+            selected &= inside
+        if near is not None and radius_nm is not None:
+            inside = np.zeros(count, dtype=bool)
+            inside[columns.spatial_index.within_radius(near[0], near[1], radius_nm)[0]] = True
+            selected &= inside
+        if search:
+            search = search.lower()
+            selected &= np.fromiter((search in text for text in columns.search_text),
+                                    dtype=bool, count=count)
+        return np.flatnonzero(selected)
+
+    def sort(self, indices, column='name', descending=False):
+        """
+        Return the row indices ordered by one of the TABLE_COLUMNS.
+        """
+        ranks = self._columns.sort_ranks(column)
+        indices = np.asarray(indices, dtype=np.intp)
+        order = np.argsort(ranks[indices], kind='stable')
+        return indices[order[::-1] if descending else order]
+
+    def record(self, i):
+        """
+        Return the turnpoint at row index i as a dict.
+        """
+        columns = self._columns
+        return {
+            'code': columns.codes[i],
+            'name': columns.names[i],
+            'country': columns.countries[i],
+            'lat': float(columns.lats[i]),
+            'lon': float(columns.lons[i]),
+            'elev': float(columns.elevs[i]),
+            'style': columns.styles[i],
+            'desc': columns.descriptions[i],
+            'region': columns.region_names[columns.region_ids[i]],
+        }
+
+    def table_row(self, i):
+        """
+        Return the turnpoint at row index i as a row of the index page's table (TABLE_COLUMNS).
+        """
+        columns = self._columns
+        return [columns.codes[i], columns.names[i], '%.0fft' % columns.elevs[i],
+                float(columns.lats[i]), float(columns.lons[i]), columns.styles[i],
+                columns.descriptions[i]]
+
+
+_repositories = {}
+_repositories_lock = threading.Lock()
+
+
+def get_repository(path=TURNPOINT_FILE):
+    """
+    Return a snapshot of the shared repository for path, loading it on first use and
+    reloading it if the files have changed since. A request reads every column from the
+    snapshot, so a reload by another thread never mixes two versions in one response.
+    """
+    repository = _repositories.get(path)
+    if repository is None:
+        with _repositories_lock:
+            repository = _repositories.setdefault(path, TurnpointRepository(path))
+    repository.refresh()
+    return repository.snapshot()
@@ -0,0 +1,34 @@
+import argparse
+import os
+import sys
+import time
+
+# Run from anywhere: the turnpoint modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from turnpoints import TurnpointRepository, TURNPOINT_FILE
+from turnpoint_db import compile_turnpoints, COMPILED_EXTENSION
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compile .cup/.csv turnpoint files into a memory-mapped turnpoint database. '
+                    'Point TURNPOINT_FILE at the output to use it.')
+    parser.add_argument('sources', nargs='*', default=[TURNPOINT_FILE],
+                        help='.cup/.csv files or directories of them, one region per file '
+                             '(default: TURNPOINT_FILE)')
+    parser.add_argument('-o', '--output', default='data/turnpoints' + COMPILED_EXTENSION,
+                        help='compiled database to write (default: %(default)s)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    repository = TurnpointRepository(os.pathsep.join(args.sources))
+    repository.refresh()
+    count = compile_turnpoints(repository, args.output)
+    print('Compiled %d turnpoints in %d regions into %s (%.0f kB) in %.2f s' % (
+        count, len(repository.region_names), args.output, os.path.getsize(args.output) / 1024,
+        time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
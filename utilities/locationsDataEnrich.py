@@ -1,26 +1,316 @@
-from geopy.geocoders import Nominatim
-import pandas as pd
-
-# Define a function to get location details
-def get_location_details(lat, lon):
-    # Initialize Nominatim API
-    geolocator = Nominatim(user_agent="location_data_enricher")
-    
-    # Get location details
-    location = geolocator.reverse((lat, lon), exactly_one=True)
-    address = location.raw['address']
-    
-    return address.get('state'), address.get('county')
-
-def enrich_locations():
-    # Load your CSV data into a DataFrame
-    df = pd.read_csv('/Users/alejandroleda/Documents/Py/gliderFlightPlanner/data/Crystal23.csv')
-
-    # Apply the function to each row in your DataFrame
-    df[['State', 'County']] = df.apply(lambda row: get_location_details(row['Lat'], row['Long']), axis=1, result_type='expand')
-
-    # Save the enriched DataFrame back to CSV
-    df.to_csv('/Users/alejandroleda/Documents/Py/gliderFlightPlanner/data/enriched_locations.csv', index=False)
+import argparse
+import csv
+import itertools
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
+
+# Run from anywhere: the turnpoint modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from turnpoints import parse_latitude, parse_longitude, RELATED_TASKS_MARKER
+
+# Decimal places of the coordinates the cache is keyed by; 4 places is about 11 m
+CACHE_PRECISION = 4
+
+
+class RateLimiter:
+    """
+    Let at most rate calls per second through, shared by every thread calling wait().
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class Geocoder:
+    """
+    A reverse geocoder: (lat, lon) -> (state, county).
+
+    Subclasses implement reverse() for one point; reverse_many() runs it for many points on a
+    bounded pool of threads, at most rate requests per second, retrying failed requests with an
+    exponential backoff. Points whose lookup still fails are left out of the result, so that
+    they are not cached and are tried again on the next run.
+    """
+
+    name = None
+
+    def __init__(self, workers=1, rate=1.0, retries=3, backoff=1.0):
+        self.workers = workers
+        self.limiter = RateLimiter(rate)
+        self.retries = retries
+        self.backoff = backoff
+
+    def reverse(self, lat, lon):
+        raise NotImplementedError
+
+    def _reverse_with_retries(self, point):
+        for attempt in range(self.retries + 1):
+            self.limiter.wait()
+            try:
+                return point, self.reverse(*point)
+            except Exception as e:
+                if attempt == self.retries:
+                    print('Gave up on %.5f, %.5f: %s' % (point + (e,)), file=sys.stderr)
+                    return point, None
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def reverse_many(self, points):
+        """
+        Return {(lat, lon): (state, county)} for the points that could be looked up.
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return {point: result for point, result in executor.map(self._reverse_with_retries,
+                                                                    points)
+                    if result is not None}
+
+
+class NominatimGeocoder(Geocoder):
+    """
+    Reverse geocoding with OpenStreetMap's Nominatim service through geopy, with one client
+    shared by all requests. Nominatim's usage policy allows one request per second.
+    """
+
+    name = 'nominatim'
+
+    def __init__(self, user_agent='location_data_enricher', timeout=10, **options):
+        super().__init__(**options)
+        # geopy is only needed for this backend
+        from geopy.geocoders import Nominatim
+        self.client = Nominatim(user_agent=user_agent, timeout=timeout)
+
+    def reverse(self, lat, lon):
+        location = self.client.reverse((lat, lon), exactly_one=True)
+        if location is None:
+            return None, None
+        address = location.raw.get('address', {})
+        return address.get('state'), address.get('county')
+
+
+class BoundaryGeocoder(Geocoder):
+    """
+    Offline reverse geocoding against a GeoJSON file of county (or state) boundary polygons, whose
+    properties name the state and the county, e.g. the Census Bureau's cartographic boundary
+    files converted to GeoJSON.
+
+    All the points of a chunk are located at once with a spatial index, so no rate limit or
+    threads are needed.
+    """
+
+    name = 'boundaries'
+
+    def __init__(self, path, state_property='state', county_property='county', **options):
+        super().__init__(**options)
+        with open(path, 'r') as file:
+            features = json.load(file)['features']
+        self.geometries = np.array([shape(feature['geometry'])
+                                    for feature in features], dtype=object)
+        self.names = [(feature['properties'].get(state_property),
+                       feature['properties'].get(county_property)) for feature in features]
+        self.tree = shapely.STRtree(self.geometries)
+        self.name = 'boundaries:%s' % os.path.basename(path)
+
+    def reverse(self, lat, lon):
+        return self.reverse_many([(lat, lon)])[(lat, lon)]
+
+    def reverse_many(self, points):
+        if not points:
+            return {}
+        lats, lons = np.array(points, dtype=np.float64).reshape(-1, 2).T
+        # GeoJSON boundaries are in lon, lat order
+        point_indices, boundary_indices = self.tree.query(shapely.points(lons, lats),
+                                                          predicate='intersects')
+        results = {point: (None, None) for point in points}
+        # Points on a shared border take the first boundary found
+        for point_index, boundary_index in zip(point_indices[::-1], boundary_indices[::-1]):
+            results[points[point_index]] = self.names[boundary_index]
+        return results
+
+
+class GeocodeCache:
+    """
+    Persistent cache of reverse geocoding results in an SQLite file, keyed by the backend and the
+    coordinates rounded to CACHE_PRECISION decimal places. Places with no state or county are
+    cached too, so they are not asked again.
+    """
+
+    def __init__(self, path, backend):
+        self.backend = backend
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS geocodes (backend TEXT, lat REAL, '
+                                'lon REAL, state TEXT, county TEXT, '
+                                'PRIMARY KEY (backend, lat, lon))')
+
+    def get_many(self, points):
+        found = {}
+        for point in points:
+            row = self.connection.execute(
+                'SELECT state, county FROM geocodes WHERE backend = ? AND lat = ? AND lon = ?',
+                (self.backend,) + point).fetchone()
+            if row is not None:
+                found[point] = row
+        return found
+
+    def put_many(self, results):
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?, ?)',
+                [(self.backend,) + point + tuple(names) for point, names in results.items()])
+
+    def close(self):
+        self.connection.close()
+
+
+def coordinate(value, parse):
+    """
+    Return a coordinate in decimal degrees from a decimal value or a .cup coordinate.
+    """
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        return parse(value)
+
+
+def enrich_locations(source, output, geocoder, cache, lat_column='lat', lon_column='lon',
+                     chunk_size=1000):
+    """
+    Copy a CSV or .cup file, adding the State and County of every row.
+
+    The rows are read, geocoded and written chunk_size at a time, so a file of any size is
+    streamed. Every chunk's distinct coordinates are looked up in the cache first, and only the
+    rest go to the geocoder. The Related Tasks section of a .cup file is copied as it is; blank
+    rows of a CSV file are skipped with a warning.
+
+    Returns:
+    tuple: The rows written and the lookups sent to the geocoder.
+    """
+    rows_written = lookups = 0
+    with open(source, 'r', newline='', encoding='utf-8-sig') as infile, \
+            open(output, 'w', newline='', encoding='utf-8') as outfile:
+        reader = csv.reader(infile)
+        fieldnames = next(reader)
+        writer = csv.writer(outfile)
+        writer.writerow(fieldnames + ['State', 'County'])
+        lat_index, lon_index = fieldnames.index(lat_column), fieldnames.index(lon_column)
+        # Only a .cup file has a task section after its waypoints
+        name_column = fieldnames.index('name') \
+            if source.lower().endswith('.cup') and 'name' in fieldnames else None
+        tail = None
+        blank_rows = 0
+        while tail is None:
+            chunk = []
+            read = 0
+            for fields in itertools.islice(reader, chunk_size):
+                read += 1
+                if name_column is not None and (not fields or not fields[name_column]
+                                                or RELATED_TASKS_MARKER in fields[name_column]):
+                    tail = fields
+                    break
+                if not any(field.strip() for field in fields):
+                    blank_rows += 1
+                    continue
+                chunk.append(fields)
+            if not read:
+                break
+            if not chunk:
+                continue
+
+            points = [(round(coordinate(fields[lat_index], parse_latitude), CACHE_PRECISION),
+                       round(coordinate(fields[lon_index], parse_longitude), CACHE_PRECISION))
+                      for fields in chunk]
+            found = cache.get_many(set(points))
+            missing = sorted(set(points) - set(found))
+            if missing:
+                results = geocoder.reverse_many(missing)
+                cache.put_many(results)
+                found.update(results)
+                lookups += len(missing)
+            writer.writerows(fields + list(found.get(point, ('', '')))
+                             for fields, point in zip(chunk, points))
+            rows_written += len(chunk)
+            print('%d rows, %d lookups' % (rows_written, lookups), file=sys.stderr)
+
+        if blank_rows:
+            print('Skipped %d blank rows' % blank_rows, file=sys.stderr)
+        if tail is not None:
+            # The rest of a .cup file is its task section, copied row by row
+            writer.writerow(tail)
+            writer.writerows(reader)
+    return rows_written, lookups
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Add the state and county of every row of a CSV or .cup turnpoint file.')
+    parser.add_argument('source', help='CSV or .cup file to enrich')
+    parser.add_argument('-o', '--output', required=True, help='enriched file to write')
+    parser.add_argument('--backend', choices=('nominatim', 'boundaries'), default='nominatim',
+                        help='geocoder: the Nominatim service (needs geopy) or, offline, a '
+                             'GeoJSON file of boundaries (default: %(default)s)')
+    parser.add_argument('--boundaries', help='GeoJSON boundaries for --backend boundaries')
+    parser.add_argument('--state-property', default='state',
+                        help='property naming the state in --boundaries (default: %(default)s)')
+    parser.add_argument('--county-property', default='county',
+                        help='property naming the county in --boundaries (default: %(default)s)')
+    parser.add_argument('--cache', default='data/geocode_cache.sqlite',
+                        help='SQLite cache of the lookups, kept across runs (default: '
+                             '%(default)s)')
+    parser.add_argument('--lat-column', default='lat')
+    parser.add_argument('--lon-column', default='lon')
+    parser.add_argument('--chunk-size', type=int, default=1000,
+                        help='rows read, geocoded and written at a time (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='concurrent geocoding requests (default: %(default)s)')
+    parser.add_argument('--rate', type=float, default=1.0,
+                        help='most geocoding requests per second (default: %(default)s)')
+    parser.add_argument('--retries', type=int, default=3,
+                        help='retries of a failed request, with exponential backoff (default: '
+                             '%(default)s)')
+    parser.add_argument('--user-agent', default='location_data_enricher',
+                        help='user agent sent to Nominatim (default: %(default)s)')
+    args = parser.parse_args()
+
+    options = {'workers': args.workers, 'rate': args.rate, 'retries': args.retries}
+    if args.backend == 'boundaries':
+        if not args.boundaries:
+            parser.error('--backend boundaries needs --boundaries')
+        geocoder = BoundaryGeocoder(args.boundaries, args.state_property, args.county_property,
+                                    **options)
+    else:
+        try:
+            geocoder = NominatimGeocoder(args.user_agent, **options)
+        except ImportError:
+            parser.error('--backend nominatim needs geopy (pip install geopy)')
+
+    start = time.perf_counter()
+    cache = GeocodeCache(args.cache, geocoder.name)
+    try:
+        rows, lookups = enrich_locations(args.source, args.output, geocoder, cache,
+                                         args.lat_column, args.lon_column, args.chunk_size)
+    finally:
+        cache.close()
+    print('Enriched %d rows into %s with %d lookups in %.1f s' % (
+        rows, args.output, lookups, time.perf_counter() - start))
+
 
 if __name__ == '__main__':
-    enrich_locations()
+    main()
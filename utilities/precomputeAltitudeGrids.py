@@ -0,0 +1,103 @@
+import argparse
+import os
+import sys
+import time
+
+# Run from anywhere: the turnpoint modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from altitude_grid import glider_class, class_range, region_bounds, grid_axes, compute_grid, \
+    write_grids
+from gliders import get_glider_registry
+from task_analysis import TASK_SEARCH_RADIUS_NM
+from turnpoints import TurnpointRepository, TURNPOINT_FILE
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Precompute, for every region, glider class and wind, the altitude required '
+                    'to reach a landable turnpoint on a lat/lon grid. Point ALTITUDE_GRID_DIR at '
+                    'the output to serve them.')
+    parser.add_argument('sources', nargs='*', default=[TURNPOINT_FILE],
+                        help='.cup/.csv files or directories of them, one region per file '
+                             '(default: TURNPOINT_FILE)')
+    parser.add_argument('-o', '--output', default='data/altitude_grids',
+                        help='directory to write the grids to (default: %(default)s)')
+    parser.add_argument('--gliders', nargs='*',
+                        help='glider IDs whose classes are computed (default: every glider)')
+    parser.add_argument('--glide-step', type=float, default=2.0,
+                        help='glide ratios are rounded down to a multiple of this (default: '
+                             '%(default)s)')
+    parser.add_argument('--vg-step', type=float, default=5.0,
+                        help='best glide speeds are rounded to a multiple of this (default: '
+                             '%(default)s)')
+    parser.add_argument('--wind-speeds', type=float, nargs='+', default=[0, 10, 20],
+                        help='wind speeds in knots; a grid covers every speed above the next '
+                             'lower one up to its own (default: %(default)s)')
+    parser.add_argument('--wind-directions', type=float, nargs='+',
+                        default=[0, 45, 90, 135, 180, 225, 270, 315],
+                        help='directions the wind comes from in degrees; a grid covers every '
+                             'direction up to halfway to its neighbours (default: %(default)s)')
+    parser.add_argument('--safety-margin', type=float, default=50,
+                        help='safety margin in %% (default: %(default)s)')
+    parser.add_argument('--arrival-altitude', type=float, default=1500,
+                        help='height above the turnpoint to arrive at, in feet (default: '
+                             '%(default)s)')
+    parser.add_argument('--step', type=float, default=1.0,
+                        help='nautical miles between grid points (default: %(default)s)')
+    parser.add_argument('--radius', type=float, default=TASK_SEARCH_RADIUS_NM,
+                        help='farthest landable turnpoint considered, in nautical miles '
+                             '(default: TASK_SEARCH_RADIUS_NM)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    repository = TurnpointRepository(os.pathsep.join(args.sources))
+    repository.refresh()
+    registry = get_glider_registry()
+    gliders = registry.gliders if args.gliders is None \
+        else [registry.lookup(selection) for selection in args.gliders]
+    if None in gliders:
+        parser.error('unknown glider %s' % args.gliders[gliders.index(None)])
+    classes = sorted({glider_class(float(glider['glide_ratio']), float(glider['vg']),
+                                   args.glide_step, args.vg_step) for glider in gliders})
+    winds = [(0.0, 0.0)] * (0 in args.wind_speeds) + [
+        (speed, direction) for speed in args.wind_speeds if speed != 0
+        for direction in args.wind_directions]
+    safety_margin = args.safety_margin / 100
+    settings = {
+        'glide_step': args.glide_step, 'vg_step': args.vg_step,
+        'wind_speeds': sorted(set(args.wind_speeds)), 'wind_directions': args.wind_directions,
+        'step_nm': args.step, 'radius_nm': args.radius,
+    }
+
+    grids = []
+    for region in repository.region_names:
+        bounds = region_bounds(repository, region, args.radius / 2)
+        if bounds is None:
+            print('Skipped %s: no landable turnpoints' % region)
+            continue
+        lats, lons = grid_axes(bounds, args.step)
+        for glide_ratio, vg in classes:
+            for wind_speed, wind_direction in winds:
+                unit_range = class_range(glide_ratio, vg, safety_margin, wind_speed,
+                                         wind_direction, settings)
+                values = compute_grid(repository, lats, lons, unit_range, args.arrival_altitude,
+                                      args.radius)
+                grids.append(({
+                    'region': region, 'glide_ratio': glide_ratio, 'vg': vg,
+                    'safety_margin': safety_margin, 'arrival_altitude': args.arrival_altitude,
+                    'wind_speed': wind_speed, 'wind_direction': wind_direction,
+                    'south': float(lats[0]), 'west': float(lons[0]),
+                    'dlat': float(lats[1] - lats[0]) if lats.size > 1 else 1.0,
+                    'dlon': float(lons[1] - lons[0]) if lons.size > 1 else 1.0,
+                }, values))
+        print('%s: %d x %d points, %d glider classes, %d winds' % (
+            region, lats.size, lons.size, len(classes), len(winds)))
+
+    write_grids(args.output, grids, settings)
+    print('Wrote %d grids to %s in %.1f s' % (len(grids), args.output,
+                                              time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,45 @@
 import numpy as np
 from math import radians, cos, sin, asin, sqrt, degrees, atan2
-from shapely.geometry import Point, Polygon, MultiPolygon
-from shapely.ops import unary_union
 import folium
+import shapely
 from folium.features import DivIcon
-import smtplib
-from email.message import EmailMessage
+from folium.plugins import FastMarkerCluster
+from html import escape
 import os
 from branca.element import Template, MacroElement
 from dotenv import load_dotenv
+from rings import compute_rings, resolve_headings, ring_engine, ADAPTIVE, DEFAULT_HEADING_STEP
+from ring_cache import canonical_key, geometry_cache
+from ring_executor import union_bands_parallel
+from ring_geojson import rings_feature_collection, RingLayer, RING_COLOR, RING_LABEL_STYLE
+from terrain import terrain_model
+from instrumentation import stage, metrics
+from wind_field import WIND_STEP_NM
+from planning import map_center
 
 load_dotenv()
 
-GMAIL_ADDRESS = os.environ.get('GMAIL_ADDRESS')
-GMAIL_PASSWORD = os.environ.get('GMAIL_PASSWORD')
+
+# Heading step of the ring vertices in degrees, or 'adaptive'
+RING_RESOLUTION = os.environ.get('RING_RESOLUTION', str(DEFAULT_HEADING_STEP))
+# Tolerance, in degrees, used to drop redundant ring vertices in adaptive mode
+RING_SIMPLIFY_TOLERANCE = float(os.environ.get('RING_SIMPLIFY_TOLERANCE', '0.0002'))
+# Reuse ring profiles across altitude bands and requests instead of recomputing every band
+RING_INCREMENTAL = os.environ.get('RING_INCREMENTAL', 'true').lower() in ('1', 'true', 'yes')
+# Above this many locations the markers are clustered and built client-side
+MARKER_CLUSTER_THRESHOLD = int(os.environ.get('MARKER_CLUSTER_THRESHOLD', '50'))
+MARKER_CLUSTER_CALLBACK = """
+    function (row) {
+        var icon = L.AwesomeMarkers.icon({icon: 'plane-arrival', prefix: 'fa'});
+        var marker = L.marker(new L.LatLng(row[0], row[1]), {icon: icon});
+        marker.bindPopup(row[2]);
+        return marker;
+    };
+"""
+# How rings are embedded in the map page: 'geojson', 'topojson' or 'folium'
+RING_OUTPUT = os.environ.get('RING_OUTPUT', 'geojson')
+# Number of altitude labels drawn along each ring
+RING_LABEL_COUNT = 4
 
 
 def glide_range(altitude, arrival_altitude, glide_ratio, safety_margin, Vg, wind_speed,
@@ -33,6 +59,8 @@ def glide_range(altitude, arrival_altitude, glide_ratio, safety_margin, Vg, wind
     Returns:
     float: The glide range of the aircraft in nautical miles from the initial altitude
       from which the aircraft starts to glide to the arrival altitude.
+
+    This is the scalar reference for rings.glide_ranges, which plot_map uses.
     """
     initial_altitude = altitude - arrival_altitude
 
@@ -70,6 +98,8 @@ def glide_range(altitude, arrival_altitude, glide_ratio, safety_margin, Vg, wind
 def haversine(lon1, lat1, d, brng):
     """
     Calculate the new coordinates given a starting point, distance and bearing
+
+    This is the scalar reference for rings.destination_points, which plot_map uses.
     """
     R = 3440.069  # Radius of the Earth in nautical miles
     brng = radians(brng)  # convert bearing to radians
@@ -87,8 +117,172 @@ def haversine(lon1, lat1, d, brng):
     return [lat2, lon2]
 
 
+def ring_label_locations(polygon, count=RING_LABEL_COUNT):
+    """
+    Return count points spread evenly along the exterior of a ring polygon, as [lat, lon] pairs.
+    """
+    # Offset the first label a little from the start of the ring, as the fixed labels used to be
+    return [list(polygon.exterior.interpolate((i + 1 / 9) / count, normalized=True).coords[0])
+            for i in range(count)]
+
+
+def location_popup(name, type, description, arrival_altitude_msl, arrival_altitude_agl):
+    return f"{name}\nType: {type}\nArrival Alt: {arrival_altitude_msl}ft\nLocation Alt: {arrival_altitude_msl - arrival_altitude_agl}ft\nDescription: {description}"
+
+
+def add_location_markers(m, center_locations, arrival_altitude_agl,
+                         cluster_threshold=MARKER_CLUSTER_THRESHOLD):
+    """
+    Add one marker per center location to the map. Above cluster_threshold locations the markers
+    go into a FastMarkerCluster, which builds them in the browser from a single data array.
+    """
+    if len(center_locations) <= cluster_threshold:
+        for lat, lon, wind_speed, wind_direction, arrival_altitude_msl, name, type, description in center_locations:
+            folium.Marker(
+                location=[lat, lon],
+                popup=location_popup(name, type, description, arrival_altitude_msl, arrival_altitude_agl),
+                icon=folium.Icon(icon="plane-arrival", prefix='fa')
+            ).add_to(m)
+        return
+
+    data = [[lat, lon, escape(location_popup(name, type, description, arrival_altitude_msl,
+                                             arrival_altitude_agl)).replace('\n', '<br>')]
+            for lat, lon, wind_speed, wind_direction, arrival_altitude_msl, name, type, description
+            in center_locations]
+    FastMarkerCluster(data, callback=MARKER_CLUSTER_CALLBACK, name='Locations').add_to(m)
+
+
+def ring_locations_of(center_locations):
+    """
+    Return the distinct (lat, lon, arrival_altitude_msl, wind_speed, wind_direction) tuples of the
+    center locations that get rings. Turnpoints don't get rings.
+    """
+    return list(dict.fromkeys(
+        (lat, lon, arrival_altitude_msl, wind_speed, wind_direction)
+        for lat, lon, wind_speed, wind_direction, arrival_altitude_msl, name, type, description
+        in center_locations if type != "T"))
+
+
+def compute_merged_rings(ring_locations, polygon_altitudes, glide_ratio, safety_margin, Vg,
+                         ring_resolution=RING_RESOLUTION, incremental=RING_INCREMENTAL,
+                         terrain=terrain_model, wind_field=None):
+    """
+    Compute the rings around the ring locations and merge the overlapping ones.
+
+    With incremental set, the rings come from the shared IncrementalRingEngine, which derives
+    every band from memoized per-location profiles. With a terrain model (TERRAIN_DIR), every
+    ring is cut where its glide path meets the terrain. With a wind field, the wind along every
+    heading comes from the field rather than from the ring locations.
+
+    Returns:
+    list: One list of merged shapely Polygons per altitude in polygon_altitudes.
+    """
+    # Compute the rings for every altitude and location in one vectorized pass
+    ring_lats, ring_lons, ring_arrival_altitudes, ring_wind_speeds, ring_wind_directions = \
+        np.array(ring_locations, dtype=np.float64).reshape(-1, 5).T
+    headings = resolve_headings(ring_resolution, glide_ratio, safety_margin, Vg,
+                                ring_wind_speeds, ring_wind_directions)
+    wind_step = WIND_STEP_NM if terrain is None else min(WIND_STEP_NM, terrain.step)
+    with stage('rings'):
+        ring_vertices, ring_reachable = (ring_engine.compute_rings if incremental else compute_rings)(
+            polygon_altitudes, ring_lats, ring_lons, ring_arrival_altitudes, ring_wind_speeds,
+            ring_wind_directions, glide_ratio, safety_margin, Vg, headings, terrain, wind_field,
+            wind_step)
+
+    if wind_field is not None:
+        ring_wind_speeds = [wind_field.max_speed]
+    return merge_ring_bands(ring_vertices, ring_reachable, polygon_altitudes, ring_wind_speeds, Vg,
+                            ring_resolution)
+
+
+def merge_ring_bands(ring_vertices, ring_reachable, polygon_altitudes, wind_speeds, Vg,
+                     ring_resolution=RING_RESOLUTION):
+    """
+    Merge the overlapping rings of each band, as returned by rings.compute_rings.
+
+    Returns:
+    list: One list of merged shapely Polygons per altitude in polygon_altitudes.
+    """
+    # The rings of a location only grow with the altitude as long as no headwind exceeds the
+    # glide speed.
+    nested = bool(np.all(np.diff(polygon_altitudes) > 0) and np.all(np.asarray(wind_speeds) < Vg))
+    reachable_count = int(np.count_nonzero(ring_reachable))
+    metrics.count('gfp_rings_total', ring_reachable.size)
+    metrics.count('gfp_ring_vertices_total', reachable_count * ring_vertices.shape[2])
+    metrics.count('gfp_union_input_polygons_total', reachable_count)
+    with stage('union'):
+        merged_rings = union_bands_parallel(ring_vertices, ring_reachable, nested)
+
+        if ring_resolution == ADAPTIVE:
+            # Drop the vertices that don't change the shape of the rings
+            merged_rings = [[merged_polygon.simplify(RING_SIMPLIFY_TOLERANCE)
+                             for merged_polygon in merged_polygons]
+                            for merged_polygons in merged_rings]
+
+    polygons = [polygon for merged_polygons in merged_rings for polygon in merged_polygons]
+    metrics.count('gfp_union_output_polygons_total', len(polygons))
+    metrics.count('gfp_union_output_vertices_total', int(shapely.get_num_coordinates(polygons).sum()))
+    return merged_rings
+
+
+def ring_geometry_key(center_locations, polygon_altitudes, glide_ratio, safety_margin, Vg,
+                      ring_resolution=RING_RESOLUTION, terrain=terrain_model, wind_field=None):
+    """
+    Return the geometry cache key of the rings for these inputs, without computing them.
+    """
+    inputs = dict(ring_locations=sorted(ring_locations_of(center_locations)),
+                  polygon_altitudes=polygon_altitudes,
+                  glide_ratio=glide_ratio,
+                  safety_margin=safety_margin,
+                  vg=Vg,
+                  ring_resolution=str(ring_resolution))
+    if terrain is not None:
+        inputs['terrain'] = terrain.cache_key
+    if wind_field is not None:
+        inputs['wind_field'] = wind_field.cache_key
+    return canonical_key(**inputs)
+
+
+def ring_geometry(center_locations, polygon_altitudes, glide_ratio, safety_margin, Vg,
+                  ring_resolution=RING_RESOLUTION, terrain=terrain_model, wind_field=None):
+    """
+    Return the merged rings per altitude for the center locations, from the geometry cache
+    when the same rings were computed before.
+    """
+    key = ring_geometry_key(center_locations, polygon_altitudes, glide_ratio, safety_margin, Vg,
+                            ring_resolution, terrain, wind_field)
+    return geometry_cache.get_or_compute(
+        key, lambda: compute_merged_rings(ring_locations_of(center_locations), polygon_altitudes,
+                                          glide_ratio, safety_margin, Vg, ring_resolution,
+                                          terrain=terrain, wind_field=wind_field))
+
+
+def add_ring_polygons(m, polygon_altitudes, merged_rings):
+    """
+    Add every merged ring and its altitude labels to the map as individual folium objects.
+    """
+    for altitude, merged_polygons in zip(polygon_altitudes, merged_rings):
+        for merged_polygon in merged_polygons:
+            # Convert the merged polygon back to a list of points
+            merged_polygon_points = [list(point) for point in merged_polygon.exterior.coords]
+            # Draw the merged polygon on the map
+            folium.Polygon(locations=merged_polygon_points, color=RING_COLOR, fill=False).add_to(m)
+
+            for label_location in ring_label_locations(merged_polygon):
+                # Add a label with the altitude at the label locations
+                folium.Marker(
+                    location=label_location,
+                    icon=DivIcon(
+                        icon_size=(150, 36),
+                        icon_anchor=(0, 0),
+                        html='<div style="%s">%s ft</div>' % (RING_LABEL_STYLE, altitude),
+                    )
+                ).add_to(m)
+
+
 def plot_map(lat1, lon1, glide_ratio, safety_margin, Vg, center_locations, polygon_altitudes, \
-             arrival_altitude_agl, selected_glider, wind_speed, wind_direction):
+             arrival_altitude_agl, selected_glider, wind_speed, wind_direction,
+             ring_resolution=RING_RESOLUTION, ring_output=RING_OUTPUT, wind_field=None):
     """
     Plots a map using Folium library with markers and polygons based on the input parameters.
 
@@ -98,9 +292,16 @@ def plot_map(lat1, lon1, glide_ratio, safety_margin, Vg, center_locations, polyg
     glide_ratio (float): The glide ratio of the aircraft.
     safety_margin (float): The safety margin to be added to the glide range.
     Vg (float): The ground speed of the aircraft.
-    center_locations (list): A list of tuples containing the location information of the center points.
+    center_locations (list): One (lat, lon, wind_speed, wind_direction, arrival_altitude_msl, name,
+      type, description) tuple per center point.
     polygon_altitudes (list): A list of altitudes for which polygons need to be drawn.
     arrival_altitude_agl (float): The arrival altitude above ground level.
+    ring_resolution (float or str): The heading step between ring vertices in degrees, or
+      'adaptive' to add vertices only where the range changes quickly and simplify the rings.
+    ring_output (str): 'geojson' or 'topojson' to embed all rings as one payload that is styled and
+      labelled in the browser, or 'folium' for one folium object per ring and label.
+    wind_field (wind_field.WindField): Forecast winds to use instead of wind_speed and
+      wind_direction.
 
     Returns:
     str: The HTML code for the rendered map.
@@ -117,84 +318,64 @@ def plot_map(lat1, lon1, glide_ratio, safety_margin, Vg, center_locations, polyg
         attr='Esri', name='VFR Sectional', overlay=False, control=True).add_to(m)
     folium.LayerControl().add_to(m)
 
-    for altitude in polygon_altitudes:
-        polygons_points = []
+    merged_rings = ring_geometry(center_locations, polygon_altitudes, glide_ratio, safety_margin,
+                                 Vg, ring_resolution, wind_field=wind_field)
 
-        for lat, lon, polygon_altitude, wind_speed, wind_direction, arrival_altitude_msl, name, type, description in center_locations:
-            folium.Marker(
-                location=[lat, lon],
-                popup=f"{name}\nType: {type}\nArrival Alt: {arrival_altitude_msl}ft\nLocation Alt: {arrival_altitude_msl - arrival_altitude_agl}ft\nDescription: {description}",
-                icon=folium.Icon(icon="plane-arrival", prefix='fa')
-            ).add_to(m)
-            # Only calculate the polygon rings for altitudes above arrival altitude and the location type is not a turnpoint
-            if altitude >= arrival_altitude_msl and type != "T":
-                polygon_points = []
-                for heading in range(0, 360, 10):
-                    range_nm = glide_range(altitude, arrival_altitude_msl, glide_ratio,
-                                           safety_margin, Vg, wind_speed, wind_direction, heading)
-                    new_point = haversine(lon, lat, range_nm, heading)
-                    polygon_points.append(new_point)
-
-                polygons_points.append(polygon_points)
-
-        # Merge the polygons using a union operation
-        merged_polygon = unary_union(
-            [Polygon(polygon_points) for polygon_points in polygons_points])
-
-        # Handle both Polygon and MultiPolygon cases
-        merged_polygons = list(merged_polygon.geoms) if isinstance(merged_polygon,
-                                                                   MultiPolygon) else [
-            merged_polygon]
+    # Every location gets one marker, whatever the number of altitude bands
+    add_location_markers(m, center_locations, arrival_altitude_agl)
 
-        for merged_polygon in merged_polygons:
-            # Only proceed if the geometry is a Polygon
-            if isinstance(merged_polygon, Polygon):
-                # Convert the merged polygon back to a list of points
-                merged_polygon_points = [list(point) for point in merged_polygon.exterior.coords]
-                # Draw the merged polygon on the map
-                folium.Polygon(locations=merged_polygon_points, color='blue', fill=False).add_to(m)
-
-                label_locs = [1, 10, 19, 28]  # bearing of the label locations
-                for loc in label_locs:
-                    # Add a label with the altitude at the label locations
-                    folium.Marker(
-                        location=merged_polygon_points[loc],
-                        icon=DivIcon(
-                            icon_size=(150, 36),
-                            icon_anchor=(0, 0),
-                            html='<div style="font-size: 12pt; color: yellow; text-shadow: -1px 0 black, 0 1px black, 1px 0 black, 0 -1px black;">%s ft</div>' % (
-                                altitude),
-                        )
-                    ).add_to(m)
+    if ring_output in ('geojson', 'topojson'):
+        RingLayer(rings_feature_collection(polygon_altitudes, merged_rings, ring_label_locations),
+                  topojson=ring_output == 'topojson').add_to(m)
+    else:
+        add_ring_polygons(m, polygon_altitudes, merged_rings)
 
     # Display input values on map
     parmsInfobox = get_input_parms_display(selected_glider, glide_ratio, Vg, safety_margin * 100, \
-                                       wind_speed, wind_direction, arrival_altitude_agl)
+                                       wind_speed, wind_direction, arrival_altitude_agl,
+                                       None if wind_field is None else wind_field.name)
     macro = MacroElement()
     macro._template = Template(parmsInfobox)
     m.get_root().add_child(macro)
 
-    return m.get_root().render()
+    with stage('render'):
+        html = m.get_root().render()
+    metrics.observe('gfp_map_html_bytes', len(html))
+    return html
 
 
-def send_email(to_email, subject, content):
-    """Send email using SMTP."""
-    msg = EmailMessage()
-    msg.set_content(content)
-    msg['Subject'] = subject
-    msg['From'] = GMAIL_ADDRESS
-    msg['To'] = to_email
-
-    # Connect to Gmail's SMTP server
-    with smtplib.SMTP_SSL('smtp.gmail.com', 465) as server:
-        server.login(GMAIL_ADDRESS, GMAIL_PASSWORD)
-        server.send_message(msg)
+def plan_map_html(plan, center_locations):
+    """
+    Return the HTML of the map of a flight plan around its center locations.
+    """
+    # Calculate the average latitude and longitude
+    avg_lat, avg_lon = map_center(center_locations)
+
+    # Generate the map using the plan parameters
+    return plot_map(
+        avg_lat,
+        avg_lon,
+        plan.glide_ratio,
+        plan.safety_margin,
+        plan.vg,
+        center_locations,
+        plan.polygon_altitudes(),
+        plan.arrival_altitude,
+        plan.selected_glider,
+        plan.wind_speed,
+        plan.wind_direction,
+        wind_field=plan.wind_field(),
+        )
 
 
 ## Original source from https://nbviewer.org/gist/talbertc-usgs/18f8901fc98f109f2b71156cf3ac81cd
 # and modified as needed
 def get_input_parms_display(selected_glider, glide_ratio, vg, safety_margin, wind_speed,
-                            wind_direction, arrival_altitude_agl):
+                            wind_direction, arrival_altitude_agl, wind_forecast=None):
+    if wind_forecast:
+        wind = f"Wind: forecast {escape(wind_forecast)}"
+    else:
+        wind = f"Wind spd: {wind_speed:.0f}kts at: {wind_direction:.0f}degs"
     template = f"""
         {{% macro html(this, kwargs) %}}
         <!doctype html>
@@ -231,7 +412,7 @@ def get_input_parms_display(selected_glider, glide_ratio, vg, safety_margin, win
           <p>{selected_glider}<br>
           Max L/D: {glide_ratio} at: {vg:.0f} kts<br>
           Safety Margin over best L/D: {safety_margin:.0f}%<br>
-          Wind spd: {wind_speed:.0f}kts at: {wind_direction:.0f}degs<br>
+          {wind}<br>
           Arrival alt: {arrival_altitude_agl:.0f}ft AGL<br>
           <br> Circles show altitude required <br>to reach destination
           </p>
@@ -0,0 +1,173 @@
+import csv
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Directory of gridded wind forecasts, one CSV file per forecast hour; forecasts are off when unset
+WIND_FIELD_DIR = os.environ.get('WIND_FIELD_DIR')
+# Number of forecast hours kept loaded per worker
+WIND_FIELD_CACHE_SIZE = int(os.environ.get('WIND_FIELD_CACHE_SIZE', '4'))
+# Distance in nautical miles between wind samples along each ring heading
+WIND_STEP_NM = float(os.environ.get('WIND_STEP_NM', '1.0'))
+
+WIND_FIELD_EXTENSION = '.csv'
+WIND_FIELD_COLUMNS = ('lat', 'lon', 'altitude', 'wind_speed', 'wind_direction')
+
+
+def wind_components(wind_speeds, wind_directions):
+    """
+    Return the east and north components, in knots, of winds coming from wind_directions.
+    """
+    radians = np.radians(np.asarray(wind_directions, dtype=np.float64))
+    wind_speeds = np.asarray(wind_speeds, dtype=np.float64)
+    return -wind_speeds * np.sin(radians), -wind_speeds * np.cos(radians)
+
+
+def _axis_weights(axis, values):
+    """
+    Return the lower grid index and the weight of the upper one for linear interpolation,
+    holding the values at the edges of the grid outside it.
+    """
+    if axis.size == 1:
+        return np.zeros(values.shape, dtype=np.intp), np.zeros(values.shape)
+    values = np.clip(values, axis[0], axis[-1])
+    lower = np.clip(np.searchsorted(axis, values, side='right') - 1, 0, axis.size - 2)
+    weight = (values - axis[lower]) / (axis[lower + 1] - axis[lower])
+    return lower, weight
+
+
+class WindField:
+    """
+    Winds on a regular latitude x longitude x altitude grid, interpolated linearly in between.
+
+    The winds are kept as east (u) and north (v) components in knots, shape (Z, Y, X) for the
+    ascending altitudes (feet MSL), latitudes and longitudes of the grid.
+    """
+
+    def __init__(self, lats, lons, altitudes, u, v, name=None, version=None):
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.altitudes = np.asarray(altitudes, dtype=np.float64)
+        self.u = np.asarray(u, dtype=np.float64)
+        self.v = np.asarray(v, dtype=np.float64)
+        self.name = name
+        self.version = version
+        self.max_speed = float(np.hypot(self.u, self.v).max()) if self.u.size else 0.0
+
+    @classmethod
+    def from_csv(cls, path):
+        """
+        Load a forecast CSV with one row per grid point and altitude: lat, lon, altitude (feet
+        MSL), wind_speed (knots) and wind_direction (degrees the wind comes from).
+
+        Raises:
+        ValueError: If a column is missing or the points don't fill a regular grid.
+        """
+        with open(path, 'r', newline='') as file:
+            reader = csv.DictReader(file)
+            missing = [column for column in WIND_FIELD_COLUMNS
+                       if column not in (reader.fieldnames or ())]
+            if missing:
+                raise ValueError('%s is missing the columns %s' % (path, ', '.join(missing)))
+            rows = np.array([[float(row[column]) for column in WIND_FIELD_COLUMNS]
+                             for row in reader], dtype=np.float64).reshape(-1, 5)
+
+        lats, lat_index = np.unique(rows[:, 0], return_inverse=True)
+        lons, lon_index = np.unique(rows[:, 1], return_inverse=True)
+        altitudes, altitude_index = np.unique(rows[:, 2], return_inverse=True)
+        shape = (altitudes.size, lats.size, lons.size)
+        if rows.shape[0] == 0 or rows.shape[0] != np.prod(shape):
+            raise ValueError('%s does not hold a complete lat x lon x altitude grid' % path)
+
+        u = np.full(shape, np.nan)
+        v = np.full(shape, np.nan)
+        u[altitude_index, lat_index, lon_index], v[altitude_index, lat_index, lon_index] = \
+            wind_components(rows[:, 3], rows[:, 4])
+        if np.isnan(u).any():
+            raise ValueError('%s lists some grid points twice' % path)
+        name = os.path.splitext(os.path.basename(path))[0]
+        return cls(lats, lons, altitudes, u, v, name=name, version=os.stat(path).st_mtime_ns)
+
+    @property
+    def cache_key(self):
+        """
+        What the rings depend on besides the glide inputs, for ring cache keys.
+        """
+        return [self.name, self.version]
+
+    def wind_at(self, lats, lons, altitudes):
+        """
+        Return the interpolated east and north wind components in knots at every point.
+
+        Parameters:
+        lats, lons, altitudes (array): Points in degrees and feet MSL, all of the same shape.
+
+        Returns:
+        tuple of arrays: u and v, shaped like lats.
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        z0, wz = _axis_weights(self.altitudes, np.asarray(altitudes, dtype=np.float64))
+        y0, wy = _axis_weights(self.lats, lats)
+        x0, wx = _axis_weights(self.lons, np.asarray(lons, dtype=np.float64))
+        z1 = np.minimum(z0 + 1, self.altitudes.size - 1)
+        y1 = np.minimum(y0 + 1, self.lats.size - 1)
+        x1 = np.minimum(x0 + 1, self.lons.size - 1)
+
+        components = []
+        for grid in (self.u, self.v):
+            value = np.zeros(lats.shape)
+            for z, cz in ((z0, 1 - wz), (z1, wz)):
+                for y, cy in ((y0, 1 - wy), (y1, wy)):
+                    for x, cx in ((x0, 1 - wx), (x1, wx)):
+                        value += cz * cy * cx * grid[z, y, x]
+            components.append(value)
+        return components[0], components[1]
+
+    def speed_direction(self, lats, lons, altitudes):
+        """
+        Return the interpolated wind speed in knots and the direction it comes from in degrees.
+        """
+        u, v = self.wind_at(lats, lons, altitudes)
+        return np.hypot(u, v), np.degrees(np.arctan2(-u, -v)) % 360
+
+
+def forecast_hours(directory=WIND_FIELD_DIR):
+    """
+    Return the forecast hours available in the directory, i.e. its CSV file names without the
+    extension, in order.
+    """
+    if not directory or not os.path.isdir(directory):
+        return []
+    return sorted(os.path.splitext(name)[0] for name in os.listdir(directory)
+                  if name.endswith(WIND_FIELD_EXTENSION))
+
+
+_fields = OrderedDict()
+_fields_lock = threading.Lock()
+
+
+def get_wind_field(hour, directory=WIND_FIELD_DIR):
+    """
+    Return the wind field of a forecast hour, loading it on first use and keeping the last
+    WIND_FIELD_CACHE_SIZE hours. A file that changed on disk is loaded again.
+
+    Raises:
+    ValueError: If there is no forecast for that hour.
+    """
+    if hour not in forecast_hours(directory):
+        raise ValueError('No wind forecast for %r' % hour)
+    path = os.path.join(directory, hour + WIND_FIELD_EXTENSION)
+    key = (path, os.stat(path).st_mtime_ns)
+    with _fields_lock:
+        field = _fields.get(key)
+        if field is not None:
+            _fields.move_to_end(key)
+            return field
+    field = WindField.from_csv(path)
+    with _fields_lock:
+        _fields[key] = field
+        while len(_fields) > WIND_FIELD_CACHE_SIZE:
+            _fields.popitem(last=False)
+    return field